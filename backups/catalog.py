@@ -0,0 +1,192 @@
+import bisect
+import difflib
+import os
+import re
+from datetime import datetime
+from config.settings import DUMPS_DIR, ERROR_DUMPS_DIR, CATALOG_INCLUDE_REMOTE, logger
+from backups.compression import ARCHIVE_SUFFIXES
+from storage.remote_index import remote_index
+
+CATALOG_SUFFIXES = ARCHIVE_SUFFIXES + ('.sql',)  # Файлы, которые можно развернуть
+FUZZY_CUTOFF = 0.6  # Минимальное сходство имени для нечёткого поиска (difflib)
+_TIMESTAMP_RE = re.compile(r'_(\d{8}_\d{6})')
+_TOKEN_RE = re.compile(r'[\s_\-.]+')
+
+def _created_at(name):
+    """Время создания по метке в имени архива (<база>_ГГГГММДД_ЧЧММСС); None, если метки нет."""
+    match = _TIMESTAMP_RE.search(name)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        except ValueError:
+            pass
+    return None
+
+class BackupCatalog:
+    """Каталог бэкапов в памяти: поиск по имени за O(1), по префиксу и нечёткий, выборка по базе и дню.
+
+    Каталог обновляется при каждом запросе, но перечитывает только каталоги баз, у которых
+    изменилось время изменения (оно меняется при создании, удалении и переименовании файла).
+    Проверка — один stat на базу, поэтому запрос не обходит тысячи архивов. Архивы, которые
+    есть только на Яндекс.Диске, берутся из локального индекса Диска (CATALOG_INCLUDE_REMOTE).
+    """
+
+    def __init__(self, root, include_remote=False):
+        self._root = root
+        self._include_remote = include_remote
+        self._root_mtime = None
+        self._dirs = {}  # база: (mtime_ns, {имя: запись})
+        self._remote = {}
+        self._remote_version = None
+        self._entries = {}
+        self._by_db = {}
+        self._names = []  # Отсортированные (имя в нижнем регистре, имя) для поиска по префиксу
+
+    def _is_db_dir(self, item):
+        """Каталог базы; служебные каталоги и распакованные для развёртывания дампы (<база>_<метка>) пропускаются."""
+        if not item.is_dir() or item.name.startswith('.') or item.name == ERROR_DUMPS_DIR.name:
+            return False
+        return not _TIMESTAMP_RE.search(item.name)
+
+    def _scan_dir(self, db_dir):
+        entries = {}
+        with os.scandir(db_dir) as it:
+            for item in it:
+                if not item.name.endswith(CATALOG_SUFFIXES) or not item.is_file():
+                    continue
+                created_at = _created_at(item.name)
+                if created_at is None:
+                    try:
+                        created_at = datetime.fromtimestamp(item.stat().st_mtime)
+                    except FileNotFoundError:
+                        continue
+                entries[item.name] = {
+                    'name': item.name,
+                    'db_name': db_dir.name,
+                    'path': db_dir / item.name,
+                    'created_at': created_at,
+                    'local': True,
+                    'remote_path': None
+                }
+        return entries
+
+    def _refresh_local(self):
+        changed = False
+        root_mtime = os.stat(self._root).st_mtime_ns
+        names = self._dirs.keys()
+        if root_mtime != self._root_mtime:
+            self._root_mtime = root_mtime
+            names = [item.name for item in os.scandir(self._root) if self._is_db_dir(item)]
+            for name in set(self._dirs) - set(names):
+                del self._dirs[name]
+                changed = True
+        for name in list(names):
+            db_dir = self._root / name
+            try:
+                mtime = os.stat(db_dir).st_mtime_ns
+            except FileNotFoundError:
+                self._dirs.pop(name, None)
+                changed = True
+                continue
+            cached = self._dirs.get(name)
+            if cached is None or cached[0] != mtime:
+                self._dirs[name] = (mtime, self._scan_dir(db_dir))
+                changed = True
+        return changed
+
+    def _refresh_remote(self):
+        if not self._include_remote or remote_index.version == self._remote_version:
+            return False
+        self._remote_version = remote_index.version
+        self._remote = {}
+        for entry in remote_index.files():
+            parts = entry['path'].rsplit('/', 2)
+            name = parts[-1]
+            if len(parts) < 3 or not name.endswith(CATALOG_SUFFIXES):
+                continue
+            self._remote[name] = {
+                'name': name,
+                'db_name': parts[-2],
+                'path': None,
+                'created_at': _created_at(name) or datetime.fromisoformat(entry['modified']).astimezone().replace(tzinfo=None),
+                'local': False,
+                'remote_path': entry['path']
+            }
+        return True
+
+    def refresh(self):
+        """Обновление каталога; полная перестройка индексов только при изменениях."""
+        local_changed = self._refresh_local()
+        remote_changed = self._refresh_remote()
+        if not local_changed and not remote_changed and self._entries:
+            return
+        entries = dict(self._remote)
+        for _, dir_entries in self._dirs.values():
+            for name, entry in dir_entries.items():
+                remote = entries.get(name)
+                entries[name] = {**entry, 'remote_path': remote['remote_path']} if remote else entry
+        by_db = {}
+        for entry in entries.values():
+            by_db.setdefault(entry['db_name'], []).append(entry)
+        for db_entries in by_db.values():
+            db_entries.sort(key=lambda entry: (entry['created_at'], entry['name']), reverse=True)
+        self._entries = entries
+        self._by_db = by_db
+        self._names = sorted((name.lower(), name) for name in entries)
+        logger.debug(f"Каталог бэкапов обновлён: баз {len(by_db)}, бэкапов {len(entries)}")
+
+    def get(self, name):
+        """Бэкап по точному имени файла или None."""
+        self.refresh()
+        return self._entries.get(name)
+
+    def databases(self):
+        """Базы с бэкапами: [(база, число бэкапов)] по имени базы."""
+        self.refresh()
+        return sorted((db_name, len(entries)) for db_name, entries in self._by_db.items())
+
+    def days(self, db_name):
+        """Дни с бэкапами базы, новые первыми: [(дата, число бэкапов)]."""
+        self.refresh()
+        counts = {}
+        for entry in self._by_db.get(db_name, []):
+            day = entry['created_at'].date()
+            counts[day] = counts.get(day, 0) + 1
+        return sorted(counts.items(), reverse=True)
+
+    def archives(self, db_name, day=None):
+        """Бэкапы базы (за день, если он указан), новые первыми."""
+        self.refresh()
+        entries = self._by_db.get(db_name, [])
+        if day is None:
+            return list(entries)
+        return [entry for entry in entries if entry['created_at'].date() == day]
+
+    def search(self, query, limit=10):
+        """Поиск бэкапов: по префиксу имени, затем по всем словам запроса, затем нечёткий.
+
+        Результаты каждого шага — новые первыми; следующий шаг выполняется, только если
+        предыдущий ничего не нашёл.
+        """
+        self.refresh()
+        query = query.strip().lower()
+        if not query:
+            return []
+        start = bisect.bisect_left(self._names, (query,))
+        matches = []
+        for index in range(start, len(self._names)):
+            lower, name = self._names[index]
+            if not lower.startswith(query):
+                break
+            matches.append(self._entries[name])
+        if not matches:
+            tokens = [token for token in _TOKEN_RE.split(query) if token]
+            matches = [self._entries[name] for lower, name in self._names if all(token in lower for token in tokens)]
+        if matches:
+            matches.sort(key=lambda entry: (entry['created_at'], entry['name']), reverse=True)
+            return matches[:limit]
+        close = difflib.get_close_matches(query, [lower for lower, _ in self._names], n=limit, cutoff=FUZZY_CUTOFF)
+        lookup = dict(self._names)
+        return [self._entries[lookup[lower]] for lower in close]
+
+backup_catalog = BackupCatalog(DUMPS_DIR, include_remote=CATALOG_INCLUDE_REMOTE)
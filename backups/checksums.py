@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+from datetime import datetime
+from config.settings import logger
+
+CHECKSUMS_SUFFIX = '.checksums.json'  # Файл рядом с архивом: <архив>.checksums.json
+
+class ChecksumHasher:
+    """SHA-256 и MD5 архива, считаемые по ходу записи или чтения."""
+
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self._md5 = hashlib.md5()
+        self.size = 0
+
+    def update(self, data):
+        self._sha256.update(data)
+        self._md5.update(data)
+        self.size += len(data)
+
+    def result(self):
+        return {
+            'sha256': self._sha256.hexdigest(),
+            'md5': self._md5.hexdigest(),
+            'size': self.size
+        }
+
+class HashingFile:
+    """Файл архива, для которого контрольные суммы считаются при записи.
+
+    seek не поддерживается, поэтому zipfile пишет архив последовательно и каждый байт
+    проходит через хэш ровно один раз, в том порядке, в котором окажется в файле.
+    """
+
+    def __init__(self, fileobj):
+        self._file = fileobj
+        self.hasher = ChecksumHasher()
+
+    def write(self, data):
+        self._file.write(data)
+        self.hasher.update(data)
+        return len(data)
+
+    def tell(self):
+        return self.hasher.size
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def checksums_path(archive_file):
+    """Путь файла контрольных сумм архива."""
+    return archive_file.with_name(f"{archive_file.name}{CHECKSUMS_SUFFIX}")
+
+def save_checksums(archive_file, hasher):
+    """Атомарная запись контрольных сумм рядом с архивом."""
+    path = checksums_path(archive_file)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps({
+        **hasher.result(),
+        'computed_at': datetime.now().isoformat(timespec='seconds')
+    }, ensure_ascii=False), encoding='utf-8')
+    os.replace(tmp_path, path)
+    logger.debug(f"Контрольные суммы {archive_file.name}: sha256 {hasher.result()['sha256']}")
+
+def load_checksums(archive_file):
+    """Контрольные суммы архива; None, если их нет или архив изменился после подсчёта."""
+    path = checksums_path(archive_file)
+    if not path.exists():
+        return None
+    try:
+        checksums = json.loads(path.read_text(encoding='utf-8'))
+    except ValueError as e:
+        logger.warning(f"Повреждён файл контрольных сумм {path}: {e}")
+        return None
+    if not archive_file.exists() or checksums.get('size') != archive_file.stat().st_size:
+        return None
+    return checksums
+
+def discard_checksums(archive_file):
+    """Удаление устаревших контрольных сумм (архив дописан или удалён)."""
+    checksums_path(archive_file).unlink(missing_ok=True)
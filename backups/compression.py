@@ -0,0 +1,254 @@
+import gzip
+import struct
+import time
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from config.settings import ARCHIVE_CODEC, ARCHIVE_COMPRESS_LEVEL, COMPRESS_THREADS, logger
+from backups.dedup import ChunkedDumpWriter, ChunkedDumpReader, MANIFEST_SUFFIX
+
+# Суффиксы архивов и сигнатуры, по которым формат определяется при развёртывании
+CODEC_SUFFIXES = {
+    'zip': '.zip',
+    'zstd': '.sql.zst',
+    'gzip': '.sql.gz',
+    'chunked': MANIFEST_SUFFIX
+}
+CODEC_MAGIC = {
+    b'PK\x03\x04': 'zip',
+    b'\x28\xb5\x2f\xfd': 'zstd',
+    b'\x1f\x8b': 'gzip'
+}
+ARCHIVE_SUFFIXES = ('.zip', '.zst', '.gz', MANIFEST_SUFFIX)
+DEFAULT_LEVELS = {
+    'zip': 6,
+    'zstd': 3,
+    'gzip': 6
+}
+# Допустимые уровни: zip и gzip сжимает zlib (0-9), zstd — 1-22
+LEVEL_RANGES = {
+    'zip': (0, 9),
+    'zstd': (1, 22),
+    'gzip': (0, 9)
+}
+GZIP_BLOCK_SIZE = 1024 * 1024  # Размер блока для параллельного gzip
+GZIP_WINDOW = 32 * 1024  # Хвост предыдущего блока используется как словарь следующего
+
+def resolve_codec(codec=None, storage_mode=None):
+    """Выбор кодека с откатом на zip, если нужная библиотека не установлена."""
+    if storage_mode == 'dedup':
+        return 'chunked'
+    codec = (codec or ARCHIVE_CODEC or 'zip').lower()
+    if codec not in CODEC_SUFFIXES:
+        logger.warning(f"Неизвестный кодек сжатия {codec}, используется zip")
+        return 'zip'
+    if codec == 'zstd':
+        try:
+            _zstandard()
+        except RuntimeError as e:
+            logger.warning(f"{e}, используется zip")
+            return 'zip'
+    return codec
+
+def _zstandard():
+    """Модуль zstandard: импортируется при первом обращении, zstd необязателен (без него доступны zip и gzip)."""
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("Для кодека zstd требуется библиотека zstandard (pip install zstandard)") from None
+    return zstandard
+
+def archive_suffix(codec):
+    """Суффикс файла архива для кодека."""
+    return CODEC_SUFFIXES[codec]
+
+def detect_codec(path):
+    """Определение формата архива по сигнатуре (None для несжатого дампа)."""
+    if path.suffix == MANIFEST_SUFFIX:
+        return 'chunked'
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    for magic, codec in CODEC_MAGIC.items():
+        if head.startswith(magic):
+            return codec
+    return None
+
+def _deflate_block(block, level, dictionary):
+    """Сжатие блока в raw deflate с выравниванием по байту (как в pigz)."""
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+class ParallelGzipWriter:
+    """Многопоточный gzip: блоки сжимаются параллельно и склеиваются в один поток deflate."""
+
+    def __init__(self, path, level, threads, fileobj=None):
+        self._file = fileobj or open(path, 'wb')
+        self._level = level
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._max_pending = threads * 2
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._dictionary = b''
+        self._crc = 0
+        self._size = 0
+        # Заголовок gzip: метод deflate, без флагов, время изменения, ОС Unix
+        self._file.write(b'\x1f\x8b\x08\x00' + struct.pack('<I', int(time.time())) + b'\x00\x03')
+
+    def _submit(self, block):
+        self._pending.append(self._executor.submit(_deflate_block, block, self._level, self._dictionary))
+        self._dictionary = block[-GZIP_WINDOW:]
+        while len(self._pending) > self._max_pending:
+            self._file.write(self._pending.popleft().result())
+
+    def write(self, data):
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= GZIP_BLOCK_SIZE:
+            block = bytes(self._buffer[:GZIP_BLOCK_SIZE])
+            del self._buffer[:GZIP_BLOCK_SIZE]
+            self._submit(block)
+        return len(data)
+
+    def close(self):
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._file.write(self._pending.popleft().result())
+            # Пустой финальный блок и трейлер gzip (CRC32 и размер по модулю 2^32)
+            self._file.write(zlib.compressobj(self._level, zlib.DEFLATED, -zlib.MAX_WBITS).flush(zlib.Z_FINISH))
+            self._file.write(struct.pack('<II', self._crc & 0xffffffff, self._size & 0xffffffff))
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._file.close()
+
+class _ZipMemberWriter:
+    """Запись дампа единственным файлом внутри ZIP-архива."""
+
+    def __init__(self, path, arcname, level, fileobj=None):
+        compression = zipfile.ZIP_STORED if level == 0 else zipfile.ZIP_DEFLATED
+        # В поток без seek zipfile пишет размеры в дескриптор данных после файла
+        self._fileobj = fileobj
+        self._archive = zipfile.ZipFile(fileobj or path, 'w', compression, compresslevel=level or None)
+        self._member = self._archive.open(arcname, 'w', force_zip64=True)
+
+    def write(self, data):
+        return self._member.write(data)
+
+    def add_entry(self, name, data):
+        """Служебный файл после дампа, пока архив не закрыт (дописывать архив после закрытия не нужно)."""
+        self._member.close()
+        self._archive.writestr(name, data)
+
+    def close(self):
+        try:
+            self._member.close()
+        finally:
+            self._archive.close()
+            if self._fileobj is not None:
+                self._fileobj.close()
+
+class _ZstdWriter:
+    """Многопоточное сжатие zstd в один кадр."""
+
+    def __init__(self, path, level, threads, fileobj=None):
+        self._file = fileobj or open(path, 'wb')
+        compressor = _zstandard().ZstdCompressor(level=level, threads=threads)
+        self._writer = compressor.stream_writer(self._file, closefd=False)
+
+    def write(self, data):
+        return self._writer.write(data)
+
+    def close(self):
+        try:
+            self._writer.close()
+        finally:
+            self._file.close()
+
+def compress_level(codec, level=None):
+    """Уровень сжатия для кодека: общий ARCHIVE_COMPRESS_LEVEL или уровень базы, приведённый к диапазону кодека.
+
+    Один уровень задаётся для всех кодеков, а zstd-уровень выше 9 (например, при откате zstd на zip
+    или для gzip-сегментов) zlib не принимает.
+    """
+    if level is None:
+        level = ARCHIVE_COMPRESS_LEVEL if ARCHIVE_COMPRESS_LEVEL is not None else DEFAULT_LEVELS.get(codec, 6)
+    low, high = LEVEL_RANGES.get(codec, LEVEL_RANGES['zip'])
+    if not low <= level <= high:
+        clamped = min(max(level, low), high)
+        logger.debug(f"Уровень сжатия {level} вне диапазона {low}-{high} кодека {codec}, используется {clamped}")
+        level = clamped
+    return level
+
+def open_dump_writer(path, arcname, codec='zip', level=None, fileobj=None):
+    """Открытие архива на запись; level=0 для zip сохраняет данные без сжатия.
+
+    fileobj — поток вместо файла path (например, запись с одновременной загрузкой),
+    для кодека chunked не поддерживается.
+    """
+    level = compress_level(codec, level)
+    threads = max(1, COMPRESS_THREADS)
+    logger.debug(f"Сжатие {path}: кодек {codec}, уровень {level}, потоков {threads}")
+    if codec == 'zstd':
+        return _ZstdWriter(path, level, threads, fileobj)
+    if codec == 'gzip':
+        return ParallelGzipWriter(path, level, threads, fileobj)
+    if codec == 'chunked':
+        if fileobj is not None:
+            raise ValueError("Кодек chunked не поддерживает запись в поток")
+        return ChunkedDumpWriter(path, arcname)
+    return _ZipMemberWriter(path, arcname, level, fileobj)
+
+class _ZipMemberReader:
+    """Чтение единственного .sql файла из ZIP-архива."""
+
+    def __init__(self, path, fileobj=None):
+        self._archive = zipfile.ZipFile(fileobj or path, 'r')
+        sql_files = [name for name in self._archive.namelist() if name.endswith('.sql')]
+        if len(sql_files) != 1:
+            self._archive.close()
+            raise ValueError(f"ZIP-архив {path.name} должен содержать ровно один .sql файл, найдено: {len(sql_files)}")
+        self.name = sql_files[0]
+        self._member = self._archive.open(self.name, 'r')
+
+    def read(self, size=-1):
+        return self._member.read(size)
+
+    def close(self):
+        try:
+            self._member.close()
+        finally:
+            self._archive.close()
+
+def open_dump_reader(path, fileobj=None):
+    """Открытие дампа на чтение с распаковкой по сигнатуре архива.
+
+    fileobj — уже открытый файл архива (например, со счётчиком прочитанных байт); закрывает его вызывающий.
+    Манифест чанков всегда читается по пути.
+    """
+    codec = detect_codec(path)
+    if codec == 'zip':
+        return _ZipMemberReader(path, fileobj)
+    if codec == 'zstd':
+        return _zstandard().ZstdDecompressor().stream_reader(
+            fileobj or open(path, 'rb'), read_across_frames=True, closefd=fileobj is None
+        )
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj) if fileobj else gzip.open(path, 'rb')
+    if codec == 'chunked':
+        return ChunkedDumpReader(path)
+    return fileobj or open(path, 'rb')
+
+def dump_name_from_archive(path):
+    """Имя .sql дампа для архива .sql.zst / .sql.gz или манифеста чанков."""
+    name = path.name
+    for suffix in ('.zst', '.gz', MANIFEST_SUFFIX):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name if name.endswith('.sql') else f"{name}.sql"
@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import time
+import zlib
+from config.settings import DUMPS_DIR, logger
+
+CHUNK_STORE_DIR = DUMPS_DIR / '.chunks'
+MANIFEST_SUFFIX = '.chunks'
+MIN_CHUNK_SIZE = 256 * 1024
+AVG_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_COMPRESS_LEVEL = 6
+CHUNK_GC_GRACE_SECONDS = 86400  # Свежие чанки не удаляются: на них может сослаться дамп в процессе записи
+# Вероятность границы на байт строки: ожидаемый размер чанка не зависит от длины строк
+_CUT_THRESHOLD_PER_BYTE = (1 << 32) // (AVG_CHUNK_SIZE - MIN_CHUNK_SIZE)
+
+class ContentChunker:
+    """Разбиение потока дампа на чанки с границами, зависящими только от содержимого.
+
+    Границы ставятся на концах строк: строка становится границей, если CRC32 её
+    содержимого меньше порога, пропорционального её длине. Вставка или удаление
+    строк сдвигает только соседние границы, остальные чанки совпадают с прошлым дампом.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._resume = 0  # Начало строки, с которой продолжится поиск границы
+
+    def _find_cut(self):
+        """Позиция конца очередного чанка в буфере или None, если данных мало."""
+        buffer = self._buffer
+        line_start = self._resume or buffer.rfind(b'\n', 0, MIN_CHUNK_SIZE) + 1
+        limit = min(len(buffer), MAX_CHUNK_SIZE)
+        while True:
+            line_end = buffer.find(b'\n', max(line_start, MIN_CHUNK_SIZE - 1), limit)
+            if line_end == -1:
+                break
+            line_end += 1
+            line_length = line_end - line_start
+            if zlib.crc32(buffer[line_start:line_end]) < line_length * _CUT_THRESHOLD_PER_BYTE:
+                return line_end
+            line_start = line_end
+        if len(buffer) >= MAX_CHUNK_SIZE:
+            # Длинные строки или бинарные данные: принудительная граница
+            return MAX_CHUNK_SIZE
+        self._resume = line_start
+        return None
+
+    def feed(self, data):
+        """Добавление данных, возвращает список готовых чанков."""
+        self._buffer += data
+        chunks = []
+        while len(self._buffer) >= MIN_CHUNK_SIZE:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            chunks.append(bytes(self._buffer[:cut]))
+            del self._buffer[:cut]
+            self._resume = 0
+        return chunks
+
+    def finish(self):
+        """Остаток потока после последней границы."""
+        chunks = self.feed(b'')
+        if self._buffer:
+            chunks.append(bytes(self._buffer))
+            self._buffer.clear()
+        return chunks
+
+def chunk_path(chunk_id):
+    """Путь к чанку в локальном хранилище."""
+    return CHUNK_STORE_DIR / chunk_id[:2] / chunk_id
+
+def store_chunk(chunk):
+    """Сохранение чанка, если его ещё нет в хранилище. Возвращает (id, новый ли чанк)."""
+    chunk_id = hashlib.sha256(chunk).hexdigest()
+    path = chunk_path(chunk_id)
+    if path.exists():
+        os.utime(path)
+        return chunk_id, False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{chunk_id}.tmp{os.getpid()}")
+    with open(tmp_path, 'wb') as f:
+        f.write(zlib.compress(chunk, CHUNK_COMPRESS_LEVEL))
+    os.replace(tmp_path, path)
+    return chunk_id, True
+
+def load_chunk(chunk_id):
+    """Чтение чанка с проверкой контрольной суммы."""
+    with open(chunk_path(chunk_id), 'rb') as f:
+        chunk = zlib.decompress(f.read())
+    if hashlib.sha256(chunk).hexdigest() != chunk_id:
+        raise ValueError(f"Чанк {chunk_id} повреждён")
+    return chunk
+
+def read_manifest(path):
+    """Чтение манифеста дедуплицированного бэкапа."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class ChunkedDumpWriter:
+    """Запись дампа в хранилище чанков; сам бэкап — небольшой манифест со списком чанков."""
+
+    def __init__(self, path, arcname):
+        self._path = path
+        self._arcname = arcname
+        self._chunker = ContentChunker()
+        self._hash = hashlib.sha256()
+        self._chunks = []
+        self._size = 0
+        self._new_chunks = 0
+        self._new_bytes = 0
+
+    def _store(self, chunks):
+        for chunk in chunks:
+            chunk_id, is_new = store_chunk(chunk)
+            self._chunks.append([chunk_id, len(chunk)])
+            if is_new:
+                self._new_chunks += 1
+                self._new_bytes += len(chunk)
+
+    def write(self, data):
+        self._hash.update(data)
+        self._size += len(data)
+        self._store(self._chunker.feed(data))
+        return len(data)
+
+    def close(self):
+        self._store(self._chunker.finish())
+        manifest = {
+            'format': 'chunked',
+            'version': 1,
+            'member': self._arcname,
+            'size': self._size,
+            'sha256': self._hash.hexdigest(),
+            'chunks': self._chunks
+        }
+        tmp_path = self._path.with_name(f"{self._path.name}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, separators=(',', ':'))
+        os.replace(tmp_path, self._path)
+        logger.info(
+            f"Манифест {self._path.name}: {len(self._chunks)} чанков, новых {self._new_chunks} "
+            f"({self._new_bytes / 1_048_576:.2f} МБ из {self._size / 1_048_576:.2f} МБ)"
+        )
+
+class ChunkedDumpReader:
+    """Потоковая сборка исходного дампа из чанков манифеста."""
+
+    def __init__(self, path):
+        self.manifest = read_manifest(path)
+        self.name = self.manifest['member']
+        self._chunks = iter(self.manifest['chunks'])
+        self._hash = hashlib.sha256()
+        self._pending = b''
+        self._eof = False
+
+    def _next_chunk(self):
+        try:
+            chunk_id, _ = next(self._chunks)
+        except StopIteration:
+            self._eof = True
+            if self._hash.hexdigest() != self.manifest['sha256']:
+                raise ValueError(f"Контрольная сумма собранного дампа {self.name} не совпадает с манифестом")
+            return b''
+        chunk = load_chunk(chunk_id)
+        self._hash.update(chunk)
+        return chunk
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self._pending]
+            while not self._eof:
+                parts.append(self._next_chunk())
+            self._pending = b''
+            return b''.join(parts)
+        while len(self._pending) < size and not self._eof:
+            self._pending += self._next_chunk()
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    def close(self):
+        self._pending = b''
+
+def referenced_chunks(manifest_paths):
+    """Множество чанков, на которые ссылаются манифесты."""
+    referenced = set()
+    for path in manifest_paths:
+        try:
+            referenced.update(chunk_id for chunk_id, _ in read_manifest(path)['chunks'])
+        except Exception as e:
+            logger.error(f"Не удалось прочитать манифест {path}: {e}")
+            raise
+    return referenced
+
+def collect_garbage_chunks():
+    """Удаление локальных чанков, на которые не ссылается ни один манифест."""
+    if not CHUNK_STORE_DIR.exists():
+        return 0
+    referenced = referenced_chunks(DUMPS_DIR.glob(f'*/*{MANIFEST_SUFFIX}'))
+    threshold = time.time() - CHUNK_GC_GRACE_SECONDS
+    removed = 0
+    for path in CHUNK_STORE_DIR.glob('??/*'):
+        if path.name not in referenced and path.stat().st_mtime < threshold:
+            path.unlink()
+            removed += 1
+    logger.info(f"Удалено неиспользуемых чанков: {removed}")
+    return removed
@@ -0,0 +1,64 @@
+import asyncio
+import heapq
+import itertools
+from collections import Counter
+from contextlib import asynccontextmanager
+from config.settings import BACKUP_MAX_CONCURRENCY, BACKUP_MAX_PER_HOST, logger
+
+class DumpLimiter:
+    """Ограничение одновременных дампов: общее и на каждый сервер БД, с учётом приоритетов."""
+
+    def __init__(self, max_total, max_per_host):
+        self.max_total = max(1, max_total)
+        self.max_per_host = max(1, max_per_host)
+        self._running_total = 0
+        self._running_hosts = Counter()
+        self._waiters = []  # Куча (приоритет, порядковый номер, хост, future)
+        self._seq = itertools.count()
+
+    def _grant(self):
+        """Выдача свободных слотов ожидающим задачам в порядке приоритета."""
+        busy_host_waiters = []
+        while self._waiters and self._running_total < self.max_total:
+            waiter = heapq.heappop(self._waiters)
+            _, _, host, future = waiter
+            if future.done():
+                continue
+            if self._running_hosts[host] >= self.max_per_host:
+                # Сервер занят — задача ждёт, слот получает следующая по приоритету
+                busy_host_waiters.append(waiter)
+                continue
+            self._running_total += 1
+            self._running_hosts[host] += 1
+            future.set_result(None)
+        for waiter in busy_host_waiters:
+            heapq.heappush(self._waiters, waiter)
+
+    def _release(self, host):
+        """Освобождение слота и передача его следующей задаче."""
+        self._running_total -= 1
+        self._running_hosts[host] -= 1
+        if not self._running_hosts[host]:
+            del self._running_hosts[host]
+        self._grant()
+
+    @asynccontextmanager
+    async def slot(self, host, priority=100):
+        """Ожидание слота для дампа на сервере host (меньшее значение priority — раньше)."""
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), host, future))
+        self._grant()
+        if not future.done():
+            logger.debug(f"Дамп на {host} (приоритет {priority}) ожидает свободного слота")
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release(host)
+            raise
+        try:
+            yield
+        finally:
+            self._release(host)
+
+dump_limiter = DumpLimiter(BACKUP_MAX_CONCURRENCY, BACKUP_MAX_PER_HOST)
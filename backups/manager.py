@@ -1,110 +1,96 @@
-from config.settings import POSTGRES_DBS, MYSQL_DBS, MARIADB_DBS, logger, DUMPS_DIR
+from config.settings import POSTGRES_DBS, MYSQL_DBS, MARIADB_DBS, logger, DUMPS_DIR, DEFAULT_DB_PRIORITY
 from backups.postgres import process_postgres_db
 from backups.mysql import process_mysql_db
 from backups.mariadb import process_mariadb_db
+from backups.limiter import dump_limiter
+from backups.scheduler import BackupScheduler
 from storage.file_exchange import upload_to_file_exchange
 from pathlib import Path
 import asyncio
 
-async def backup_job():
-    """Запуск запланированного бэкапа последовательно."""
-    logger.info("Запуск запланированного бэкапа")
+DB_PROCESSORS = {
+    'PostgreSQL': process_postgres_db,
+    'MySQL': process_mysql_db,
+    'MariaDB': process_mariadb_db
+}
+
+MANUAL_BACKUP_PRIORITY = 0  # Бэкап по запросу из бота не ждёт плановые дампы
+
+def _configured_dbs():
+    """Все настроенные базы в порядке конфигурации: (конфиг, тип)."""
+    return (
+        [(db, 'PostgreSQL') for db in POSTGRES_DBS] +
+        [(db, 'MySQL') for db in MYSQL_DBS] +
+        [(db, 'MariaDB') for db in MARIADB_DBS]
+    )
+
+def _db_name(db_config):
+    """Имя базы из конфига PostgreSQL или MySQL/MariaDB."""
+    return db_config.get('dbname', db_config.get('database'))
+
+async def _run_dump(db_config, db_type, is_manual, priority=None):
+    """Дамп базы в слоте с ограничением общей и per-host параллельности."""
+    host = f"{db_config['host']}:{db_config['port']}"
+    if priority is None:
+        priority = db_config.get('priority', DEFAULT_DB_PRIORITY)
+    async with dump_limiter.slot(host, priority):
+        logger.debug(f"Старт дампа {db_type} {_db_name(db_config)} на {host} (приоритет {priority})")
+        return await DB_PROCESSORS[db_type](db_config, is_manual=is_manual)
+
+async def _gather_backups(jobs, runner):
+    """Параллельный запуск runner для всех баз, результаты в порядке конфигурации."""
+    outcomes = await asyncio.gather(*(runner(db, db_type) for db, db_type in jobs), return_exceptions=True)
     results = []
-    
-    for db in POSTGRES_DBS:
-        try:
-            result = await process_postgres_db(db, is_manual=False)
-            if result:
-                results.append(result)
-        except Exception as e:
-            logger.error(f"Ошибка обработки PostgreSQL базы {db['dbname']}: {e}")
-    
-    for db in MYSQL_DBS:
-        try:
-            result = await process_mysql_db(db, is_manual=False)
-            if result:
-                results.append(result)
-        except Exception as e:
-            logger.error(f"Ошибка обработки MySQL базы {db['database']}: {e}")
-    
-    for db in MARIADB_DBS:
-        try:
-            result = await process_mariadb_db(db, is_manual=False)
-            if result:
-                results.append(result)
-        except Exception as e:
-            logger.error(f"Ошибка обработки MariaDB базы {db['database']}: {e}")
-    
-    logger.info("Запланированный бэкап завершён")
+    for (db, db_type), outcome in zip(jobs, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error(f"Ошибка обработки {db_type} базы {_db_name(db)}: {outcome}")
+        elif outcome:
+            results.append(outcome)
+        else:
+            logger.warning(f"Бэкап для {db_type} {_db_name(db)} не создан")
     return results
 
+async def run_scheduled_backups():
+    """Запуск бэкапов по расписаниям баз (вместо общего интервала DUMP_INTERVAL_HOURS)."""
+    jobs = [(db, db_type, _db_name(db)) for db, db_type in _configured_dbs()]
+
+    async def runner(db, db_type):
+        return await _run_dump(db, db_type, is_manual=False)
+
+    await BackupScheduler(jobs, runner).run()
+
 async def create_backup_now():
     """Создание бэкапа по запросу с загрузкой на файлообменник."""
     logger.info("Запуск бэкапа по запросу")
-    results = []
-    
-    for db in POSTGRES_DBS:
-        try:
-            result = await process_postgres_db(db, is_manual=True)
-            if result:
-                zip_file = DUMPS_DIR / db['dbname'] / result['archive']
-                download_url = await upload_to_file_exchange(zip_file)
-                result['download_url'] = download_url
-                results.append(result)
-            else:
-                logger.warning(f"Бэкап для PostgreSQL {db['dbname']} не создан")
-        except Exception as e:
-            logger.error(f"Ошибка создания бэкапа PostgreSQL {db['dbname']}: {e}")
-    
-    for db in MYSQL_DBS:
-        try:
-            result = await process_mysql_db(db, is_manual=True)
-            if result:
-                zip_file = DUMPS_DIR / db['database'] / result['archive']
-                download_url = await upload_to_file_exchange(zip_file)
-                result['download_url'] = download_url
-                results.append(result)
-            else:
-                logger.warning(f"Бэкап для MySQL {db['database']} не создан")
-        except Exception as e:
-            logger.error(f"Ошибка создания бэкапа MySQL {db['database']}: {e}")
-    
-    for db in MARIADB_DBS:
-        try:
-            result = await process_mariadb_db(db, is_manual=True)
-            if result:
-                zip_file = DUMPS_DIR / db['database'] / result['archive']
-                download_url = await upload_to_file_exchange(zip_file)
-                result['download_url'] = download_url
-                results.append(result)
-            else:
-                logger.warning(f"Бэкап для MariaDB {db['database']} не создан")
-        except Exception as e:
-            logger.error(f"Ошибка создания бэкапа MariaDB {db['database']}: {e}")
-    
+
+    async def runner(db, db_type):
+        result = await _run_dump(db, db_type, is_manual=True)
+        if result and 'download_url' not in result:
+            # Архив прошлого бэкапа (дамп пропущен) загружается отдельно
+            zip_file = DUMPS_DIR / result['database'] / result['archive']
+            result['download_url'] = await upload_to_file_exchange(zip_file)
+        return result
+
+    results = await _gather_backups(_configured_dbs(), runner)
     logger.info("Бэкап по запросу завершён")
     return results
 
 async def create_backup_for_db(db_config, db_type):
     """Создание бэкапа для одной базы."""
-    db_name = db_config.get('dbname', db_config.get('database'))
+    db_name = _db_name(db_config)
     logger.info(f"Запуск бэкапа для базы {db_name} ({db_type})")
     try:
-        if db_type == 'PostgreSQL':
-            result = await process_postgres_db(db_config, is_manual=True)
-        elif db_type == 'MySQL':
-            result = await process_mysql_db(db_config, is_manual=True)
-        elif db_type == 'MariaDB':
-            result = await process_mariadb_db(db_config, is_manual=True)
-        else:
+        if db_type not in DB_PROCESSORS:
             logger.error(f"Неизвестный тип базы: {db_type}")
             return None
-        
+        result = await _run_dump(db_config, db_type, is_manual=True, priority=MANUAL_BACKUP_PRIORITY)
+
         if result:
-            zip_file = DUMPS_DIR / result['database'] / result['archive']
-            logger.debug(f"Загрузка архива {zip_file} на файлообменник")
-            download_url = await upload_to_file_exchange(zip_file)
-            result['download_url'] = download_url
+            if 'download_url' not in result:
+                # Ссылка файлообменника приходит из общей загрузки в хранилища; здесь — для пропущенного дампа
+                zip_file = DUMPS_DIR / result['database'] / result['archive']
+                logger.debug(f"Загрузка архива {zip_file} на файлообменник")
+                result['download_url'] = await upload_to_file_exchange(zip_file)
             logger.info(f"Бэкап для {result['database']} завершён успешно")
             return result
         else:
@@ -112,4 +98,4 @@ async def create_backup_for_db(db_config, db_type):
             return None
     except Exception as e:
         logger.error(f"Ошибка создания бэкапа {db_type} {db_name}: {e}")
-        return None
\ No newline at end of file
+        return None
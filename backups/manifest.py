@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime
+from config.settings import logger
+
+BACKUP_MANIFEST_SUFFIX = '.manifest.json'  # Описание бэкапа рядом с архивом: <архив>.manifest.json
+MANIFEST_VERSION = 1
+INDEX_TAIL_BYTES = 1024  # Хвост предыдущего блока: начало строки с именем таблицы на границе блоков
+
+# Строки дампа, с которых начинаются описание и данные таблицы (pg_dump и mysqldump)
+_TABLE_LINE_RE = re.compile(rb'\n(CREATE TABLE|COPY|INSERT INTO) ((?:"[^"\n]+"|`[^`\n]+`|[\w.$])+)[ (]')
+
+def _table_name(raw):
+    """Имя таблицы без схемы public и кавычек."""
+    name = raw.decode('utf-8', errors='replace')
+    if name.startswith('public.'):
+        name = name[len('public.'):]
+    return name.strip('"`')
+
+class DumpIndexer:
+    """SHA-256 несжатого дампа и смещения таблиц, считаемые по ходу записи.
+
+    Смещение таблицы — позиция строки CREATE TABLE, смещение данных — первой строки
+    COPY или INSERT INTO этой таблицы в несжатом дампе. Поиск идёт по байтам, поэтому
+    кодировка дампа не важна.
+    """
+
+    def __init__(self):
+        self._sha256 = hashlib.sha256()
+        self._tail = b'\n'  # Первая строка дампа тоже начинается «после перевода строки»
+        self.size = 0
+        self._seen = 0
+        self.tables = {}
+
+    def update(self, data):
+        self._sha256.update(data)
+        window = self._tail + data
+        base = self.size - len(self._tail) + 1
+        for match in _TABLE_LINE_RE.finditer(window):
+            offset = base + match.start()
+            if offset < self._seen:
+                continue
+            self._seen = offset + 1
+            entry = self.tables.setdefault(_table_name(match.group(2)), {})
+            key = 'offset' if match.group(1) == b'CREATE TABLE' else 'data_offset'
+            entry.setdefault(key, offset)
+        self.size += len(data)
+        self._tail = window[-INDEX_TAIL_BYTES:]
+
+    def checksum(self):
+        return self._sha256.hexdigest()
+
+class BackupManifest:
+    """Описание бэкапа: сервер, формат, кодек, размеры, таблицы, контрольная сумма и время.
+
+    Создаётся до дампа; для SQL дампа, который пишется потоком, индексирует несжатый
+    поток (см. DumpIndexer). Итог пишется в ZIP-архив (ARCHIVE_META_NAME) и рядом
+    с архивом, поэтому развёртывание и список бэкапов не открывают сам архив.
+    """
+
+    def __init__(self, server, database, dump_format, codec, jobs=1, member=None, source=None, tool_version=None,
+                 created_at=None):
+        self.data = {
+            'manifest_version': MANIFEST_VERSION,
+            'engine': 'postgresql' if server == 'PostgreSQL' else 'mysql',
+            'server': server,
+            'server_version': (source or {}).get('server_version'),
+            'tool_version': tool_version,
+            'format': dump_format,
+            'codec': codec,
+            'member': member,
+            'jobs': jobs,
+            'database': database,
+            'created_at': created_at or datetime.now().strftime("%Y%m%d_%H%M%S"),
+            'started_at': datetime.now().isoformat(timespec='seconds')
+        }
+        self._rows = (source or {}).get('tables', {})
+        self._started = time.monotonic()
+        self.indexer = DumpIndexer()
+        self.offsets = None  # Смещения таблиц не из индексатора: сегменты или формат без SQL текста
+        self.embedded = False  # Описание уже записано в архив при его создании
+
+    def update(self, data):
+        """Блок несжатого дампа."""
+        self.indexer.update(data)
+
+    def finish(self, dump_size):
+        """Итоговое описание бэкапа."""
+        if 'finished_at' not in self.data:
+            self.data['finished_at'] = datetime.now().isoformat(timespec='seconds')
+            self.data['duration_seconds'] = round(time.monotonic() - self._started, 1)
+        offsets = self.offsets if self.offsets is not None else self.indexer.tables
+        # Сумма верна, только если через индексатор прошёл весь дамп
+        streamed = self.indexer.size == dump_size > 0
+        self.data['dump_size'] = dump_size
+        self.data['dump_sha256'] = self.indexer.checksum() if streamed else None
+        names = set(self._rows) | set(offsets)
+        entries = [{'name': name, 'rows': self._rows.get(name), **offsets.get(name, {})} for name in names]
+        entries.sort(key=lambda entry: (entry.get('offset', entry.get('data_offset', float('inf'))), entry['name']))
+        self.data['tables'] = entries
+        return self.data
+
+def manifest_path(archive_file):
+    """Путь файла описания бэкапа."""
+    return archive_file.with_name(f"{archive_file.name}{BACKUP_MANIFEST_SUFFIX}")
+
+def save_manifest(archive_file, manifest):
+    """Атомарная запись описания рядом с архивом, с итоговым размером архива; возвращает записанное описание."""
+    path = manifest_path(archive_file)
+    manifest = {**manifest, 'archive_size': archive_file.stat().st_size}
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=1), encoding='utf-8')
+    os.replace(tmp_path, path)
+    logger.debug(f"Описание бэкапа {archive_file.name}: таблиц {len(manifest.get('tables', []))}")
+    return manifest
+
+def load_manifest(archive_file):
+    """Описание бэкапа из файла рядом с архивом; None, если его нет или оно повреждено."""
+    path = manifest_path(archive_file)
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except ValueError as e:
+        logger.warning(f"Повреждён файл описания бэкапа {path}: {e}")
+        return None
+
+def discard_manifest(archive_file):
+    """Удаление описания вместе с архивом."""
+    manifest_path(archive_file).unlink(missing_ok=True)
+
+def manifest_created_at(manifest):
+    """Время создания бэкапа по описанию (None для описаний без времени)."""
+    try:
+        return datetime.strptime(manifest['created_at'], "%Y%m%d_%H%M%S")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def _format_size(size):
+    if size >= 1024 ** 3:
+        return f"{size / 1024 ** 3:.2f} ГБ"
+    return f"{size / 1024 ** 2:.1f} МБ"
+
+def describe_manifest(manifest):
+    """Краткое описание бэкапа для сообщения: размеры, кодек, таблицы, время дампа."""
+    parts = []
+    if manifest.get('archive_size') is not None:
+        parts.append(f"{_format_size(manifest['archive_size'])} ({manifest.get('codec')}, дамп {_format_size(manifest.get('dump_size', 0))})")
+    tables = manifest.get('tables') or []
+    if tables:
+        rows = f"{sum(entry['rows'] or 0 for entry in tables):,}".replace(',', ' ')
+        parts.append(f"таблиц {len(tables)}, ~{rows} строк")
+    if manifest.get('duration_seconds') is not None:
+        parts.append(f"дамп {manifest['duration_seconds']:.0f} сек")
+    return ' · '.join(parts)
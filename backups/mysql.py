@@ -1,6 +1,11 @@
-from config.settings import logger, telegram_bot, DUMPS_DIR, MIN_DUMP_SIZE, YANDEX_DISK_TOKEN, ADMIN_LIST
-from backups.utils import run_subprocess, async_archive_dump, unlink_file
-from storage.yandex_disk import upload_to_yandex_disk_rest
+from config.settings import logger, telegram_bot, DUMPS_DIR, MIN_DUMP_SIZE, ADMIN_LIST, UPLOAD_QUEUE_ENABLED
+from backups.compression import resolve_codec, archive_suffix
+from backups.mysql_parallel import dump_mysql_parallel, PARALLEL_FORMAT, PARALLEL_TOOL
+from backups.probe import detect_unchanged, save_probe_state, get_source_info, get_tool_version
+from backups.manifest import BackupManifest, describe_manifest
+from backups.utils import stream_dump_to_archive, write_backup_manifest, unlink_file
+from storage.yandex_disk import start_pipelined_upload
+from storage.fanout import upload_archive, enqueue_upload, unsupported_storages
 from bot.utils import send_telegram_notification
 from datetime import datetime
 import os
@@ -14,58 +19,122 @@ async def process_mysql_db(db, is_manual=False):
         db_name = db['database']
         dump_dir = DUMPS_DIR / db_name
         dump_dir.mkdir(exist_ok=True)
-        dump_file = dump_dir / f"{db_name}_{timestamp}.sql"
+        base_name = f"{db_name}_{timestamp}"
+        dump_format = db.get('dump_format', 'plain')
+        # Параллельный дамп — многофайловый ZIP с описанием формата
+        codec = resolve_codec(db.get('codec'), db.get('storage_mode')) if dump_format != 'parallel' else 'zip'
+        archive_file = dump_dir / f"{base_name}{archive_suffix(codec)}"
+        dump_jobs = max(1, int(db.get('dump_jobs', 1)))
         
-        env = os.environ.copy()
-        env['MYSQL_PWD'] = db['password']
-        cmd = [
-            'mysqldump',
-            '-h', db['host'],
-            '-P', db['port'],
-            '-u', db['user'],
-            db_name,
-            '--quick',
-            '--lock-tables=false',
-            '-r', str(dump_file)
-        ]
-        logger.debug(f"Создание дампа MySQL: {cmd}")
-        result = await run_subprocess(cmd, env)
+        change_signature = None
+        pipeline = None
+        if db.get('skip_unchanged') and not is_manual:
+            change_signature, previous = await detect_unchanged(db, 'MySQL')
+            if previous:
+                logger.info(f"База MySQL {db_name} не изменилась с бэкапа {previous['archive']}, дамп пропущен")
+                return {
+                    'database': db_name,
+                    'archive': previous['archive'],
+                    'yandex_uploaded': previous.get('yandex_uploaded', False),
+                    'unchanged': True
+                }
+        
+        manifest = BackupManifest(
+            'MySQL', db_name, PARALLEL_FORMAT if dump_format == 'parallel' else dump_format, codec, jobs=dump_jobs,
+            member=base_name if dump_format == 'parallel' else f"{base_name}.sql",
+            source=await get_source_info(db, 'MySQL'),
+            tool_version=PARALLEL_TOOL if dump_format == 'parallel' else await get_tool_version('mysqldump'),
+            created_at=timestamp
+        )
+        result = None
+        if dump_format == 'parallel':
+            logger.debug(f"Создание параллельного дампа MySQL {db_name}: {dump_jobs} соединений")
+            result = await dump_mysql_parallel(db, archive_file, base_name, dump_jobs, db.get('compress_level'))
+            if result is None:
+                logger.warning(f"Параллельный дамп MySQL {db_name} недоступен, используется mysqldump")
+                dump_format = 'plain'
+                codec = resolve_codec(db.get('codec'), db.get('storage_mode'))
+                archive_file = dump_dir / f"{base_name}{archive_suffix(codec)}"
+                manifest.data.update(
+                    format=dump_format, codec=codec, member=f"{base_name}.sql",
+                    tool_version=await get_tool_version('mysqldump')
+                )
+        
+        if result is None:
+            env = os.environ.copy()
+            env['MYSQL_PWD'] = db['password']
+            cmd = [
+                'mysqldump',
+                '-h', db['host'],
+                '-P', db['port'],
+                '-u', db['user'],
+                db_name,
+                '--quick',
+                '--lock-tables=false'
+            ]
+            logger.debug(f"Создание дампа MySQL: {cmd}")
+            if db.get('upload_mode') == 'pipelined':
+                pipeline = await start_pipelined_upload(archive_file, db_name, codec)
+            result = await stream_dump_to_archive(
+                cmd, env, archive_file, f"{base_name}.sql", codec=codec, level=db.get('compress_level'),
+                fileobj=pipeline.tee if pipeline else None, manifest=manifest
+            )
         
         if result.returncode != 0:
             logger.error(f"Ошибка создания дампа MySQL {db_name}: {result.stderr}")
-            if dump_file.exists():
-                logger.warning(f"Удаление неудавшегося дампа MySQL {dump_file}")
-                await unlink_file(dump_file)
+            if pipeline:
+                await pipeline.abort()
+            if archive_file.exists():
+                logger.warning(f"Удаление неудавшегося архива MySQL {archive_file}")
+                await unlink_file(archive_file)
             return None
         
-        if not dump_file.exists() or dump_file.stat().st_size < MIN_DUMP_SIZE:
-            logger.error(f"Дамп MySQL {db_name} пуст или слишком мал: {dump_file}")
-            await unlink_file(dump_file)
+        if result.dump_size < MIN_DUMP_SIZE:
+            logger.error(f"Дамп MySQL {db_name} пуст или слишком мал: {result.dump_size} байт")
+            if pipeline:
+                await pipeline.abort()
+            await unlink_file(archive_file)
             return None
         
-        logger.info(f"Дамп MySQL {dump_file} валиден, размер OK: {dump_file.stat().st_size} байт")
+        logger.info(f"Дамп MySQL {db_name} валиден, размер OK: {result.dump_size} байт, архив: {archive_file}")
         
-        zip_file = await async_archive_dump(dump_file)
-        if not zip_file:
-            logger.error(f"Не удалось заархивировать дамп MySQL {dump_file}")
-            await unlink_file(dump_file)
-            return None
-        
-        await unlink_file(dump_file)
+        # Описание бэкапа — рядом с архивом и внутри ZIP (в потоковый архив оно уже записано при создании)
+        manifest_data = await write_backup_manifest(archive_file, manifest, result.dump_size)
         
+        # Плановый бэкап не ждёт хранилища: архив загрузят обработчики очереди
+        queued = UPLOAD_QUEUE_ENABLED and not is_manual
         yandex_uploaded = False
-        if YANDEX_DISK_TOKEN:
-            yandex_uploaded = await upload_to_yandex_disk_rest(zip_file, db_name)
+        if pipeline:
+            yandex_uploaded = await pipeline.finish(fallback=not queued)
+        exclude = ('yandex',) if pipeline and (yandex_uploaded or not queued) else ()
+        if queued:
+            uploads = await enqueue_upload(archive_file, db_name, exclude=exclude)
+        else:
+            # Остальные хранилища (и файлообменник для бэкапа по запросу) получают архив за одно чтение
+            uploads = await upload_archive(archive_file, db_name, file_exchange=is_manual, exclude=exclude)
+        yandex_uploaded = yandex_uploaded or uploads.get('yandex', {}).get('ok', False)
+        
+        if change_signature:
+            save_probe_state(db_name, change_signature, archive_file.name, yandex_uploaded)
         
         if telegram_bot and not is_manual:
             timestamp_formatted = datetime.now().strftime("%H:%M %d.%m.%Y")
+            if yandex_uploaded:
+                yandex_status = f"/Backups/{db_name}/{archive_file.name}"
+            elif uploads.get('yandex', {}).get('queued'):
+                yandex_status = "В очереди на загрузку"
+            else:
+                yandex_status = "Не загружен"
+            unsupported = unsupported_storages(uploads)
+            no_copy_line = f"\n⚠️ <b>Без копии</b>: {', '.join(unsupported)} (нет хранилища чанков)" if unsupported else ""
             message = (
                 f"<b>✅ Создание бэкапа завершено!</b>\n\n"
                 f"🗄️ <b>База</b>: {db_name}\n"
-                f"📁 <b>Файл</b>: <a href=\"tg://btn/copy_file:{zip_file.name}\"><code>{zip_file.name}</code></a>\n"
+                f"📁 <b>Файл</b>: <a href=\"tg://btn/copy_file:{archive_file.name}\"><code>{archive_file.name}</code></a>\n"
                 f"📅 <b>Время создания</b>: {timestamp_formatted}\n"
-                f"☁️ <b>Я.Диск</b>: /Backups/{db_name}/{zip_file.name}" if yandex_uploaded else
-                f"☁️ <b>Я.Диск</b>: Не загружен"
+                f"📦 <b>Бэкап</b>: {describe_manifest(manifest_data)}\n"
+                f"☁️ <b>Я.Диск</b>: {yandex_status}"
+                f"{no_copy_line}"
             )
             await telegram_bot.send_message(
                 chat_id=ADMIN_LIST[0],
@@ -76,11 +145,16 @@ async def process_mysql_db(db, is_manual=False):
         
         return {
             'database': db_name,
-            'archive': zip_file.name,
-            'yandex_uploaded': yandex_uploaded
+            'archive': archive_file.name,
+            'yandex_uploaded': yandex_uploaded,
+            'uploads': uploads,
+            'manifest': manifest_data,
+            'download_url': uploads.get('file_exchange', {}).get('url')
         }
     except Exception as e:
         logger.error(f"Неожиданная ошибка при создании дампа MySQL {db.get('database', 'unknown')}: {e}")
-        if 'dump_file' in locals() and dump_file.exists():
-            await unlink_file(dump_file)
+        if 'pipeline' in locals() and pipeline:
+            await pipeline.abort()
+        if 'archive_file' in locals() and archive_file.exists():
+            await unlink_file(archive_file)
         return None
\ No newline at end of file
@@ -0,0 +1,337 @@
+import asyncio
+import gzip
+import math
+import queue
+import re
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import mysql.connector
+from config.settings import logger
+from backups.compression import compress_level
+from backups.ratelimit import disk_limiter
+from backups.utils import pack_directory_to_archive
+
+PARALLEL_FORMAT = 'mysql-parallel'
+PARALLEL_TOOL = f"mysql-connector-python {mysql.connector.__version__}"  # Чем выгружен параллельный дамп
+RANGE_SPLIT_BYTES = 512 * 1024 * 1024  # Таблицы больше этого размера делятся на диапазоны первичного ключа
+INSERT_BATCH_BYTES = 1024 * 1024  # Размер одного INSERT, с запасом меньше max_allowed_packet
+FETCH_ROWS = 1000
+LOCK_WAIT_TIMEOUT = 60  # Ожидание FLUSH TABLES WITH READ LOCK, секунды
+
+NUMERIC_TYPES = {'tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint', 'decimal', 'float', 'double', 'year'}
+BINARY_TYPES = {
+    'binary', 'varbinary', 'tinyblob', 'blob', 'mediumblob', 'longblob', 'bit',
+    'geometry', 'point', 'linestring', 'polygon', 'multipoint', 'multilinestring', 'multipolygon', 'geometrycollection'
+}
+INTEGER_TYPES = {'tinyint', 'smallint', 'mediumint', 'int', 'integer', 'bigint'}
+
+# Заголовок каждого файла дампа: файлы восстанавливаются в отдельных сессиях
+DUMP_HEADER = (
+    "/*!40101 SET NAMES utf8mb4 */;\n"
+    "/*!40103 SET TIME_ZONE='+00:00' */;\n"
+    "/*!40014 SET UNIQUE_CHECKS=0, FOREIGN_KEY_CHECKS=0 */;\n"
+    "/*!40101 SET SQL_MODE='NO_AUTO_VALUE_ON_ZERO' */;\n"
+    "/*!40111 SET SQL_NOTES=0 */;\n\n"
+)
+_DEFINER_RE = re.compile(r"DEFINER=`(?:[^`]|``)*`@`(?:[^`]|``)*`\s*")
+# Генерируемые колонки: VIRTUAL/STORED GENERATED (MySQL, MariaDB 10.2+), PERSISTENT/VIRTUAL (старые MariaDB).
+# DEFAULT_GENERATED (MySQL 8, DEFAULT CURRENT_TIMESTAMP или выражение) — обычная колонка с данными
+_GENERATED_EXTRA_RE = re.compile(r"\b(?:VIRTUAL|STORED|PERSISTENT)\b", re.I)
+
+def _quote(name):
+    """Экранирование идентификатора MySQL."""
+    return '`' + name.replace('`', '``') + '`'
+
+def _escape(value):
+    """Экранирование строки как в mysql_real_escape_string."""
+    return (value.replace(b'\\', b'\\\\').replace(b'\0', b'\\0').replace(b'\n', b'\\n')
+            .replace(b'\r', b'\\r').replace(b'\x1a', b'\\Z').replace(b"'", b"\\'").replace(b'"', b'\\"'))
+
+def _literal(value, kind):
+    """SQL-литерал значения, полученного в текстовом протоколе."""
+    if value is None:
+        return b'NULL'
+    value = bytes(value)
+    if kind == 'numeric':
+        return value
+    if kind == 'binary':
+        return b'0x' + value.hex().encode() if value else b"''"
+    return b"'" + _escape(value) + b"'"
+
+def _text(value):
+    """Строка из результата information_schema (некоторые версии коннектора отдают bytearray)."""
+    return value.decode() if isinstance(value, (bytes, bytearray)) else value
+
+def _column_kind(data_type):
+    """Вид литерала для типа колонки: число, двоичные данные или строка."""
+    if data_type in NUMERIC_TYPES:
+        return 'numeric'
+    if data_type in BINARY_TYPES:
+        return 'binary'
+    return 'text'
+
+def _connect(db):
+    """Соединение с базой через mysql-connector."""
+    return mysql.connector.connect(
+        host=db['host'],
+        port=int(db['port']),
+        user=db['user'],
+        password=db['password'],
+        database=db['database'],
+        charset='utf8mb4',
+        connection_timeout=30
+    )
+
+def _open_snapshot_connections(db, count):
+    """Соединения, открывшие транзакции на одном и том же снимке данных.
+
+    Пока удерживается FLUSH TABLES WITH READ LOCK, запись в базу невозможна, поэтому
+    все START TRANSACTION WITH CONSISTENT SNAPSHOT видят одинаковое состояние.
+    """
+    control = _connect(db)
+    connections = []
+    try:
+        cursor = control.cursor()
+        cursor.execute(f"SET SESSION lock_wait_timeout = {LOCK_WAIT_TIMEOUT}")
+        cursor.execute("FLUSH TABLES WITH READ LOCK")
+        try:
+            for _ in range(count):
+                connection = _connect(db)
+                connections.append(connection)
+                worker_cursor = connection.cursor()
+                worker_cursor.execute("SET SESSION time_zone = '+00:00'")
+                worker_cursor.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                worker_cursor.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                worker_cursor.close()
+        finally:
+            cursor.execute("UNLOCK TABLES")
+            cursor.close()
+    except BaseException:
+        for connection in connections:
+            connection.close()
+        raise
+    finally:
+        control.close()
+    return connections
+
+def _read_columns(connection, db_name):
+    """Колонки таблиц (без генерируемых) и одноколоночные целочисленные первичные ключи."""
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE, EXTRA FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME, ORDINAL_POSITION", (db_name,)
+    )
+    columns = {}
+    for table, column, data_type, extra in cursor.fetchall():
+        if _GENERATED_EXTRA_RE.search(_text(extra) or ''):
+            continue
+        columns.setdefault(_text(table), []).append((_text(column), _column_kind(_text(data_type).lower())))
+    cursor.execute(
+        "SELECT k.TABLE_NAME, k.COLUMN_NAME, c.DATA_TYPE FROM information_schema.KEY_COLUMN_USAGE k "
+        "JOIN information_schema.COLUMNS c ON c.TABLE_SCHEMA = k.TABLE_SCHEMA AND c.TABLE_NAME = k.TABLE_NAME "
+        "AND c.COLUMN_NAME = k.COLUMN_NAME "
+        "WHERE k.TABLE_SCHEMA = %s AND k.CONSTRAINT_NAME = 'PRIMARY'", (db_name,)
+    )
+    key_columns = {}
+    for table, column, data_type in cursor.fetchall():
+        key_columns.setdefault(_text(table), []).append((_text(column), _text(data_type).lower()))
+    cursor.close()
+    primary_keys = {
+        table: keys[0][0] for table, keys in key_columns.items()
+        if len(keys) == 1 and keys[0][1] in INTEGER_TYPES
+    }
+    return columns, primary_keys
+
+def _sort_views(views):
+    """Порядок создания представлений с учётом ссылок друг на друга."""
+    ordered, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done or name in visiting:
+            return
+        visiting.add(name)
+        for other in views:
+            if other != name and _quote(other) in views[name]:
+                visit(other)
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(name)
+
+    for name in sorted(views):
+        visit(name)
+    return ordered
+
+def _write_schema(connection, db_name, staging_dir):
+    """Запись схемы (таблицы) и объектов, создаваемых после данных (представления, триггеры)."""
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT TABLE_NAME, TABLE_TYPE, COALESCE(DATA_LENGTH, 0) FROM information_schema.TABLES "
+        "WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME", (db_name,)
+    )
+    tables, views = {}, {}
+    for name, table_type, data_length in cursor.fetchall():
+        name = _text(name)
+        if _text(table_type) == 'VIEW':
+            views[name] = None
+        else:
+            tables[name] = int(data_length)
+
+    with open(staging_dir / 'schema.sql', 'w', encoding='utf-8') as f:
+        f.write(DUMP_HEADER)
+        for name in tables:
+            cursor.execute(f"SHOW CREATE TABLE {_quote(name)}")
+            f.write(f"DROP TABLE IF EXISTS {_quote(name)};\n{cursor.fetchone()[1]};\n\n")
+
+    for name in views:
+        cursor.execute(f"SHOW CREATE VIEW {_quote(name)}")
+        views[name] = _DEFINER_RE.sub('', cursor.fetchone()[1])
+    cursor.execute("SELECT TRIGGER_NAME FROM information_schema.TRIGGERS WHERE TRIGGER_SCHEMA = %s ORDER BY TRIGGER_NAME", (db_name,))
+    triggers = []
+    for (trigger,) in cursor.fetchall():
+        cursor.execute(f"SHOW CREATE TRIGGER {_quote(_text(trigger))}")
+        triggers.append(_DEFINER_RE.sub('', cursor.fetchone()[2]))
+    cursor.close()
+
+    # Триггеры создаются после загрузки данных, иначе сработают на каждую строку дампа
+    with open(staging_dir / 'post.sql', 'w', encoding='utf-8') as f:
+        f.write(DUMP_HEADER)
+        for name in _sort_views(views):
+            f.write(f"DROP VIEW IF EXISTS {_quote(name)};\n{views[name]};\n\n")
+        if triggers:
+            f.write("DELIMITER ;;\n")
+            for trigger in triggers:
+                f.write(f"{trigger};;\n")
+            f.write("DELIMITER ;\n")
+    return tables
+
+def _plan_jobs(connection, tables, primary_keys, jobs):
+    """Задания выгрузки: таблица целиком или диапазон первичного ключа, крупные первыми."""
+    planned = []
+    cursor = connection.cursor()
+    for table, data_length in tables.items():
+        key = primary_keys.get(table)
+        parts = min(max(jobs * 4, 2), math.ceil(data_length / RANGE_SPLIT_BYTES)) if key else 1
+        if parts < 2:
+            planned.append((data_length, table, None))
+            continue
+        cursor.execute(f"SELECT MIN({_quote(key)}), MAX({_quote(key)}) FROM {_quote(table)}")
+        low, high = cursor.fetchone()
+        if low is None:
+            planned.append((data_length, table, None))
+            continue
+        step = max(1, math.ceil((high - low + 1) / parts))
+        bounds = list(range(low, high + 1, step))
+        for i, start in enumerate(bounds):
+            condition = f"{_quote(key)} >= {start}" if i else None
+            if i + 1 < len(bounds):
+                upper = f"{_quote(key)} < {bounds[i + 1]}"
+                condition = f"{condition} AND {upper}" if condition else upper
+            planned.append((data_length / len(bounds), table, condition))
+    cursor.close()
+    planned.sort(key=lambda job: job[0], reverse=True)
+    return [(table, condition) for _, table, condition in planned]
+
+def _dump_job(connection, table, columns, condition, path, level, stop):
+    """Выгрузка таблицы или её диапазона в gzip-файл с INSERT по пачкам."""
+    column_list = ', '.join(_quote(name) for name, _ in columns)
+    kinds = [kind for _, kind in columns]
+    query = f"SELECT {column_list} FROM {_quote(table)}"
+    if condition:
+        query += f" WHERE {condition}"
+    prefix = f"INSERT INTO {_quote(table)} ({column_list}) VALUES\n".encode()
+    size = 0
+    cursor = connection.cursor(raw=True)
+    try:
+        cursor.execute(query)
+        with gzip.open(path, 'wb', compresslevel=level) as out:
+            out.write(DUMP_HEADER.encode())
+            batch, batch_size = [], 0
+            while not stop.is_set():
+                rows = cursor.fetchmany(FETCH_ROWS)
+                if not rows:
+                    break
+                for row in rows:
+                    values = b'(' + b','.join(_literal(value, kind) for value, kind in zip(row, kinds)) + b')'
+                    batch.append(values)
+                    batch_size += len(values) + 2
+                    if batch_size >= INSERT_BATCH_BYTES:
+                        statement = prefix + b',\n'.join(batch) + b';\n'
+                        disk_limiter.acquire_sync(len(statement))
+                        out.write(statement)
+                        size += len(statement)
+                        batch, batch_size = [], 0
+            if batch:
+                statement = prefix + b',\n'.join(batch) + b';\n'
+                out.write(statement)
+                size += len(statement)
+    finally:
+        cursor.close()
+    return size
+
+def _dump_parallel(db, staging_dir, jobs, level):
+    """Выгрузка базы в каталог: schema.sql, data/*.sql.gz, post.sql. Возвращает размер данных."""
+    db_name = db['database']
+    connections = _open_snapshot_connections(db, jobs)
+    try:
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        (staging_dir / 'data').mkdir(exist_ok=True)
+        tables = _write_schema(connections[0], db_name, staging_dir)
+        columns, primary_keys = _read_columns(connections[0], db_name)
+        work = queue.Queue()
+        for number, (table, condition) in enumerate(_plan_jobs(connections[0], tables, primary_keys, jobs)):
+            if columns.get(table):
+                safe_name = re.sub(r'[^0-9A-Za-z_]', '_', table)
+                work.put((table, condition, staging_dir / 'data' / f"{number:05d}_{safe_name}.sql.gz"))
+        logger.info(f"Параллельный дамп {db_name}: таблиц {len(tables)}, заданий {work.qsize()}, соединений {jobs}")
+
+        stop = threading.Event()
+
+        def worker(connection):
+            size = 0
+            try:
+                while not stop.is_set():
+                    try:
+                        table, condition, path = work.get_nowait()
+                    except queue.Empty:
+                        break
+                    size += _dump_job(connection, table, columns[table], condition, path, level, stop)
+            except BaseException:
+                stop.set()
+                raise
+            return size
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(worker, connection) for connection in connections]
+            return sum(future.result() for future in futures)
+    finally:
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+async def dump_mysql_parallel(db, archive_file, member, jobs=1, level=None):
+    """Параллельный дамп MySQL/MariaDB на согласованном снимке в многофайловый ZIP.
+
+    Возвращает None, если снимок для нескольких соединений получить нельзя
+    (нет привилегии RELOAD для FLUSH TABLES WITH READ LOCK) — тогда нужен обычный mysqldump.
+    """
+    jobs = max(1, int(jobs))
+    staging_dir = archive_file.parent / f"{member}.dir"
+    try:
+        dump_size = await asyncio.to_thread(_dump_parallel, db, staging_dir, jobs, compress_level('gzip', level))
+        await pack_directory_to_archive(staging_dir, archive_file, member)
+        returncode, stderr = 0, ''
+    except mysql.connector.Error as e:
+        if e.errno == 1227 and not staging_dir.exists():
+            logger.warning(f"Не удалось получить согласованный снимок {db['database']}: {e}")
+            return None
+        returncode, stderr, dump_size = 1, str(e), 0
+    finally:
+        await asyncio.to_thread(shutil.rmtree, staging_dir, True)
+    return type('DumpResult', (), {
+        'returncode': returncode,
+        'stderr': stderr,
+        'dump_size': dump_size
+    })()
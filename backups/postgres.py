@@ -1,6 +1,11 @@
-from config.settings import logger, telegram_bot, DUMPS_DIR, MIN_DUMP_SIZE, YANDEX_DISK_TOKEN, ADMIN_LIST
-from backups.utils import run_subprocess, async_archive_dump, unlink_file
-from storage.yandex_disk import upload_to_yandex_disk_rest
+from config.settings import logger, telegram_bot, DUMPS_DIR, MIN_DUMP_SIZE, ADMIN_LIST, UPLOAD_QUEUE_ENABLED
+from backups.compression import resolve_codec, archive_suffix
+from backups.segments import dump_postgres_segments
+from backups.probe import detect_unchanged, save_probe_state, get_source_info, get_tool_version
+from backups.manifest import BackupManifest, describe_manifest
+from backups.utils import stream_dump_to_archive, dump_directory_to_archive, write_backup_manifest, unlink_file
+from storage.yandex_disk import start_pipelined_upload
+from storage.fanout import upload_archive, enqueue_upload, unsupported_storages
 from bot.utils import send_telegram_notification
 from datetime import datetime
 import os
@@ -14,7 +19,29 @@ async def process_postgres_db(db, is_manual=False):
         db_name = db['dbname']
         dump_dir = DUMPS_DIR / db_name
         dump_dir.mkdir(exist_ok=True)
-        dump_file = dump_dir / f"{db_name}_{timestamp}.sql"
+        base_name = f"{db_name}_{timestamp}"
+        dump_format = db.get('dump_format', 'plain')
+        # Форматы directory/custom всегда упаковываются в ZIP вместе с описанием формата,
+        # segments собирается в обычный SQL дамп и сжимается выбранным кодеком
+        if dump_format in ('plain', 'segments'):
+            codec = resolve_codec(db.get('codec'), db.get('storage_mode'))
+        else:
+            codec = 'zip'
+        archive_file = dump_dir / f"{base_name}{archive_suffix(codec)}"
+        dump_jobs = max(1, int(db.get('dump_jobs', 1)))
+        
+        change_signature = None
+        pipeline = None
+        if db.get('skip_unchanged') and not is_manual:
+            change_signature, previous = await detect_unchanged(db, 'PostgreSQL')
+            if previous:
+                logger.info(f"База PostgreSQL {db_name} не изменилась с бэкапа {previous['archive']}, дамп пропущен")
+                return {
+                    'database': db_name,
+                    'archive': previous['archive'],
+                    'yandex_uploaded': previous.get('yandex_uploaded', False),
+                    'unchanged': True
+                }
         
         env = os.environ.copy()
         env['PGPASSWORD'] = db['password']
@@ -26,47 +53,96 @@ async def process_postgres_db(db, is_manual=False):
             '-d', db_name,
             '--schema=public',
             '--no-owner',
-            '--no-privileges',
-            '-f', str(dump_file)
+            '--no-privileges'
         ]
-        logger.debug(f"Создание дампа PostgreSQL: {cmd}")
-        result = await run_subprocess(cmd, env)
+        if dump_format == 'directory':
+            # Параллельный дамп: каждая таблица выгружается и сжимается отдельным процессом
+            cmd += ['-Fd', '-j', str(dump_jobs)]
+        elif dump_format == 'custom':
+            cmd += ['-Fc']
+        logger.debug(f"Создание дампа PostgreSQL ({dump_format}): {cmd}")
+        
+        member = {'directory': base_name, 'custom': f"{base_name}.dump"}.get(dump_format, f"{base_name}.sql")
+        manifest = BackupManifest(
+            'PostgreSQL', db_name, dump_format, codec, jobs=dump_jobs, member=member,
+            source=await get_source_info(db, 'PostgreSQL'), tool_version=await get_tool_version('pg_dump'),
+            created_at=timestamp
+        )
+        if dump_format == 'custom':
+            # Архив pg_dump -Fc не SQL текст: строки CREATE TABLE в нём — оглавление, а не начало таблиц
+            manifest.offsets = {}
+        if dump_format == 'directory':
+            result = await dump_directory_to_archive(cmd, env, dump_dir / f"{base_name}.dir", archive_file, member)
+        elif dump_format == 'custom':
+            result = await stream_dump_to_archive(cmd, env, archive_file, member, level=0, manifest=manifest)
+        elif dump_format == 'segments':
+            result = await dump_postgres_segments(
+                db, cmd, env, archive_file, member, codec=codec, level=db.get('compress_level'), jobs=dump_jobs,
+                manifest=manifest
+            )
+        else:
+            if db.get('upload_mode') == 'pipelined':
+                pipeline = await start_pipelined_upload(archive_file, db_name, codec)
+            result = await stream_dump_to_archive(
+                cmd, env, archive_file, member, codec=codec, level=db.get('compress_level'),
+                fileobj=pipeline.tee if pipeline else None, manifest=manifest
+            )
         
         if result.returncode != 0:
             logger.error(f"Ошибка создания дампа PostgreSQL {db_name}: {result.stderr}")
-            if dump_file.exists():
-                logger.warning(f"Удаление неудавшегося дампа PostgreSQL {dump_file}")
-                await unlink_file(dump_file)
+            if pipeline:
+                await pipeline.abort()
+            if archive_file.exists():
+                logger.warning(f"Удаление неудавшегося архива PostgreSQL {archive_file}")
+                await unlink_file(archive_file)
             return None
         
-        if not dump_file.exists() or dump_file.stat().st_size < MIN_DUMP_SIZE:
-            logger.error(f"Дамп PostgreSQL {db_name} пуст или слишком мал: {dump_file}")
-            await unlink_file(dump_file)
+        if result.dump_size < MIN_DUMP_SIZE:
+            logger.error(f"Дамп PostgreSQL {db_name} пуст или слишком мал: {result.dump_size} байт")
+            if pipeline:
+                await pipeline.abort()
+            await unlink_file(archive_file)
             return None
         
-        logger.info(f"Дамп PostgreSQL {dump_file} валиден, размер OK: {dump_file.stat().st_size} байт")
+        logger.info(f"Дамп PostgreSQL {db_name} валиден, размер OK: {result.dump_size} байт, архив: {archive_file}")
         
-        zip_file = await async_archive_dump(dump_file)
-        if not zip_file:
-            logger.error(f"Не удалось заархивировать дамп PostgreSQL {dump_file}")
-            await unlink_file(dump_file)
-            return None
-        
-        await unlink_file(dump_file)
+        # Описание бэкапа — рядом с архивом и внутри ZIP (в потоковый архив оно уже записано при создании)
+        manifest_data = await write_backup_manifest(archive_file, manifest, result.dump_size)
         
+        # Плановый бэкап не ждёт хранилища: архив загрузят обработчики очереди
+        queued = UPLOAD_QUEUE_ENABLED and not is_manual
         yandex_uploaded = False
-        if YANDEX_DISK_TOKEN:
-            yandex_uploaded = await upload_to_yandex_disk_rest(zip_file, db_name)
+        if pipeline:
+            yandex_uploaded = await pipeline.finish(fallback=not queued)
+        exclude = ('yandex',) if pipeline and (yandex_uploaded or not queued) else ()
+        if queued:
+            uploads = await enqueue_upload(archive_file, db_name, exclude=exclude)
+        else:
+            # Остальные хранилища (и файлообменник для бэкапа по запросу) получают архив за одно чтение
+            uploads = await upload_archive(archive_file, db_name, file_exchange=is_manual, exclude=exclude)
+        yandex_uploaded = yandex_uploaded or uploads.get('yandex', {}).get('ok', False)
+        
+        if change_signature:
+            save_probe_state(db_name, change_signature, archive_file.name, yandex_uploaded)
         
         if telegram_bot and not is_manual:
             timestamp_formatted = datetime.now().strftime("%H:%M %d.%m.%Y")
+            if yandex_uploaded:
+                yandex_status = f"/Backups/{db_name}/{archive_file.name}"
+            elif uploads.get('yandex', {}).get('queued'):
+                yandex_status = "В очереди на загрузку"
+            else:
+                yandex_status = "Не загружен"
+            unsupported = unsupported_storages(uploads)
+            no_copy_line = f"\n⚠️ <b>Без копии</b>: {', '.join(unsupported)} (нет хранилища чанков)" if unsupported else ""
             message = (
                 f"<b>✅ Создание бэкапа завершено!</b>\n\n"
                 f"🗄️ <b>База</b>: {db_name}\n"
-                f"📁 <b>Файл</b>: <a href=\"tg://btn/copy_file:{zip_file.name}\"><code>{zip_file.name}</code></a>\n"
+                f"📁 <b>Файл</b>: <a href=\"tg://btn/copy_file:{archive_file.name}\"><code>{archive_file.name}</code></a>\n"
                 f"📅 <b>Время создания</b>: {timestamp_formatted}\n"
-                f"☁️ <b>Я.Диск</b>: /Backups/{db_name}/{zip_file.name}" if yandex_uploaded else
-                f"☁️ <b>Я.Диск</b>: Не загружен"
+                f"📦 <b>Бэкап</b>: {describe_manifest(manifest_data)}\n"
+                f"☁️ <b>Я.Диск</b>: {yandex_status}"
+                f"{no_copy_line}"
             )
             await telegram_bot.send_message(
                 chat_id=ADMIN_LIST[0],
@@ -77,11 +153,16 @@ async def process_postgres_db(db, is_manual=False):
         
         return {
             'database': db_name,
-            'archive': zip_file.name,
-            'yandex_uploaded': yandex_uploaded
+            'archive': archive_file.name,
+            'yandex_uploaded': yandex_uploaded,
+            'uploads': uploads,
+            'manifest': manifest_data,
+            'download_url': uploads.get('file_exchange', {}).get('url')
         }
     except Exception as e:
         logger.error(f"Неожиданная ошибка при создании дампа PostgreSQL {db.get('dbname', 'unknown')}: {e}")
-        if 'dump_file' in locals() and dump_file.exists():
-            await unlink_file(dump_file)
+        if 'pipeline' in locals() and pipeline:
+            await pipeline.abort()
+        if 'archive_file' in locals() and archive_file.exists():
+            await unlink_file(archive_file)
         return None
\ No newline at end of file
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from config.settings import DUMPS_DIR, UNCHANGED_MAX_AGE_HOURS, logger
+from backups.utils import run_subprocess
+
+PROBE_STATE_NAME = '.probe.json'
+
+# Счётчики изменений строк базы (DDL тоже меняет строки системного каталога).
+# На реплике статистика первичного сервера недоступна, поэтому учитывается позиция применённого WAL.
+POSTGRES_PROBE_SQL = (
+    "SELECT concat_ws(':', d.tup_inserted, d.tup_updated, d.tup_deleted, d.stats_reset, "
+    "CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()::text END) "
+    "FROM pg_stat_database d WHERE d.datname = current_database();"
+)
+MYSQL_TABLES_SQL = (
+    "SELECT TABLE_NAME, ENGINE, CREATE_TIME, UPDATE_TIME FROM information_schema.TABLES "
+    "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME;"
+)
+# В MySQL 8 статистика information_schema кэшируется до суток, для проверки нужен свежий UPDATE_TIME
+MYSQL_STATS_EXPIRY_SQL = "SET SESSION information_schema_stats_expiry = 0;"
+# UPDATE_TIME точен до секунды: запись после снимка дампа в ту же секунду, что и предыдущая, его не меняет.
+# Позиция записи сервера (GTID) сдвигается каждой транзакцией любой базы сервера; без GTID/бинлога она пуста
+MYSQL_WRITE_POSITION_SQL = {
+    'MySQL': "SELECT @@GLOBAL.gtid_executed;",
+    'MariaDB': "SELECT @@GLOBAL.gtid_binlog_pos;"
+}
+# Оценка числа строк по статистике планировщика (-1 — таблица ещё не анализировалась)
+POSTGRES_TABLE_ROWS_SQL = (
+    "SELECT c.relname, CASE WHEN c.reltuples >= 0 THEN c.reltuples::bigint END FROM pg_class c "
+    "JOIN pg_namespace n ON n.oid = c.relnamespace "
+    "WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') ORDER BY c.relname;"
+)
+MYSQL_TABLE_ROWS_SQL = (
+    "SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES "
+    "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE' ORDER BY TABLE_NAME;"
+)
+
+_tool_versions = {}
+
+def _psql_cmd(db, sql):
+    """Команда psql для одного запроса без форматирования вывода."""
+    return [
+        'psql',
+        '-h', db['host'],
+        '-p', db['port'],
+        '-U', db['user'],
+        '-d', db['dbname'],
+        '-At',
+        '-c', sql
+    ]
+
+def _mysql_cmd(db, sql):
+    """Команда mysql для запроса с выводом через табуляцию."""
+    return [
+        'mysql',
+        '-h', db['host'],
+        '-P', db['port'],
+        '-u', db['user'],
+        '-D', db['database'],
+        '--batch',
+        '--skip-column-names',
+        '-e', sql
+    ]
+
+async def get_change_signature(db, db_type):
+    """Дешёвая сигнатура состояния базы; None, если её не удалось получить."""
+    env = os.environ.copy()
+    if db_type == 'PostgreSQL':
+        env['PGPASSWORD'] = db['password']
+        result = await run_subprocess(_psql_cmd(db, POSTGRES_PROBE_SQL), env)
+    else:
+        env['MYSQL_PWD'] = db['password']
+        sql = MYSQL_WRITE_POSITION_SQL[db_type] + MYSQL_TABLES_SQL
+        if db_type == 'MySQL':
+            sql = MYSQL_STATS_EXPIRY_SQL + sql
+        result = await run_subprocess(_mysql_cmd(db, sql), env)
+        checksum = db.get('change_probe') == 'checksum'
+        position, _, table_lines = result.stdout.partition('\n')
+        if result.returncode == 0 and not checksum and not position.strip():
+            logger.info(
+                f"На сервере базы {db['database']} нет GTID и бинлога, изменения проверяются через CHECKSUM TABLE"
+            )
+            checksum = True
+        if result.returncode == 0 and checksum:
+            # Точная проверка по содержимому таблиц (полное чтение, дороже проверки по UPDATE_TIME)
+            tables = [line.split('\t')[0] for line in table_lines.splitlines() if line.split('\t')[1:2] != ['NULL']]
+            if tables:
+                checksum_sql = "CHECKSUM TABLE " + ", ".join(f"`{table}`" for table in tables) + ";"
+                result = await run_subprocess(_mysql_cmd(db, checksum_sql), env)
+
+    if result.returncode != 0 or not result.stdout.strip():
+        logger.warning(f"Не удалось проверить изменения базы {db.get('dbname', db.get('database'))}: {result.stderr}")
+        return None
+    return hashlib.sha256(result.stdout.encode()).hexdigest()
+
+async def get_source_info(db, db_type):
+    """Версия сервера и оценка числа строк таблиц для описания бэкапа; None, если запрос не удался."""
+    env = os.environ.copy()
+    if db_type == 'PostgreSQL':
+        env['PGPASSWORD'] = db['password']
+        cmd = _psql_cmd(db, 'SHOW server_version;') + ['-F', '\t', '-c', POSTGRES_TABLE_ROWS_SQL]
+    else:
+        env['MYSQL_PWD'] = db['password']
+        cmd = _mysql_cmd(db, 'SELECT VERSION();' + MYSQL_TABLE_ROWS_SQL)
+    try:
+        result = await run_subprocess(cmd, env)
+    except OSError as e:
+        logger.warning(f"Не удалось получить сведения о базе {db.get('dbname', db.get('database'))} для описания бэкапа: {e}")
+        return None
+    lines = result.stdout.splitlines()
+    if result.returncode != 0 or not lines:
+        logger.warning(f"Не удалось получить сведения о базе {db.get('dbname', db.get('database'))} для описания бэкапа: {result.stderr}")
+        return None
+    tables = {}
+    for line in lines[1:]:
+        name, _, rows = line.partition('\t')
+        tables[name] = int(rows) if rows.isdigit() else None
+    return {'server_version': lines[0].strip(), 'tables': tables}
+
+async def get_tool_version(tool):
+    """Версия утилиты дампа (первая строка --version), запрашивается один раз за запуск."""
+    if tool not in _tool_versions:
+        try:
+            result = await run_subprocess([tool, '--version'], os.environ.copy())
+        except OSError as e:
+            logger.warning(f"Не удалось определить версию {tool}: {e}")
+            return None
+        output = result.stdout.strip()
+        _tool_versions[tool] = output.splitlines()[0] if result.returncode == 0 and output else None
+    return _tool_versions[tool]
+
+def _state_path(db_name):
+    """Файл состояния проверки изменений базы."""
+    return DUMPS_DIR / db_name / PROBE_STATE_NAME
+
+def load_probe_state(db_name):
+    """Состояние последней проверки базы (сигнатура и архив последнего бэкапа)."""
+    path = _state_path(db_name)
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except ValueError as e:
+        logger.warning(f"Повреждён файл состояния проверки {path}: {e}")
+        return None
+
+def save_probe_state(db_name, signature, archive_name, yandex_uploaded):
+    """Сохранение сигнатуры базы после успешного бэкапа."""
+    path = _state_path(db_name)
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(json.dumps({
+        'signature': signature,
+        'archive': archive_name,
+        'yandex_uploaded': yandex_uploaded,
+        'dumped_at': datetime.now().isoformat(timespec='seconds')
+    }, ensure_ascii=False), encoding='utf-8')
+
+async def detect_unchanged(db, db_type):
+    """Проверка изменений перед дампом: (сигнатура, состояние прошлого бэкапа или None)."""
+    db_name = db.get('dbname', db.get('database'))
+    signature = await get_change_signature(db, db_type)
+    if signature is None:
+        return None, None
+    state = load_probe_state(db_name)
+    if not state or state.get('signature') != signature:
+        return signature, None
+    if not (DUMPS_DIR / db_name / state['archive']).exists():
+        logger.debug(f"Архив последнего бэкапа {state['archive']} не найден, выполняется новый дамп")
+        return signature, None
+    dumped_at = datetime.fromisoformat(state['dumped_at'])
+    if datetime.now() - dumped_at >= timedelta(hours=UNCHANGED_MAX_AGE_HOURS):
+        # Периодический полный дамп даже без изменений
+        logger.debug(f"Бэкапу {state['archive']} больше {UNCHANGED_MAX_AGE_HOURS} ч, выполняется новый дамп")
+        return signature, None
+    return signature, state
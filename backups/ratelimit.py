@@ -0,0 +1,115 @@
+import asyncio
+import re
+import threading
+import time
+from datetime import datetime
+from config.settings import RATE_LIMIT_UPLOAD, RATE_LIMIT_DOWNLOAD, RATE_LIMIT_DISK, RATE_LIMIT_BURST_SECONDS, logger
+
+READ_BLOCK_SIZE = 1024 * 1024  # Блок чтения файла при загрузке с ограничением скорости
+_RATE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([KMG]?)B?$', re.IGNORECASE)
+_WINDOW_RE = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+_RATE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_rate(value):
+    """Скорость в байтах в секунду из строки (500K, 10M, 1.5G); 0 — без ограничения."""
+    match = _RATE_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"Неверное значение скорости: {value}")
+    return int(float(match.group(1)) * _RATE_UNITS[match.group(2).upper()])
+
+def parse_rate_profile(spec):
+    """Профиль лимита по времени суток: «09:00-19:00=10M,0».
+
+    Элементы через запятую: окно ЧЧ:ММ-ЧЧ:ММ=скорость (окно может переходить через полночь)
+    или просто скорость — значение вне всех окон. Возвращает (окна, скорость по умолчанию).
+    """
+    windows = []
+    default = 0
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        if '=' not in item:
+            default = parse_rate(item)
+            continue
+        window, rate = item.split('=', 1)
+        match = _WINDOW_RE.match(window.strip())
+        if not match:
+            raise ValueError(f"Неверное окно времени в лимите скорости: {window}")
+        start_h, start_m, end_h, end_m = (int(group) for group in match.groups())
+        windows.append((start_h * 60 + start_m, end_h * 60 + end_m, parse_rate(rate)))
+    return windows, default
+
+def _in_window(minute, start, end):
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+class RateLimiter:
+    """Общий для всех задач token bucket с лимитом, зависящим от времени суток.
+
+    Запрос, на который не хватает токенов, уводит ведро в минус и ждёт, пока долг
+    не восполнится, поэтому одновременные задачи делят лимит, а не умножают его.
+    Работает и из асинхронного кода, и из потоков сжатия.
+    """
+
+    def __init__(self, name, spec):
+        self.name = name
+        try:
+            self._profile = parse_rate_profile(spec)
+        except ValueError as e:
+            logger.error(f"Лимит скорости {name} отключён: {e}")
+            self._profile = ([], 0)
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self._rate = None
+
+    def current_rate(self, now=None):
+        """Лимит в байтах в секунду на текущее время; 0 — без ограничения."""
+        now = now or datetime.now()
+        minute = now.hour * 60 + now.minute
+        windows, default = self._profile
+        for start, end, rate in windows:
+            if _in_window(minute, start, end):
+                return rate
+        return default
+
+    def _reserve(self, amount):
+        """Списание amount байт, возвращает время ожидания в секундах."""
+        rate = self.current_rate()
+        with self._lock:
+            if rate != self._rate:
+                logger.info(f"Лимит скорости {self.name}: {f'{rate / 1_048_576:.2f} МБ/с' if rate else 'без ограничения'}")
+                self._rate = rate
+                self._tokens = min(self._tokens, 0.0)
+            if not rate:
+                return 0
+            now = time.monotonic()
+            burst = rate * RATE_LIMIT_BURST_SECONDS
+            self._tokens = min(burst, self._tokens + (now - self._updated) * rate) - amount
+            self._updated = now
+            return -self._tokens / rate if self._tokens < 0 else 0
+
+    async def acquire(self, amount):
+        """Ожидание права передать amount байт."""
+        delay = self._reserve(amount)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self, amount):
+        """То же для кода, выполняющегося в отдельном потоке."""
+        delay = self._reserve(amount)
+        if delay > 0:
+            time.sleep(delay)
+
+async def iter_file(path, limiter, block_size=READ_BLOCK_SIZE):
+    """Чтение файла блоками с ограничением скорости (тело запроса aiohttp)."""
+    with open(path, 'rb') as f:
+        while True:
+            block = await asyncio.to_thread(f.read, block_size)
+            if not block:
+                return
+            await limiter.acquire(len(block))
+            yield block
+
+upload_limiter = RateLimiter('загрузки', RATE_LIMIT_UPLOAD)
+download_limiter = RateLimiter('скачивания', RATE_LIMIT_DOWNLOAD)
+disk_limiter = RateLimiter('записи архивов', RATE_LIMIT_DISK)
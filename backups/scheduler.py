@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+from datetime import datetime, timedelta
+from config.settings import DUMPS_DIR, BACKUP_SCHEDULE, SCHEDULE_CATCH_UP, logger
+
+SCHEDULE_STATE_FILE = DUMPS_DIR / '.schedule.json'
+SCHEDULE_ORIGIN = datetime(2000, 1, 1)  # Интервалы выравниваются от локальной полуночи этой даты
+MAX_JITTER_SHARE = 0.25  # Сдвиг не больше четверти промежутка между запусками
+_INTERVAL_RE = re.compile(r'^(\d+)\s*([smhd])$')
+_INTERVAL_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *'
+}
+
+class IntervalSchedule:
+    """Запуск каждые N секунд, выровненный по началу суток, а не по времени прошлого запуска."""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("Интервал расписания должен быть больше нуля")
+        self.seconds = seconds
+
+    def next_after(self, moment):
+        elapsed = (moment - SCHEDULE_ORIGIN).total_seconds()
+        return SCHEDULE_ORIGIN + timedelta(seconds=(elapsed // self.seconds + 1) * self.seconds)
+
+    def __str__(self):
+        return f"каждые {self.seconds} с"
+
+def _parse_cron_field(field, low, high):
+    """Множество значений поля cron: *, */n, a-b, a-b/n и списки через запятую."""
+    values = set()
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = int(step)
+            if step <= 0:
+                raise ValueError(f"Неверный шаг в поле cron: {field}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = (int(value) for value in part.split('-', 1))
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if start < low or end > high or start > end:
+            raise ValueError(f"Значение вне диапазона {low}-{high} в поле cron: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """Расписание в формате cron из пяти полей: минута, час, день месяца, месяц, день недели."""
+
+    def __init__(self, expression):
+        self.expression = _CRON_ALIASES.get(expression, expression)
+        fields = self.expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Выражение cron должно содержать 5 полей: {expression}")
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        # 0 и 7 — воскресенье; в datetime.weekday() воскресенье — 6
+        self.weekdays = {(day - 1) % 7 for day in _parse_cron_field(fields[4], 0, 7)}
+        # Как в cron: если заданы и день месяца, и день недели, достаточно совпадения одного из них
+        self.any_day = fields[2] == '*' or fields[4] == '*'
+
+    def _day_matches(self, moment):
+        day_ok = moment.day in self.days
+        weekday_ok = moment.weekday() in self.weekdays
+        return day_ok and weekday_ok if self.any_day else day_ok or weekday_ok
+
+    def next_after(self, moment):
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                month_start = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (month_start + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"Выражение cron никогда не срабатывает: {self.expression}")
+
+    def __str__(self):
+        return f"cron «{self.expression}»"
+
+def parse_schedule(spec):
+    """Расписание из строки: интервал (15m, 1h, 1d) или выражение cron (*/15 * * * *, @daily)."""
+    spec = spec.strip()
+    match = _INTERVAL_RE.match(spec)
+    if match:
+        return IntervalSchedule(int(match.group(1)) * _INTERVAL_UNITS[match.group(2)])
+    return CronSchedule(spec)
+
+def jitter_offset(key, jitter_seconds, schedule, now):
+    """Постоянный для базы сдвиг запуска: базы одного сервера стартуют в разное время."""
+    if jitter_seconds <= 0:
+        return timedelta(0)
+    first = schedule.next_after(now)
+    gap = (schedule.next_after(first) - first).total_seconds()
+    jitter_seconds = min(jitter_seconds, gap * MAX_JITTER_SHARE)
+    digest = int(hashlib.sha256(key.encode()).hexdigest()[:8], 16)
+    return timedelta(seconds=digest % max(1, int(jitter_seconds)))
+
+def load_schedule_state():
+    """Время последних плановых запусков по базам."""
+    if not SCHEDULE_STATE_FILE.exists():
+        return {}
+    try:
+        return json.loads(SCHEDULE_STATE_FILE.read_text(encoding='utf-8'))
+    except ValueError as e:
+        logger.warning(f"Повреждён файл состояния расписания {SCHEDULE_STATE_FILE}: {e}")
+        return {}
+
+def _save_schedule_state(state):
+    """Атомарная запись состояния расписания."""
+    tmp_path = SCHEDULE_STATE_FILE.with_name(f"{SCHEDULE_STATE_FILE.name}.tmp")
+    tmp_path.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp_path, SCHEDULE_STATE_FILE)
+
+class BackupScheduler:
+    """Планировщик бэкапов с отдельным расписанием для каждой базы.
+
+    Время запуска вычисляется от расписания, а не от окончания прошлого дампа, поэтому
+    не накапливает сдвиг. Запуск пропускается, если предыдущий дамп этой базы ещё идёт;
+    пропущенный за время простоя запуск выполняется сразу после старта.
+    """
+
+    def __init__(self, jobs, runner):
+        self._jobs = jobs
+        self._runner = runner
+        self._state = load_schedule_state()
+
+    def _record_run(self, key, slot):
+        """Сохранение времени успешного запуска для догоняющего бэкапа после простоя."""
+        self._state[key] = {'last_run': slot.isoformat(timespec='seconds')}
+        _save_schedule_state(self._state)
+
+    async def _run_once(self, key, db, db_type, slot):
+        """Один плановый бэкап; неудачный запуск не записывается и будет повторён после рестарта."""
+        try:
+            result = await self._runner(db, db_type)
+        except Exception as e:
+            logger.error(f"Ошибка планового бэкапа {key}: {e}")
+            return
+        if result:
+            self._record_run(key, slot)
+        else:
+            logger.warning(f"Плановый бэкап {key} не создан")
+
+    async def _run_db(self, key, db, db_type):
+        """Бесконечный цикл расписания одной базы."""
+        try:
+            schedule = parse_schedule(db.get('schedule') or BACKUP_SCHEDULE)
+        except ValueError as e:
+            logger.error(f"Неверное расписание для {key}: {e}, используется {BACKUP_SCHEDULE}")
+            schedule = parse_schedule(BACKUP_SCHEDULE)
+        offset = jitter_offset(key, db.get('jitter', 0), schedule, datetime.now())
+        logger.info(f"Расписание бэкапа {key}: {schedule}, сдвиг {int(offset.total_seconds())} с")
+
+        running = None
+        last_run = self._state.get(key, {}).get('last_run')
+        if SCHEDULE_CATCH_UP:
+            due = schedule.next_after(datetime.fromisoformat(last_run)) + offset if last_run else None
+            if due is None or due <= datetime.now():
+                logger.info(f"Бэкап {key} пропущен за время простоя (последний: {last_run or 'нет'}), запуск сейчас")
+                running = asyncio.create_task(self._run_once(key, db, db_type, datetime.now()))
+
+        while True:
+            slot = schedule.next_after(datetime.now() - offset)
+            fire_at = slot + offset
+            await asyncio.sleep(max(0, (fire_at - datetime.now()).total_seconds()))
+            if datetime.now() < fire_at:
+                # Сон прерван переводом часов, время пересчитывается
+                continue
+            if running and not running.done():
+                logger.warning(f"Предыдущий бэкап {key} ещё выполняется, запуск {slot:%H:%M %d.%m.%Y} пропущен")
+                continue
+            logger.debug(f"Плановый запуск бэкапа {key} (слот {slot:%H:%M %d.%m.%Y})")
+            running = asyncio.create_task(self._run_once(key, db, db_type, slot))
+
+    async def run(self):
+        """Запуск расписаний всех баз."""
+        await asyncio.gather(*(self._run_db(f"{db_type}:{name}", db, db_type) for db, db_type, name in self._jobs))
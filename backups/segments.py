@@ -0,0 +1,324 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from config.settings import DUMPS_DIR, UNCHANGED_MAX_AGE_HOURS, logger
+from backups.compression import open_dump_writer
+from backups.ratelimit import disk_limiter
+from backups.checksums import HashingFile, save_checksums, CHECKSUMS_SUFFIX
+from backups.utils import run_subprocess, stream_dump_to_archive, DUMP_CHUNK_SIZE, ARCHIVE_META_NAME
+
+SEGMENTS_DIR_NAME = '.segments'
+SEGMENTS_INDEX_NAME = 'index.json'
+SNAPSHOT_TIMEOUT = 60  # Ожидание экспорта снимка от psql, секунды
+# Задержка попадания изменений в pg_stat: до 10 с в PostgreSQL 15+ (PGSTAT_IDLE_INTERVAL),
+# 0.5 с у коллектора статистики в более старых версиях
+STATS_FLUSH_SECONDS = 11
+
+# Ручной и плановый запуски одной базы делят каталог сегментов и индекс — выполняются по очереди
+_segment_locks = {}
+
+# Сигнатура таблицы: счётчики изменений строк, файл данных (меняется при TRUNCATE),
+# состав колонок и время сброса статистики / старта сервера. NULL — таблицу нельзя
+# сравнить с прошлым дампом (реплика, отключённый track_counts, нет статистики).
+TABLE_SIGNATURES_SQL = """
+SELECT c.relname,
+    CASE WHEN s.relid IS NULL OR pg_is_in_recovery() OR current_setting('track_counts') <> 'on' THEN NULL
+    ELSE concat_ws(':', s.n_tup_ins, s.n_tup_upd, s.n_tup_del, pg_relation_filenode(c.oid),
+        pg_stat_get_db_stat_reset_time(d.oid), pg_postmaster_start_time(),
+        (SELECT md5(string_agg(a.attname || ' ' || format_type(a.atttypid, a.atttypmod), ',' ORDER BY a.attnum))
+         FROM pg_attribute a WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped)) END
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_database d ON d.datname = current_database()
+LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+WHERE n.nspname = 'public' AND c.relkind = 'r'
+ORDER BY c.relname;
+"""
+SEQUENCES_SQL = "SELECT sequencename FROM pg_sequences WHERE schemaname = 'public' ORDER BY sequencename;"
+
+def _psql_cmd(db):
+    """Базовая команда psql с выводом через табуляцию без заголовков."""
+    return [
+        'psql',
+        '-h', db['host'],
+        '-p', db['port'],
+        '-U', db['user'],
+        '-d', db['dbname'],
+        '-Atq',
+        '-F', '\t',
+        '-v', 'ON_ERROR_STOP=1'
+    ]
+
+def _table_pattern(name):
+    """Шаблон pg_dump -t, совпадающий ровно с одной таблицей схемы public."""
+    return 'public."' + name.replace('"', '""') + '"'
+
+def _segments_dir(db_name):
+    """Каталог кэша сегментов таблиц базы."""
+    return DUMPS_DIR / db_name / SEGMENTS_DIR_NAME
+
+def load_segments_index(db_name):
+    """Индекс закэшированных сегментов таблиц: {таблица: {signature, file, size, dumped_at}}."""
+    path = _segments_dir(db_name) / SEGMENTS_INDEX_NAME
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except ValueError as e:
+        logger.warning(f"Повреждён индекс сегментов {path}, все таблицы будут выгружены заново: {e}")
+        return {}
+
+def _save_segments_index(db_name, index):
+    path = _segments_dir(db_name) / SEGMENTS_INDEX_NAME
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(json.dumps(index, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp_path, path)
+
+def _remove_stale_segments(segments_dir, index):
+    """Удаление файлов сегментов, на которые больше не ссылается индекс, вместе с их контрольными суммами."""
+    keep = {entry['file'] for entry in index.values()}
+    for path in segments_dir.glob('*.sql.gz'):
+        if path.name not in keep:
+            path.unlink()
+    for path in segments_dir.glob(f'*.sql.gz{CHECKSUMS_SUFFIX}'):
+        if path.name[:-len(CHECKSUMS_SUFFIX)] not in keep:
+            path.unlink()
+
+def _is_reusable(entry, signature):
+    """Сегмент можно взять из кэша: сигнатура совпала и сегмент не старше интервала полного дампа."""
+    if not entry or not signature or entry.get('signature') != signature:
+        return False
+    dumped_at = datetime.fromisoformat(entry['dumped_at'])
+    return datetime.now() - dumped_at < timedelta(hours=UNCHANGED_MAX_AGE_HOURS)
+
+async def _query_rows(db, env, sql):
+    """Строки результата запроса psql, разбитые по табуляции."""
+    result = await run_subprocess(_psql_cmd(db) + ['-c', sql], env)
+    if result.returncode != 0:
+        raise RuntimeError(f"Ошибка запроса к {db['dbname']}: {result.stderr}")
+    return [line.split('\t') for line in result.stdout.splitlines() if line]
+
+async def _export_snapshot(db, env):
+    """Открытие сессии с экспортированным снимком; сессия должна жить до конца всех pg_dump."""
+    process = await asyncio.create_subprocess_exec(
+        *_psql_cmd(db),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env
+    )
+    try:
+        process.stdin.write(b"BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;\nSELECT pg_export_snapshot();\n")
+        await process.stdin.drain()
+        snapshot = (await asyncio.wait_for(process.stdout.readline(), SNAPSHOT_TIMEOUT)).decode().strip()
+        if not snapshot:
+            stderr = await asyncio.wait_for(process.stderr.read(), SNAPSHOT_TIMEOUT)
+            raise RuntimeError(f"Не удалось экспортировать снимок {db['dbname']}: {stderr.decode(errors='replace')}")
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    return process, snapshot
+
+async def _close_snapshot(process):
+    """Завершение сессии снимка."""
+    if process.returncode is not None:
+        return
+    try:
+        process.stdin.write(b"COMMIT;\n")
+        process.stdin.close()
+        await asyncio.wait_for(process.wait(), SNAPSHOT_TIMEOUT)
+    except (asyncio.TimeoutError, ConnectionError):
+        process.kill()
+        await process.wait()
+
+def _copy_limited(source, target):
+    """Копирование потока блоками с учётом лимита скорости записи."""
+    while True:
+        block = source.read(DUMP_CHUNK_SIZE)
+        if not block:
+            return
+        disk_limiter.acquire_sync(len(block))
+        target.write(block)
+
+def _assemble_segments(parts, archive_file, member, codec, level, meta=None):
+    """Сборка полного SQL дампа из gzip-сегментов в архив с подсчётом контрольных сумм.
+
+    meta — описание бэкапа, которое записывается в ZIP последним файлом.
+    """
+    if codec == 'chunked':
+        writer, sink = open_dump_writer(archive_file, member, codec, level), None
+    else:
+        sink = HashingFile(open(archive_file, 'wb'))
+        writer = sink if codec == 'gzip' else open_dump_writer(archive_file, member, codec, level, sink)
+    try:
+        for part in parts:
+            # Склейка gzip-потоков — корректный многочленный gzip, повторное сжатие не нужно
+            with (open(part, 'rb') if codec == 'gzip' else gzip.open(part, 'rb')) as f:
+                _copy_limited(f, writer)
+        if meta is not None and codec == 'zip':
+            writer.add_entry(ARCHIVE_META_NAME, json.dumps(meta, ensure_ascii=False, indent=2))
+    finally:
+        writer.close()
+    if sink is not None:
+        save_checksums(archive_file, sink.hasher)
+
+async def dump_postgres_segments(db, cmd, env, archive_file, member, codec='zip', level=None, jobs=1, manifest=None):
+    """Дамп PostgreSQL по сегментам таблиц с повторным использованием неизменённых сегментов.
+
+    Схема, последовательности и post-data выгружаются каждый раз, данные таблицы — только
+    если её счётчики изменений отличаются от закэшированного сегмента. Все pg_dump
+    работают на одном экспортированном снимке, поэтому собранный дамп согласован.
+    manifest получает смещения таблиц: описания — из секции pre-data, данных — по размерам сегментов.
+    Счётчики pg_stat обновляются с задержкой, поэтому после выгрузки они перечитываются и таблицы
+    из кэша, у которых сигнатура изменилась, выгружаются заново на том же снимке. Потерянные
+    коллектором статистики обновления (до PostgreSQL 15) так не поймать — их ограничивает
+    UNCHANGED_MAX_AGE_HOURS.
+    Запуски для одной базы сериализуются: они работают с общим индексом и каталогом сегментов.
+    """
+    lock = _segment_locks.setdefault(db['dbname'], asyncio.Lock())
+    if lock.locked():
+        logger.info(f"Дамп {db['dbname']} по сегментам ждёт завершения предыдущего запуска")
+    async with lock:
+        return await _dump_postgres_segments(db, cmd, env, archive_file, member, codec, level, jobs, manifest)
+
+async def _dump_postgres_segments(db, cmd, env, archive_file, member, codec, level, jobs, manifest):
+    db_name = db['dbname']
+    segments_dir = _segments_dir(db_name)
+    segments_dir.mkdir(exist_ok=True)
+    work_dir = segments_dir / f"{archive_file.name}.work"
+    work_dir.mkdir(exist_ok=True)
+    index = load_segments_index(db_name)
+    new_index = {}
+    stderr = []
+    dump_size = 0
+    returncode = 1
+    run_stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+    async def dump_part(extra_args, path, part_manifest=None):
+        nonlocal dump_size
+        result = await stream_dump_to_archive(
+            cmd + extra_args, env, path, path.name, codec='gzip', level=level, manifest=part_manifest
+        )
+        if result.returncode != 0:
+            stderr.append(result.stderr)
+            raise RuntimeError(f"pg_dump {' '.join(extra_args[2:])} завершился с кодом {result.returncode}")
+        dump_size += result.dump_size
+        return result.dump_size
+
+    try:
+        # Счётчики читаются до экспорта снимка: в индекс попадает сигнатура не новее данных
+        # в снимке, поэтому изменение между ними вызовет повторную выгрузку в следующий раз
+        tables = await _query_rows(db, env, TABLE_SIGNATURES_SQL)
+        snapshot_session, snapshot = await _export_snapshot(db, env)
+        snapshot_time = time.monotonic()
+        try:
+            snapshot_args = ['--snapshot', snapshot]
+            sequences = [row[0] for row in await _query_rows(db, env, SEQUENCES_SQL)]
+            pre_data = work_dir / 'pre-data.sql.gz'
+            # Секция pre-data идёт в начале дампа, смещения CREATE TABLE в ней совпадают со смещениями в дампе
+            pre_data_size = await dump_part(snapshot_args + ['--section=pre-data'], pre_data, manifest)
+
+            semaphore = asyncio.Semaphore(max(1, jobs))
+            table_parts = []
+            reused = 0
+
+            async def dump_table(name, signature):
+                async with semaphore:
+                    file_name = f"{hashlib.sha256(name.encode()).hexdigest()[:16]}_{run_stamp}.sql.gz"
+                    size = await dump_part(snapshot_args + ['--data-only', '-t', _table_pattern(name)], segments_dir / file_name)
+                    new_index[name] = {
+                        'signature': signature,
+                        'file': file_name,
+                        'size': size,
+                        'dumped_at': datetime.now().isoformat(timespec='seconds')
+                    }
+
+            async def dump_tables(tasks):
+                outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+                for outcome in outcomes:
+                    if isinstance(outcome, BaseException):
+                        raise outcome
+
+            tasks = []
+            signatures = {}
+            for name, signature in tables:
+                entry = index.get(name)
+                signatures[name] = signature or None
+                if _is_reusable(entry, signature) and (segments_dir / entry['file']).exists():
+                    new_index[name] = entry
+                    dump_size += entry['size']
+                    reused += 1
+                else:
+                    tasks.append(dump_table(name, signature or None))
+                table_parts.append(name)
+            await dump_tables(tasks)
+
+            if reused:
+                # Запись, закоммиченная до снимка, могла ещё не дойти до pg_stat при первом чтении
+                # счётчиков: перечитываем их после задержки сброса статистики
+                await asyncio.sleep(max(0, snapshot_time + STATS_FLUSH_SECONDS - time.monotonic()))
+                current = dict(await _query_rows(db, env, TABLE_SIGNATURES_SQL))
+                stale = [
+                    name for name in table_parts
+                    if new_index[name] is index.get(name) and name in current and (current[name] or None) != signatures[name]
+                ]
+                for name in stale:
+                    dump_size -= new_index[name]['size']
+                    reused -= 1
+                if stale:
+                    logger.info(f"Счётчики изменений {db_name} обновились после снимка, таблиц к повторной выгрузке: {len(stale)}")
+                await dump_tables([dump_table(name, signatures[name]) for name in stale])
+
+            parts = [pre_data] + [segments_dir / new_index[name]['file'] for name in table_parts]
+            if sequences:
+                sequences_part = work_dir / 'sequences.sql.gz'
+                sequence_args = ['--data-only']
+                for sequence in sequences:
+                    sequence_args += ['-t', _table_pattern(sequence)]
+                await dump_part(snapshot_args + sequence_args, sequences_part)
+                parts.append(sequences_part)
+            post_data = work_dir / 'post-data.sql.gz'
+            await dump_part(snapshot_args + ['--section=post-data'], post_data)
+            parts.append(post_data)
+        finally:
+            await _close_snapshot(snapshot_session)
+
+        meta = None
+        if manifest is not None:
+            offsets = {name: dict(entry) for name, entry in manifest.indexer.tables.items()}
+            offset = pre_data_size
+            for name in table_parts:
+                offsets.setdefault(name, {})['data_offset'] = offset
+                offset += new_index[name]['size']
+            manifest.offsets = offsets
+            meta = manifest.finish(dump_size)
+        await asyncio.to_thread(_assemble_segments, parts, archive_file, member, codec, level, meta)
+        if meta is not None and codec == 'zip':
+            manifest.embedded = True
+        logger.info(
+            f"Дамп {db_name} собран из сегментов: таблиц {len(table_parts)}, "
+            f"выгружено заново {len(table_parts) - reused}, из кэша {reused}"
+        )
+        returncode = 0
+    except Exception as e:
+        logger.error(f"Ошибка дампа {db_name} по сегментам: {e}")
+    finally:
+        # Успешно выгруженные сегменты остаются в индексе и пригодятся при следующем запуске
+        index.update(new_index)
+        if returncode == 0:
+            index = new_index
+        await asyncio.to_thread(_save_segments_index, db_name, index)
+        await asyncio.to_thread(_remove_stale_segments, segments_dir, index)
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+    return type('DumpResult', (), {
+        'returncode': returncode,
+        'stderr': ''.join(stderr),
+        'dump_size': dump_size
+    })()
@@ -1,9 +1,24 @@
 import zipfile
 import asyncio
-from config.settings import DUMPS_DIR, MIN_DUMP_SIZE, logger
+import json
+import shutil
+from config.settings import DUMPS_DIR, MIN_DUMP_SIZE, LOCAL_RETENTION_DAYS, logger
+from backups.dedup import collect_garbage_chunks
+from backups.compression import open_dump_writer, open_dump_reader, ARCHIVE_SUFFIXES
+from backups.ratelimit import disk_limiter
+from backups.checksums import HashingFile, save_checksums, discard_checksums, CHECKSUMS_SUFFIX
+from backups.manifest import BACKUP_MANIFEST_SUFFIX, save_manifest, load_manifest, discard_manifest, manifest_created_at
+from storage.file_exchange import UPLOAD_STATE_SUFFIX
+from storage.upload_queue import upload_queue
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 
+DUMP_CHUNK_SIZE = 1024 * 1024  # Размер блока при чтении вывода утилиты дампа
+DUMP_SCAN_LIMIT = 16 * 1024 * 1024  # Сколько байт распакованного дампа просматривается при проверке
+DUMP_HEAD_MAX_BYTES = 256 * 1024  # Предел начала дампа для определения типа (строки INSERT бывают очень длинными)
+DUMP_TABLE_KEYWORDS = (b'create table', b'insert into')
+ARCHIVE_META_NAME = 'backup_meta.json'  # Служебный файл с описанием формата внутри архива
+
 async def run_subprocess(cmd, env):
     """Run subprocess using asyncio to avoid blocking."""
     logger.debug("Вызов run_subprocess с командой: %s", cmd)
@@ -20,42 +35,266 @@ async def run_subprocess(cmd, env):
         'stderr': stderr.decode()
     })()
 
-async def get_file_size(dump_file):
-    """Get file size in a separate thread."""
-    return await asyncio.to_thread(lambda: dump_file.stat().st_size)
+async def stream_dump_to_archive(cmd, env, archive_file, arcname, codec='zip', level=None, fileobj=None, manifest=None):
+    """Потоковое сжатие вывода утилиты дампа в архив без промежуточного файла на диске.
+
+    fileobj — поток, в который пишется архив вместо archive_file (см. open_dump_writer).
+    Контрольные суммы архива считаются при записи и сохраняются рядом с ним.
+    manifest — BackupManifest: индексирует несжатый поток, а в ZIP записывается
+    последним файлом до закрытия архива, поэтому суммы остаются верными.
+    """
+    logger.debug("Вызов stream_dump_to_archive с командой: %s", cmd)
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=env
+    )
+    # stderr читается параллельно, иначе переполненный буфер остановит утилиту дампа
+    stderr_task = asyncio.create_task(process.stderr.read())
+    dump_size = 0
+    sink = None
+
+    def open_writer():
+        nonlocal sink
+        if codec != 'chunked':
+            # Манифест чанков пишется не потоком, его суммы считаются при загрузке
+            sink = HashingFile(fileobj or open(archive_file, 'wb'))
+        try:
+            return open_dump_writer(archive_file, arcname, codec, level, sink)
+        except BaseException:
+            if sink is not None:
+                sink.close()
+            raise
+
+    def write_block(chunk):
+        if manifest is not None:
+            manifest.update(chunk)
+        writer.write(chunk)
+
+    try:
+        writer = await asyncio.to_thread(open_writer)
+        try:
+            while True:
+                chunk = await process.stdout.read(DUMP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                dump_size += len(chunk)
+                # Лимит считается по несжатому потоку: на диск попадает не больше
+                await disk_limiter.acquire(len(chunk))
+                await asyncio.to_thread(write_block, chunk)
+            await process.wait()
+            if manifest is not None and codec == 'zip' and process.returncode == 0:
+                meta = json.dumps(manifest.finish(dump_size), ensure_ascii=False, indent=2)
+                await asyncio.to_thread(writer.add_entry, ARCHIVE_META_NAME, meta)
+                manifest.embedded = True
+        finally:
+            await asyncio.to_thread(writer.close)
+        await process.wait()
+        if sink is not None and process.returncode == 0:
+            await asyncio.to_thread(save_checksums, archive_file, sink.hasher)
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        stderr_task.cancel()
+        raise
+    stderr = await stderr_task
+    return type('DumpResult', (), {
+        'returncode': process.returncode,
+        'stderr': stderr.decode(errors='replace'),
+        'dump_size': dump_size
+    })()
+
+def _archive_directory(src_dir, zip_file, arcroot):
+    """Упаковка каталога в ZIP без сжатия (файлы уже сжаты утилитой дампа)."""
+    with zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path in sorted(src_dir.rglob('*')):
+            if path.is_file():
+                archive.write(path, f"{arcroot}/{path.relative_to(src_dir).as_posix()}")
+
+async def pack_directory_to_archive(staging_dir, zip_file, arcroot):
+    """Упаковка готового каталога дампа в ZIP, возвращает суммарный размер файлов."""
+    dump_size = await asyncio.to_thread(lambda: sum(p.stat().st_size for p in staging_dir.rglob('*') if p.is_file()))
+    await asyncio.to_thread(_archive_directory, staging_dir, zip_file, arcroot)
+    logger.info(f"Каталог дампа {staging_dir} упакован в {zip_file}")
+    return dump_size
+
+async def dump_directory_to_archive(cmd, env, staging_dir, zip_file, arcroot):
+    """Дамп в каталог (pg_dump -Fd) с последующей упаковкой каталога в ZIP."""
+    try:
+        result = await run_subprocess(cmd + ['-f', str(staging_dir)], env)
+        dump_size = 0
+        if result.returncode == 0 and staging_dir.is_dir():
+            dump_size = await pack_directory_to_archive(staging_dir, zip_file, arcroot)
+    finally:
+        await unlink_file(staging_dir)
+    return type('DumpResult', (), {
+        'returncode': result.returncode,
+        'stderr': result.stderr,
+        'dump_size': dump_size
+    })()
+
+async def write_archive_meta(zip_file, meta):
+    """Добавление описания формата бэкапа в архив."""
+    def _write():
+        # Архив дописывается, суммы пересчитаются при загрузке
+        discard_checksums(zip_file)
+        with zipfile.ZipFile(zip_file, 'a') as archive:
+            archive.writestr(ARCHIVE_META_NAME, json.dumps(meta, ensure_ascii=False, indent=2))
+    await asyncio.to_thread(_write)
+
+async def write_backup_manifest(archive_file, manifest, dump_size):
+    """Запись описания бэкапа рядом с архивом и, для ZIP, внутрь архива, если его там ещё нет."""
+    data = manifest.finish(dump_size)
+    if archive_file.suffix == '.zip' and not manifest.embedded:
+        await write_archive_meta(archive_file, data)
+        manifest.embedded = True
+    return await asyncio.to_thread(save_manifest, archive_file, data)
+
+async def read_backup_manifest(archive_file):
+    """Описание бэкапа: файл рядом с архивом, для ZIP без него — описание внутри архива."""
+    manifest = await asyncio.to_thread(load_manifest, archive_file)
+    if manifest is None and archive_file.suffix == '.zip':
+        manifest = await read_archive_meta(archive_file)
+    return manifest
+
+async def read_archive_meta(zip_file):
+    """Чтение описания формата бэкапа из архива (None для архивов без описания)."""
+    def _read():
+        with zipfile.ZipFile(zip_file, 'r') as archive:
+            if ARCHIVE_META_NAME not in archive.namelist():
+                return None
+            return json.loads(archive.read(ARCHIVE_META_NAME))
+    return await asyncio.to_thread(_read)
+
+async def extract_archive_dump(zip_file, meta, target_dir):
+    """Распаковка дампа в формате directory/custom, возвращает путь для pg_restore."""
+    member = meta['member']
+    def _extract():
+        with zipfile.ZipFile(zip_file, 'r') as archive:
+            names = [n for n in archive.namelist() if n == member or n.startswith(f"{member}/")]
+            archive.extractall(target_dir, members=names)
+    await asyncio.to_thread(_extract)
+    return target_dir / member
+
+def _decode_dump_text(data):
+    """Текст начала дампа: UTF-8, а для дампов в другой кодировке — latin1 (декодирует любые байты)."""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start >= len(data) - 3:
+            # Начало обрезано посреди многобайтового символа
+            return data[:e.start].decode('utf-8')
+        return data.decode('latin1')
+
+def _scan_dump(dump_file, keywords, head_lines, limit):
+    reader = open_dump_reader(dump_file)
+    try:
+        overlap = max((len(keyword) for keyword in keywords), default=1) - 1
+        head = bytearray()
+        tail = b''
+        scanned = 0
+        found = None
+        complete = False
+        while True:
+            head_done = head.count(b'\n') >= head_lines or len(head) >= DUMP_HEAD_MAX_BYTES
+            if found or scanned >= limit or (head_done and not keywords):
+                break
+            block = reader.read(min(DUMP_CHUNK_SIZE, limit - scanned))
+            if not block:
+                complete = True
+                break
+            scanned += len(block)
+            if not head_done:
+                head += block[:DUMP_HEAD_MAX_BYTES - len(head)]
+            if keywords:
+                # Ключевые слова — ASCII: поиск по байтам одинаков для UTF-8 и latin1 и не требует декодирования
+                window = tail + block.lower()
+                found = next((keyword for keyword in keywords if keyword in window), None)
+                tail = window[-overlap:] if overlap else b''
+        if not complete and not found and scanned >= limit:
+            complete = not reader.read(1)
+    finally:
+        reader.close()
+    lines = bytes(head).splitlines(keepends=True)[:head_lines]
+    return type('DumpScan', (), {
+        'found': found.decode() if found else None,
+        'complete': complete,
+        'scanned': scanned,
+        'head': _decode_dump_text(b''.join(lines))
+    })()
+
+async def scan_dump(dump_file, keywords=DUMP_TABLE_KEYWORDS, head_lines=100, limit=DUMP_SCAN_LIMIT):
+    """Проверка дампа (.sql или архива с ним) без чтения целиком.
+
+    Ищет первое из keywords без учёта регистра в первых limit байтах распакованного дампа
+    и останавливается на первом совпадении; заодно возвращает первые head_lines строк для
+    определения типа. complete — дамп просмотрен до конца (отсутствие совпадения окончательно).
+    """
+    return await asyncio.to_thread(_scan_dump, dump_file, keywords, head_lines, limit)
 
 async def read_file_lines(dump_file, num_lines=10):
-    """Read first N lines of file in a separate thread."""
-    return await asyncio.to_thread(lambda: ''.join(open(dump_file, 'r', encoding='utf-8').readlines()[:num_lines]))
+    """Первые num_lines строк дампа (в том числе из архива) без чтения файла целиком."""
+    return (await scan_dump(dump_file, keywords=(), head_lines=num_lines, limit=DUMP_HEAD_MAX_BYTES)).head
 
 async def unlink_file(file_path):
-    """Delete file in a separate thread."""
-    if file_path.exists():
+    """Delete file (or dump directory) in a separate thread."""
+    if file_path.is_dir():
+        await asyncio.to_thread(shutil.rmtree, file_path)
+        logger.debug(f"Удалён каталог: {file_path}")
+    elif file_path.exists():
         await asyncio.to_thread(file_path.unlink)
+        await asyncio.to_thread(discard_checksums, file_path)
+        await asyncio.to_thread(discard_manifest, file_path)
         logger.debug(f"Удалён файл: {file_path}")
 
-async def async_archive_dump(dump_file):
-    """Архивирование дампа в ZIP и удаление оригинала в отдельном потоке."""
-    try:
-        zip_file = dump_file.with_suffix('.zip')
-        await asyncio.to_thread(lambda: zipfile.ZipFile(zip_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=9).write(dump_file, dump_file.name))
-        logger.info(f"Архивирован дамп в: {zip_file}")
-        await unlink_file(dump_file)
-        return zip_file
-    except Exception as e:
-        logger.error(f"Не удалось архивировать {dump_file}: {e}")
-        return None
+def _remove_orphan_sidecar(path):
+    """Удаление служебного файла (суммы, описание, состояние загрузки), если его архива уже нет.
+
+    Возвращает True для любого служебного файла архива.
+    """
+    for suffix in (CHECKSUMS_SUFFIX, BACKUP_MANIFEST_SUFFIX, UPLOAD_STATE_SUFFIX):
+        if path.name.endswith(suffix):
+            if not path.with_name(path.name[:-len(suffix)]).exists():
+                path.unlink()
+                logger.debug(f"Удалён служебный файл удалённого архива: {path}")
+            return True
+    return False
+
+def _archive_created_at(archive_file):
+    """Время создания архива по его описанию, без описания — по времени изменения файла.
+
+    Время изменения сбивается при копировании архива и дописывании в него, время из описания — нет.
+    """
+    manifest = load_manifest(archive_file)
+    created_at = manifest_created_at(manifest) if manifest else None
+    if created_at is not None:
+        return created_at.astimezone(timezone.utc)
+    return datetime.fromtimestamp(archive_file.stat().st_mtime, tz=timezone.utc)
 
 def cleanup_old_archives():
-    """Удаление ZIP-архивов старше 30 дней."""
-    threshold = datetime.now(timezone.utc) - timedelta(days=30)
+    """Удаление архивов старше LOCAL_RETENTION_DAYS дней и неиспользуемых чанков."""
+    threshold = datetime.now(timezone.utc) - timedelta(days=LOCAL_RETENTION_DAYS)
     for db_dir in DUMPS_DIR.iterdir():
         if db_dir.is_dir():
-            for zip_file in db_dir.glob('*.zip'):
-                mtime = datetime.fromtimestamp(zip_file.stat().st_mtime, tz=timezone.utc)
-                if mtime < threshold:
+            for archive_file in db_dir.iterdir():
+                if _remove_orphan_sidecar(archive_file):
+                    continue
+                if not archive_file.is_file() or archive_file.suffix not in ARCHIVE_SUFFIXES:
+                    continue
+                created_at = _archive_created_at(archive_file)
+                if created_at < threshold and upload_queue.is_pending(archive_file):
+                    logger.warning(f"Старый архив {archive_file} ещё не загружен в хранилища, не удаляется")
+                elif created_at < threshold:
                     try:
-                        zip_file.unlink()
-                        logger.info(f"Удалён старый архив: {zip_file}")
+                        archive_file.unlink()
+                        discard_checksums(archive_file)
+                        discard_manifest(archive_file)
+                        logger.info(f"Удалён старый архив: {archive_file}")
                     except Exception as e:
-                        logger.error(f"Не удалось удалить {zip_file}: {e}")
\ No newline at end of file
+                        logger.error(f"Не удалось удалить {archive_file}: {e}")
+    try:
+        collect_garbage_chunks()
+    except Exception as e:
+        logger.error(f"Не удалось очистить хранилище чанков: {e}")
\ No newline at end of file
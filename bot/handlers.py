@@ -1,4 +1,6 @@
-from config.settings import telegram_bot, dp, ADMIN_LIST, logger, DUMPS_DIR, ERROR_DUMPS_DIR, ALL_DBS
+from config.settings import (
+    telegram_bot, dp, ADMIN_LIST, logger, DUMPS_DIR, ERROR_DUMPS_DIR, ALL_DBS, RESTORE_JOBS, CATALOG_PAGE_SIZE
+)
 from bot.states import DeployStates, BackupCreateStates
 from aiogram import types
 from aiogram.filters import Command
@@ -6,17 +8,67 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.exceptions import TelegramBadRequest
 from pathlib import Path
-from deploy.deploy import deploy_dump
-from backups.utils import run_subprocess, read_file_lines, unlink_file, async_archive_dump
+from deploy.deploy import deploy_dump, check_database_exists
+from backups.utils import (
+    scan_dump, unlink_file, read_backup_manifest, extract_archive_dump
+)
 from backups.manager import create_backup_for_db
+from backups.mysql_parallel import PARALLEL_FORMAT
+from backups.manifest import describe_manifest
+from backups.catalog import backup_catalog, CATALOG_SUFFIXES
+from storage.remote_index import remote_index, is_offsite
+from storage.fanout import unsupported_storages
 import zipfile
-import os
 import asyncio
 from datetime import datetime
 
 # Диагностика
 logger.debug(f"Инициализация handlers.py, dp id: {id(dp)}")
 
+async def _cleanup_deploy_files(dump_path, temp_file, temp_zip):
+    """Удаление временных файлов развёртывания; архивы и дампы из хранилища не удаляются."""
+    if temp_file and temp_file.exists():
+        await unlink_file(temp_file)
+        logger.debug(f"Удалён временный файл: {temp_file}")
+    # Распакованными бывают только форматы directory/custom, они лежат прямо в DUMPS_DIR
+    if dump_path and dump_path.exists() and dump_path not in (temp_file, temp_zip) and dump_path.parent == DUMPS_DIR:
+        await unlink_file(dump_path)
+        logger.debug(f"Удалён временный дамп: {dump_path}")
+    if temp_zip and temp_zip.exists():
+        logger.debug(f"Архив {temp_zip} оставлен в хранилище")
+
+def _db_type_for(db_name):
+    """Тип дампа для развёртывания по настроенной базе: postgresql или mysql (MySQL и MariaDB)."""
+    db = next((db for db in ALL_DBS if db['name'] == db_name), None)
+    return 'postgresql' if db is None or db['type'] == 'PostgreSQL' else 'mysql'
+
+RESTORE_JOBS_CHOICES = (1, 2, 4, 8, 16)
+RESTORE_JOBS_MAX = 64
+PARALLEL_RESTORE_FORMATS = ('directory', 'custom', PARALLEL_FORMAT)  # Форматы, которые восстанавливаются в несколько потоков
+
+def _is_packed_format(archive_meta):
+    """Многофайловый формат: распаковывается из ZIP перед восстановлением и восстанавливается в несколько потоков."""
+    return bool(archive_meta) and archive_meta.get('format') in PARALLEL_RESTORE_FORMATS
+
+def _restore_jobs_prompt(db_type, archive_meta):
+    """Текст и клавиатура выбора числа потоков восстановления."""
+    default = max(1, RESTORE_JOBS or int(archive_meta.get('jobs', 1)))
+    buttons = [
+        InlineKeyboardButton(text=f"✅ {jobs}" if jobs == default else str(jobs), callback_data=f"restore_jobs:{jobs}")
+        for jobs in sorted(set(RESTORE_JOBS_CHOICES) | {default})
+    ]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        buttons,
+        [InlineKeyboardButton(text="Назад", callback_data="back_to_dump")],
+        [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+    ])
+    text = (
+        f"Дамп принят ({'PostgreSQL' if db_type == 'postgresql' else 'MySQL'}, формат {archive_meta.get('format')}). "
+        f"⬇️ <b>Выберите число параллельных потоков восстановления или введите своё (1–{RESTORE_JOBS_MAX}).</b>\n"
+        f"Данные и индексы загружаются в указанное число соединений с сервером."
+    )
+    return text, keyboard
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Обработка команды /start."""
@@ -34,10 +86,11 @@ async def cmd_backup_deploy(message: types.Message, state: FSMContext):
     
     try:
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📂 Выбрать из списка", callback_data="cat:dbs:0")],
             [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
         ])
         sent_message = await message.reply(
-            "⬇️ <b>Отправьте файл дампа (.sql или .zip) или укажите его название ниже</b>",
+            "⬇️ <b>Отправьте файл дампа (.sql или .zip), укажите его название ниже или выберите из списка</b>",
             reply_markup=keyboard,
             parse_mode="HTML"
         )
@@ -129,10 +182,17 @@ async def process_db_selection(callback: types.CallbackQuery, state: FSMContext)
         
         # Формируем сообщение с HTML, имя дампа в рамочке и кликабельное
         timestamp = datetime.now().strftime("%H:%M %d.%m.%Y")
+        # Размеры и таблицы — из описания бэкапа; у пропущенного неизменённого дампа его нет
+        manifest_line = f"📦 <b>Бэкап</b>: {describe_manifest(result['manifest'])}\n" if result.get('manifest') else ""
+        unsupported = unsupported_storages(result.get('uploads'))
+        no_copy_line = f"⚠️ <b>Без копии</b>: {', '.join(unsupported)} (нет хранилища чанков)\n" if unsupported else ""
         response = (
             f"<b>✅ Создание бэкапа завершено!</b>\n\n"
             f"🗄️ <b>База</b>: {db_name}\n"
             f"📁 <b>Файл</b>: <a href=\"tg://btn/copy_file:{result['archive']}\"><code>{result['archive']}</code></a>\n"
+            f"{manifest_line}"
+            f"☁️ <b>Я.Диск</b>: {'есть' if is_offsite(db_name, result['archive']) else 'нет'}\n"
+            f"{no_copy_line}"
             f"📅 <b>Время создания</b>: {timestamp}"
         )
         
@@ -246,10 +306,17 @@ async def retry_backup(callback: types.CallbackQuery, state: FSMContext):
             return
         
         timestamp = datetime.now().strftime("%H:%M %d.%m.%Y")
+        # Размеры и таблицы — из описания бэкапа; у пропущенного неизменённого дампа его нет
+        manifest_line = f"📦 <b>Бэкап</b>: {describe_manifest(result['manifest'])}\n" if result.get('manifest') else ""
+        unsupported = unsupported_storages(result.get('uploads'))
+        no_copy_line = f"⚠️ <b>Без копии</b>: {', '.join(unsupported)} (нет хранилища чанков)\n" if unsupported else ""
         response = (
             f"<b>✅ Создание бэкапа завершено!</b>\n\n"
             f"🗄️ <b>База</b>: {db_name}\n"
             f"📁 <b>Файл</b>: <a href=\"tg://btn/copy_file:{result['archive']}\"><code>{result['archive']}</code></a>\n"
+            f"{manifest_line}"
+            f"☁️ <b>Я.Диск</b>: {'есть' if is_offsite(db_name, result['archive']) else 'нет'}\n"
+            f"{no_copy_line}"
             f"📅 <b>Время создания</b>: {timestamp}"
         )
         
@@ -315,19 +382,40 @@ async def deploy_backup(callback: types.CallbackQuery, state: FSMContext):
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
         ])
-        sent_message = await callback.message.reply(
-            f"Вы выбрали для развертывания: {archive_name}. ⬇️ <b>Укажите IP удалённого сервера.</b>",
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
+        entry = backup_catalog.get(archive_name)
+        if entry is None or not entry['local']:
+            text = f"Архив {archive_name} не найден в {DUMPS_DIR}."
+            if entry:
+                text += f"\n☁️ Архив есть только на Яндекс.Диске: {entry['remote_path']}"
+            await callback.message.reply(text, reply_markup=keyboard)
+            await callback.answer()
+            return
+        archive_path = entry['path']
+        # Описание бэкапа читается из файла рядом с архивом, сам архив не открывается
+        archive_meta = await read_backup_manifest(archive_path)
+        dump_path = archive_path
+        if _is_packed_format(archive_meta):
+            # Формат directory/custom/parallel восстанавливается из распакованного каталога
+            dump_path = await extract_archive_dump(archive_path, archive_meta, DUMPS_DIR)
+        db_type = archive_meta.get('engine', 'postgresql') if archive_meta else _db_type_for(entry['db_name'])
+        if _is_packed_format(archive_meta):
+            text, keyboard = _restore_jobs_prompt(db_type, archive_meta)
+            next_state = DeployStates.waiting_for_jobs
+        else:
+            text = f"Вы выбрали для развертывания: {archive_name}. ⬇️ <b>Укажите IP удалённого сервера.</b>"
+            next_state = DeployStates.waiting_for_ip
+        sent_message = await callback.message.reply(text, reply_markup=keyboard, parse_mode="HTML")
         await state.update_data(
             current_message_id=sent_message.message_id,
             chat_id=sent_message.chat.id,
-            dump_path=str(DUMPS_DIR / archive_name.split('_')[0] / archive_name),
-            db_type='postgresql' if 'opengater_prod' in archive_name else 'mysql' if 'opengater_test' in archive_name else 'mariadb'
+            dump_path=str(dump_path),
+            db_type=db_type,
+            temp_file=None,
+            temp_zip=archive_path,
+            restore_jobs=archive_meta.get('jobs', 1) if archive_meta else 1
         )
-        await state.set_state(DeployStates.waiting_for_ip)
-        logger.debug(f"Установлено состояние DeployStates.waiting_for_ip для развертывания {archive_name}")
+        await state.set_state(next_state)
+        logger.debug(f"Установлено состояние {next_state.state} для развертывания {archive_name}")
         await callback.answer()
     except Exception as e:
         logger.error(f"Ошибка в deploy_backup: {e}")
@@ -374,6 +462,82 @@ async def cancel_deploy(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
 
+def _catalog_page(items, page):
+    """Страница списка каталога: (элементы, номер страницы, число страниц)."""
+    size = max(1, CATALOG_PAGE_SIZE)
+    pages = max(1, (len(items) + size - 1) // size)
+    page = min(max(0, page), pages - 1)
+    return items[page * size:(page + 1) * size], page, pages
+
+def _catalog_keyboard(rows, prefix, page, pages, back=None):
+    """Кнопки страницы каталога с переходом по страницам, возвратом и отменой."""
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"{prefix}:{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"{prefix}:{page + 1}"))
+    if navigation:
+        rows.append(navigation)
+    if back:
+        rows.append([InlineKeyboardButton(text="Назад", callback_data=back)])
+    rows.append([InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def _catalog_view(data):
+    """Текст и клавиатура страницы каталога по данным callback: базы, дни базы или бэкапы за день."""
+    _, level, rest = data.split(':', 2)
+    if level == 'dbs':
+        items, page, pages = _catalog_page(backup_catalog.databases(), int(rest))
+        rows = [
+            [InlineKeyboardButton(text=f"{db_name} ({count})", callback_data=f"cat:days:{db_name}:0")]
+            for db_name, count in items
+        ]
+        text = f"📂 <b>Базы с бэкапами</b> (стр. {page + 1}/{pages})" if items else "В хранилище нет бэкапов."
+        return text, _catalog_keyboard(rows, "cat:dbs", page, pages)
+    if level == 'days':
+        db_name, page = rest.rsplit(':', 1)
+        items, page, pages = _catalog_page(backup_catalog.days(db_name), int(page))
+        rows = [
+            [InlineKeyboardButton(text=f"{day:%d.%m.%Y} ({count})", callback_data=f"cat:day:{db_name}:{day:%Y%m%d}:0")]
+            for day, count in items
+        ]
+        text = f"📂 <b>{db_name}</b>: дни с бэкапами (стр. {page + 1}/{pages})" if items else f"Бэкапов {db_name} нет."
+        return text, _catalog_keyboard(rows, f"cat:days:{db_name}", page, pages, back="cat:dbs:0")
+    db_name, day, page = rest.rsplit(':', 2)
+    day = datetime.strptime(day, "%Y%m%d").date()
+    items, page, pages = _catalog_page(backup_catalog.archives(db_name, day), int(page))
+    rows = []
+    for entry in items:
+        label = f"{entry['created_at']:%H:%M:%S} · {entry['name']}"
+        if entry['remote_path']:
+            label += " ☁️"
+        if not entry['local']:
+            label += " (только Я.Диск)"
+        rows.append([InlineKeyboardButton(text=label, callback_data=f"deploy_backup:{entry['name']}")])
+    text = (
+        f"📂 <b>{db_name}</b>, {day:%d.%m.%Y} (стр. {page + 1}/{pages}). ⬇️ <b>Выберите бэкап для развёртывания.</b>"
+        if items else f"Бэкапов {db_name} за {day:%d.%m.%Y} нет."
+    )
+    return text, _catalog_keyboard(rows, f"cat:day:{db_name}:{day:%Y%m%d}", page, pages, back=f"cat:days:{db_name}:0")
+
+@dp.callback_query(lambda c: c.data.startswith("cat:"))
+async def browse_catalog(callback: types.CallbackQuery, state: FSMContext):
+    """Выбор бэкапа для развёртывания по страницам: база, день, архив."""
+    logger.debug(f"Получен callback каталога от пользователя {callback.from_user.id}: {callback.data}")
+    if str(callback.from_user.id) not in ADMIN_LIST:
+        await callback.answer(text="Доступ запрещён: вы не админ.", show_alert=True)
+        return
+    try:
+        text, keyboard = _catalog_view(callback.data)
+        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except TelegramBadRequest as e:
+        # Повторное нажатие на ту же страницу: сообщение не изменилось
+        logger.debug(f"Страница каталога не обновлена: {e}")
+    except Exception as e:
+        logger.error(f"Ошибка в browse_catalog: {e}")
+        await callback.message.edit_text(f"Ошибка при просмотре бэкапов: {e}")
+    await callback.answer()
+
 @dp.message(DeployStates.waiting_for_dump)
 async def process_dump(message: types.Message, state: FSMContext):
     """Обработка дампа (файл или название)."""
@@ -384,20 +548,21 @@ async def process_dump(message: types.Message, state: FSMContext):
     dump_path = None
     temp_file = None
     temp_zip = None
+    archive_meta = None
     try:
         if message.document:
             logger.debug("Получен файл дампа через Telegram")
             file = await telegram_bot.get_file(message.document.file_id)
             file_path = file.file_path
             file_name = message.document.file_name
-            if not file_name.endswith(('.sql', '.zip')):
+            if not file_name.endswith(('.sql', '.zip', '.zst', '.gz')):
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
                 ])
                 await telegram_bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=current_message_id,
-                    text="Неподдерживаемый формат файла. Отправьте .sql или .zip.",
+                    text="Неподдерживаемый формат файла. Отправьте .sql, .zip, .sql.zst или .sql.gz.",
                     reply_markup=keyboard
                 )
                 logger.warning(f"Получен неподдерживаемый файл: {file_name}")
@@ -408,160 +573,167 @@ async def process_dump(message: types.Message, state: FSMContext):
             logger.debug(f"Скачан файл дампа: {temp_file}")
             
             if file_name.endswith('.zip'):
-                with zipfile.ZipFile(temp_file, 'r') as zf:
-                    sql_files = [f for f in zf.namelist() if f.endswith('.sql')]
-                    if not sql_files:
-                        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
-                        ])
-                        await telegram_bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=current_message_id,
-                            text="ZIP-архив не содержит .sql файлов.",
-                            reply_markup=keyboard
-                        )
-                        await unlink_file(temp_file)
-                        logger.error(f"ZIP-архив {temp_file} не содержит .sql файлов")
-                        return
-                    if len(sql_files) > 1:
-                        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
-                        ])
-                        await telegram_bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=current_message_id,
-                            text="ZIP-архив содержит несколько .sql файлов. Отправьте архив с одним файлом.",
-                            reply_markup=keyboard
-                        )
-                        await unlink_file(temp_file)
-                        logger.error(f"ZIP-архив {temp_file} содержит несколько .sql файлов")
-                        return
-                    zf.extract(sql_files[0], DUMPS_DIR)
-                    dump_path = DUMPS_DIR / sql_files[0]
-                await unlink_file(temp_file)
-                logger.debug(f"Распакован ZIP, дамп: {dump_path}")
+                archive_meta = await read_backup_manifest(temp_file)
+                if _is_packed_format(archive_meta):
+                    dump_path = await extract_archive_dump(temp_file, archive_meta, DUMPS_DIR)
+                elif archive_meta:
+                    # Архив с описанием создан ботом и содержит один .sql
+                    dump_path = temp_file
+                else:
+                    with zipfile.ZipFile(temp_file, 'r') as zf:
+                        sql_files = [f for f in zf.namelist() if f.endswith('.sql')]
+                        if not sql_files:
+                            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                                [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+                            ])
+                            await telegram_bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=current_message_id,
+                                text="ZIP-архив не содержит .sql файлов.",
+                                reply_markup=keyboard
+                            )
+                            await unlink_file(temp_file)
+                            logger.error(f"ZIP-архив {temp_file} не содержит .sql файлов")
+                            return
+                        if len(sql_files) > 1:
+                            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                                [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+                            ])
+                            await telegram_bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=current_message_id,
+                                text="ZIP-архив содержит несколько .sql файлов. Отправьте архив с одним файлом.",
+                                reply_markup=keyboard
+                            )
+                            await unlink_file(temp_file)
+                            logger.error(f"ZIP-архив {temp_file} содержит несколько .sql файлов")
+                            return
+                    # .sql не распаковывается: при развёртывании он читается из архива потоком
+                    dump_path = temp_file
+                if dump_path != temp_file:
+                    await unlink_file(temp_file)
+                logger.debug(f"Принят ZIP, дамп: {dump_path}")
+            elif file_name.endswith(('.zst', '.gz')):
+                dump_path = temp_file
+                logger.debug(f"Принят архив {file_name}, дамп распаковывается при развёртывании")
             else:
                 dump_path = temp_file
         else:
             file_name = message.text.strip()
             logger.debug(f"Получено имя дампа: {file_name}")
-            dump_path = None
-            for db_dir in DUMPS_DIR.iterdir():
-                if db_dir.is_dir():
-                    zip_path = db_dir / file_name
-                    if zip_path.exists() and zip_path.suffix == '.zip':
-                        temp_zip = zip_path
-                        with zipfile.ZipFile(temp_zip, 'r') as zf:
-                            sql_files = [f for f in zf.namelist() if f.endswith('.sql')]
-                            if not sql_files:
-                                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                                    [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
-                                ])
-                                await telegram_bot.edit_message_text(
-                                    chat_id=chat_id,
-                                    message_id=current_message_id,
-                                    text=f"ZIP-архив {file_name} не содержит .sql файлов.",
-                                    reply_markup=keyboard
-                                )
-                                logger.error(f"ZIP-архив {file_name} не содержит .sql файлов")
-                                return
-                            if len(sql_files) > 1:
-                                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                                    [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
-                                ])
-                                await telegram_bot.edit_message_text(
-                                    chat_id=chat_id,
-                                    message_id=current_message_id,
-                                    text=f"ZIP-архив {file_name} содержит несколько .sql файлов. Укажите архив с одним файлом.",
-                                    reply_markup=keyboard
-                                )
-                                logger.error(f"ZIP-архив {file_name} содержит несколько .sql файлов")
-                                return
-                            zf.extract(sql_files[0], DUMPS_DIR)
-                            dump_path = DUMPS_DIR / sql_files[0]
-                        logger.debug(f"Распакован указанный ZIP-архив: {dump_path}")
-                        break
-                    sql_path = db_dir / file_name
-                    if sql_path.exists() and sql_path.suffix == '.sql':
-                        dump_path = sql_path
-                        logger.debug(f"Найден указанный .sql дамп: {dump_path}")
-                        break
-                    if not file_name.endswith(('.sql', '.zip')):
-                        sql_path = db_dir / f"{file_name}.sql"
-                        if sql_path.exists():
-                            dump_path = sql_path
-                            logger.debug(f"Найден указанный .sql дамп: {dump_path}")
-                            break
+            # Поиск по каталогу бэкапов: имя ищется без обхода каталогов баз
+            entry = backup_catalog.get(file_name)
+            if entry is None and not file_name.endswith(CATALOG_SUFFIXES):
+                entry = backup_catalog.get(f"{file_name}.sql")
+            dump_path = entry['path'] if entry and entry['local'] else None
+            if dump_path is not None and dump_path.suffix == '.zip':
+                temp_zip = dump_path
+                archive_meta = await read_backup_manifest(temp_zip)
+                if _is_packed_format(archive_meta):
+                    dump_path = await extract_archive_dump(temp_zip, archive_meta, DUMPS_DIR)
+                elif not archive_meta:
+                    with zipfile.ZipFile(temp_zip, 'r') as zf:
+                        sql_files = [f for f in zf.namelist() if f.endswith('.sql')]
+                        if not sql_files:
+                            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                                [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+                            ])
+                            await telegram_bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=current_message_id,
+                                text=f"ZIP-архив {file_name} не содержит .sql файлов.",
+                                reply_markup=keyboard
+                            )
+                            logger.error(f"ZIP-архив {file_name} не содержит .sql файлов")
+                            return
+                        if len(sql_files) > 1:
+                            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                                [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+                            ])
+                            await telegram_bot.edit_message_text(
+                                chat_id=chat_id,
+                                message_id=current_message_id,
+                                text=f"ZIP-архив {file_name} содержит несколько .sql файлов. Укажите архив с одним файлом.",
+                                reply_markup=keyboard
+                            )
+                            logger.error(f"ZIP-архив {file_name} содержит несколько .sql файлов")
+                            return
+                logger.debug(f"Найден указанный ZIP-архив, дамп: {dump_path}")
+            elif dump_path is not None and dump_path.suffix in ('.zst', '.gz', '.chunks'):
+                temp_zip = dump_path
+                archive_meta = await read_backup_manifest(dump_path)
+                logger.debug(f"Найден указанный архив {dump_path.suffix}: {dump_path}")
+            elif dump_path is not None:
+                logger.debug(f"Найден указанный .sql дамп: {dump_path}")
             
             if not dump_path or not dump_path.exists():
+                text = f"Дамп {file_name} не найден в {DUMPS_DIR}. Укажите существующий .sql или .zip файл."
+                if entry and entry['remote_path']:
+                    text += f"\n☁️ Файл есть на Яндекс.Диске: {entry['remote_path']}"
+                else:
+                    remote_copies = remote_index.find(file_name)
+                    if remote_copies:
+                        text += f"\n☁️ Файл есть на Яндекс.Диске: {remote_copies[0]['path']}"
+                # Похожие бэкапы из каталога: по префиксу, по словам имени или нечёткое совпадение
+                similar = [item for item in backup_catalog.search(file_name, limit=5) if item['local']]
+                if similar:
+                    text += "\nПохожие бэкапы:"
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text=item['name'], callback_data=f"deploy_backup:{item['name']}")]
+                    for item in similar
+                ] + [
+                    [InlineKeyboardButton(text="📂 Выбрать из списка", callback_data="cat:dbs:0")],
                     [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
                 ])
                 await telegram_bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=current_message_id,
-                    text=f"Дамп {file_name} не найден в {DUMPS_DIR}. Укажите существующий .sql или .zip файл.",
+                    text=text,
                     reply_markup=keyboard
                 )
                 logger.error(f"Дамп {file_name} не найден в {DUMPS_DIR}")
                 return
         
-        # Чтение файла с попыткой разных кодировок
-        try:
-            full_content = await asyncio.to_thread(lambda: open(dump_path, 'r', encoding='utf-8').read())
-        except UnicodeDecodeError:
-            logger.warning(f"Не удалось прочитать {dump_path} как UTF-8, пробуем latin1")
-            try:
-                full_content = await asyncio.to_thread(lambda: open(dump_path, 'r', encoding='latin1').read())
-            except UnicodeDecodeError as e:
-                logger.error(f"Не удалось прочитать {dump_path} даже как latin1: {e}")
+        if archive_meta:
+            # Тип и формат известны из описания бэкапа, содержимое не сканируется
+            db_type = archive_meta.get('engine', 'postgresql')
+        else:
+            # Дамп просматривается потоком до первого CREATE TABLE / INSERT INTO, не целиком
+            scan = await scan_dump(dump_path)
+            if not scan.found and scan.complete:
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
                     [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
                 ])
                 await telegram_bot.edit_message_text(
                     chat_id=chat_id,
                     message_id=current_message_id,
-                    text="Ошибка: дамп содержит некорректные данные и не может быть прочитан.",
+                    text="Дамп пуст или не содержит таблиц/данных.",
                     reply_markup=keyboard
                 )
-                if temp_file and temp_file.exists():
-                    await unlink_file(temp_file)
-                if dump_path and dump_path.exists() and dump_path != temp_file:
-                    await unlink_file(dump_path)
+                logger.error(f"Дамп {dump_path} пуст или не содержит таблиц/данных")
+                await _cleanup_deploy_files(dump_path, temp_file, temp_zip)
                 return
+            if not scan.found:
+                logger.warning(
+                    f"В первых {scan.scanned / 1_048_576:.0f} МБ дампа {dump_path} нет CREATE TABLE / INSERT INTO, "
+                    f"проверка содержимого пропущена"
+                )
         
-        if not any(keyword in full_content.lower() for keyword in ['create table', 'insert into']):
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
-            ])
-            await telegram_bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=current_message_id,
-                text="Дамп пуст или не содержит таблиц/данных.",
-                reply_markup=keyboard
-            )
-            logger.error(f"Дамп {dump_path} пуст или не содержит таблиц/данных")
-            if temp_file and temp_file.exists():
-                await unlink_file(temp_file)
-            if dump_path and dump_path.exists() and dump_path != temp_file:
-                await unlink_file(dump_path)
-            return
-        
-        first_lines = await read_file_lines(dump_path, num_lines=100)
-        logger.debug(f"Первые строки дампа {dump_path}:\n{first_lines[:200]}")
-        mysql_keywords = ['/*!40101 set', '-- mysql dump', 'engine=innodb', 'lock tables']
-        postgresql_keywords = ['create schema', 'set search_path', 'create sequence', 'copy public.']
-        found_mysql = [kw for kw in mysql_keywords if kw in first_lines.lower()]
-        found_postgresql = [kw for kw in postgresql_keywords if kw in first_lines.lower()]
-        logger.debug(f"Найдены ключевые слова MySQL: {found_mysql}")
-        logger.debug(f"Найдены ключевые слова PostgreSQL: {found_postgresql}")
-        if found_mysql:
-            db_type = 'mysql'
-        elif found_postgresql:
-            db_type = 'postgresql'
-        else:
-            db_type = 'postgresql'
-            logger.warning(f"Тип дампа не определён, используется по умолчанию: postgresql")
+            first_lines = scan.head
+            logger.debug(f"Первые строки дампа {dump_path}:\n{first_lines[:200]}")
+            mysql_keywords = ['/*!40101 set', '-- mysql dump', 'engine=innodb', 'lock tables']
+            postgresql_keywords = ['create schema', 'set search_path', 'create sequence', 'copy public.']
+            found_mysql = [kw for kw in mysql_keywords if kw in first_lines.lower()]
+            found_postgresql = [kw for kw in postgresql_keywords if kw in first_lines.lower()]
+            logger.debug(f"Найдены ключевые слова MySQL: {found_mysql}")
+            logger.debug(f"Найдены ключевые слова PostgreSQL: {found_postgresql}")
+            if found_mysql:
+                db_type = 'mysql'
+            elif found_postgresql:
+                db_type = 'postgresql'
+            else:
+                db_type = 'postgresql'
+                logger.warning(f"Тип дампа не определён, используется по умолчанию: postgresql")
         logger.debug(f"Определён тип дампа: {db_type}")
         
         await state.update_data(
@@ -569,8 +741,21 @@ async def process_dump(message: types.Message, state: FSMContext):
             db_type=db_type,
             temp_file=temp_file,
             temp_zip=temp_zip,
+            restore_jobs=archive_meta.get('jobs', 1) if archive_meta else 1,
             dump_message="⬇️ <b>Отправьте файл дампа (.sql или .zip) или укажите его название ниже</b>"
         )
+        if _is_packed_format(archive_meta):
+            text, keyboard = _restore_jobs_prompt(db_type, archive_meta)
+            await telegram_bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=current_message_id,
+                text=text,
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+            await state.set_state(DeployStates.waiting_for_jobs)
+            logger.debug(f"Установлено состояние DeployStates.waiting_for_jobs для пользователя {message.from_user.id}")
+            return
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Назад", callback_data="back_to_dump")],
             [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
@@ -595,10 +780,7 @@ async def process_dump(message: types.Message, state: FSMContext):
             text=f"Ошибка обработки дампа: {e}",
             reply_markup=keyboard
         )
-        if temp_file and temp_file.exists():
-            await unlink_file(temp_file)
-        if dump_path and dump_path.exists() and dump_path != temp_file:
-            await unlink_file(dump_path)
+        await _cleanup_deploy_files(dump_path, temp_file, temp_zip)
         await state.clear()
 
 @dp.callback_query(lambda c: c.data == "back_to_dump")
@@ -621,6 +803,71 @@ async def back_to_dump(callback: types.CallbackQuery, state: FSMContext):
         logger.error(f"Ошибка в back_to_dump: {e}")
         await callback.message.edit_text(f"Ошибка: {e}")
 
+async def _apply_restore_jobs(state, jobs):
+    """Сохранение числа потоков восстановления и переход к вводу IP."""
+    data = await state.get_data()
+    await state.update_data(restore_jobs=jobs)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Назад", callback_data="back_to_dump")],
+        [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+    ])
+    await telegram_bot.edit_message_text(
+        chat_id=data.get('chat_id'),
+        message_id=data.get('current_message_id'),
+        text=f"Потоков восстановления: {jobs}. ⬇️ <b>Укажите IP удалённого сервера.</b>",
+        reply_markup=keyboard,
+        parse_mode="HTML"
+    )
+    await state.set_state(DeployStates.waiting_for_ip)
+    logger.debug(f"Выбрано потоков восстановления: {jobs}, установлено состояние DeployStates.waiting_for_ip")
+
+@dp.callback_query(lambda c: c.data.startswith("restore_jobs:"))
+async def choose_restore_jobs(callback: types.CallbackQuery, state: FSMContext):
+    """Выбор числа потоков восстановления кнопкой."""
+    logger.debug(f"Получен callback restore_jobs от пользователя {callback.from_user.id}: {callback.data}")
+    if await state.get_state() != DeployStates.waiting_for_jobs.state:
+        await callback.answer("Шаг выбора потоков уже пройден")
+        return
+    try:
+        await _apply_restore_jobs(state, int(callback.data.split(':')[1]))
+        await callback.answer()
+    except Exception as e:
+        logger.error(f"Ошибка в choose_restore_jobs: {e}")
+        await callback.message.edit_text(f"Ошибка: {e}")
+
+@dp.message(DeployStates.waiting_for_jobs)
+async def process_restore_jobs(message: types.Message, state: FSMContext):
+    """Обработка введённого числа потоков восстановления."""
+    logger.debug(f"Получено число потоков от пользователя {message.from_user.id}")
+    data = await state.get_data()
+    jobs = message.text.strip() if message.text else ''
+    try:
+        if not jobs.isdigit() or not (1 <= int(jobs) <= RESTORE_JOBS_MAX):
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="Назад", callback_data="back_to_dump")],
+                [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+            ])
+            await telegram_bot.edit_message_text(
+                chat_id=data.get('chat_id'),
+                message_id=data.get('current_message_id'),
+                text=f"Некорректное число потоков. Укажите число от 1 до {RESTORE_JOBS_MAX}.",
+                reply_markup=keyboard
+            )
+            logger.warning(f"Некорректное число потоков: {jobs}")
+            return
+        await _apply_restore_jobs(state, int(jobs))
+    except Exception as e:
+        logger.error(f"Ошибка обработки числа потоков: {e}")
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
+        ])
+        await telegram_bot.edit_message_text(
+            chat_id=data.get('chat_id'),
+            message_id=data.get('current_message_id'),
+            text=f"Ошибка обработки числа потоков: {e}",
+            reply_markup=keyboard
+        )
+
 @dp.message(DeployStates.waiting_for_ip)
 async def process_ip(message: types.Message, state: FSMContext):
     """Обработка IP удалённого сервера."""
@@ -921,21 +1168,8 @@ async def process_password(message: types.Message, state: FSMContext):
     temp_zip = data.get('temp_zip')
 
     try:
-        env = os.environ.copy()
-        env['PGPASSWORD' if db_type == 'postgresql' else 'MYSQL_PWD'] = password
-        check_db_cmd = [
-            'psql' if db_type == 'postgresql' else 'mysql',
-            '-h', ip,
-            '-P' if db_type == 'mysql' else '-p', port,
-            '-u' if db_type == 'mysql' else '-U', username,
-            '-d' if db_type == 'postgresql' else '-D', 'postgres' if db_type == 'postgresql' else dbname,
-            '-t' if db_type == 'postgresql' else '--batch',
-            '-c' if db_type == 'postgresql' else '-e',
-            f"SELECT 1 FROM pg_database WHERE datname = '{dbname}';" if db_type == 'postgresql' else f"SHOW DATABASES LIKE '{dbname}';"
-        ]
-        logger.debug(f"Проверка базы данных: {check_db_cmd}")
-        check_db_result = await run_subprocess(check_db_cmd, env)
-        if check_db_result.returncode != 0:
+        exists, check_error = await check_database_exists(db_type, ip, port, dbname, password, username)
+        if check_error:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="Повторить", callback_data="retry_password")],
                 [InlineKeyboardButton(text="Отмена", callback_data="cancel_deploy")]
@@ -943,14 +1177,14 @@ async def process_password(message: types.Message, state: FSMContext):
             await telegram_bot.edit_message_text(
                 chat_id=chat_id,
                 message_id=current_message_id,
-                text=f"Ошибка проверки базы {dbname}: {check_db_result.stderr}",
+                text=f"Ошибка проверки базы {dbname}: {check_error}",
                 reply_markup=keyboard
             )
-            logger.error(f"Ошибка проверки базы {dbname}: {check_db_result.stderr}")
+            logger.error(f"Ошибка проверки базы {dbname}: {check_error}")
             return
 
         await state.update_data(password=password)
-        if check_db_result.stdout.strip():
+        if exists:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
                 [InlineKeyboardButton(text="Да, перезаписать", callback_data="confirm_overwrite")],
                 [InlineKeyboardButton(text="Нет", callback_data="cancel_overwrite")]
@@ -965,9 +1199,16 @@ async def process_password(message: types.Message, state: FSMContext):
             logger.debug(f"Установлено состояние DeployStates.waiting_for_overwrite_confirmation для пользователя {message.from_user.id}")
         else:
             logger.debug(f"База {dbname} не существует, будет создана")
+            await telegram_bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=current_message_id,
+                text="🔄 Развёртывание дампа начато, ожидайте...",
+                reply_markup=None
+            )
             success, error = await deploy_dump(
                 dump_path, db_type, ip, port, dbname, password, username,
-                overwrite_confirmed=False, chat_id=chat_id, progress_message_id=current_message_id
+                overwrite_confirmed=False, chat_id=chat_id, progress_message_id=current_message_id,
+                jobs=data.get('restore_jobs', 1)
             )
             if success:
                 await telegram_bot.edit_message_text(
@@ -976,14 +1217,7 @@ async def process_password(message: types.Message, state: FSMContext):
                     text=f"✅ Дамп успешно развёрнут на {ip}:{port}/{dbname}."
                 )
                 logger.info(f"Деплоймент дампа успешен: {dump_path} на {ip}:{port}/{dbname}")
-                if temp_file and temp_file.exists():
-                    await unlink_file(temp_file)
-                    logger.debug(f"Удалён временный файл: {temp_file}")
-                if dump_path.exists() and (not temp_file or dump_path != temp_file):
-                    await unlink_file(dump_path)
-                    logger.debug(f"Удалён временный дамп: {dump_path}")
-                if temp_zip and temp_zip.exists():
-                    logger.debug(f"ZIP-архив {temp_zip} оставлен в хранилище")
+                await _cleanup_deploy_files(dump_path, temp_file, temp_zip)
                 await state.clear()
             else:
                 keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -1119,7 +1353,8 @@ async def confirm_overwrite(callback: types.CallbackQuery, state: FSMContext):
         logger.debug(f"Используется пользователь {username} для деплоймента")
         success, error = await deploy_dump(
             dump_path, db_type, ip, port, dbname, password, username,
-            overwrite_confirmed=True, chat_id=chat_id, progress_message_id=current_message_id
+            overwrite_confirmed=True, chat_id=chat_id, progress_message_id=current_message_id,
+            jobs=data.get('restore_jobs', 1)
         )
         if success:
             await telegram_bot.edit_message_text(
@@ -1128,14 +1363,7 @@ async def confirm_overwrite(callback: types.CallbackQuery, state: FSMContext):
                 text=f"✅ Дамп успешно развёрнут на {ip}:{port}/{dbname}."
             )
             logger.info(f"Деплоймент дампа успешен: {dump_path} на {ip}:{port}/{dbname}")
-            if temp_file and temp_file.exists():
-                await unlink_file(temp_file)
-                logger.debug(f"Удалён временный файл: {temp_file}")
-            if dump_path.exists() and (not temp_file or dump_path != temp_file):
-                await unlink_file(dump_path)
-                logger.debug(f"Удалён временный дамп: {dump_path}")
-            if temp_zip and temp_zip.exists():
-                logger.debug(f"ZIP-архив {temp_zip} оставлен в хранилище")
+            await _cleanup_deploy_files(dump_path, temp_file, temp_zip)
             await state.clear()
         else:
             keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -2,6 +2,7 @@ from aiogram.fsm.state import State, StatesGroup
 
 class DeployStates(StatesGroup):
     waiting_for_dump = State()
+    waiting_for_jobs = State()
     waiting_for_ip = State()
     waiting_for_port = State()
     waiting_for_dbname = State()
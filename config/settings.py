@@ -24,11 +24,59 @@ ERROR_DUMPS_DIR.mkdir(exist_ok=True)
 MIN_DUMP_SIZE = 1024
 PORT = int(os.getenv('PORT', 7967))
 DUMP_INTERVAL_HOURS = int(os.getenv('DUMP_INTERVAL_HOURS', 1))
+BACKUP_SCHEDULE = os.getenv('BACKUP_SCHEDULE', f'{DUMP_INTERVAL_HOURS}h')  # Интервал (15m, 1h, 1d) или cron
+SCHEDULE_JITTER_SECONDS = int(os.getenv('SCHEDULE_JITTER_SECONDS', 300))  # Максимальный сдвиг запуска базы
+SCHEDULE_CATCH_UP = os.getenv('SCHEDULE_CATCH_UP', 'true').lower() == 'true'  # Догонять пропущенный запуск после простоя
+BACKUP_MAX_CONCURRENCY = int(os.getenv('BACKUP_MAX_CONCURRENCY', 2))  # Одновременных дампов всего
+BACKUP_MAX_PER_HOST = int(os.getenv('BACKUP_MAX_PER_HOST', 1))  # Одновременных дампов на один сервер БД
+DEFAULT_DB_PRIORITY = 100  # Меньшее значение — дамп запускается раньше
+ARCHIVE_CODEC = os.getenv('ARCHIVE_CODEC', 'zip')  # zip, zstd или gzip
+ARCHIVE_COMPRESS_LEVEL = int(os.getenv('ARCHIVE_COMPRESS_LEVEL')) if os.getenv('ARCHIVE_COMPRESS_LEVEL') else None
+COMPRESS_THREADS = int(os.getenv('COMPRESS_THREADS', os.cpu_count() or 1))
+RESTORE_JOBS = int(os.getenv('RESTORE_JOBS', 0))  # Потоков восстановления по умолчанию, 0 — как при дампе
+RESTORE_PROGRESS_INTERVAL = int(os.getenv('RESTORE_PROGRESS_INTERVAL', 5))  # Не чаще раза в N секунд правится сообщение о прогрессе
+DEPLOY_ENGINE = os.getenv('DEPLOY_ENGINE', 'native')  # native (psycopg2/mysql-connector) или cli (psql/mysql)
+DEPLOY_BATCH_MB = int(os.getenv('DEPLOY_BATCH_MB', 16))  # Объём операторов SQL дампа в одной транзакции при развёртывании
+CATALOG_PAGE_SIZE = int(os.getenv('CATALOG_PAGE_SIZE', 8))  # Бэкапов на странице списка в боте
+CATALOG_INCLUDE_REMOTE = os.getenv('CATALOG_INCLUDE_REMOTE', 'false').lower() == 'true'  # Показывать бэкапы, которые есть только на Яндекс.Диске
+STORAGE_MODE = os.getenv('STORAGE_MODE', 'archive')  # archive или dedup (хранилище чанков)
+SKIP_UNCHANGED_DUMPS = os.getenv('SKIP_UNCHANGED_DUMPS', 'false').lower() == 'true'
+UNCHANGED_MAX_AGE_HOURS = int(os.getenv('UNCHANGED_MAX_AGE_HOURS', 24))  # Полный дамп не реже этого интервала
+# Лимиты скорости в байтах в секунду (10M, 500K; 0 — без ограничения), можно по времени суток: 09:00-19:00=10M,0
+RATE_LIMIT_UPLOAD = os.getenv('RATE_LIMIT_UPLOAD', '0')
+RATE_LIMIT_DOWNLOAD = os.getenv('RATE_LIMIT_DOWNLOAD', '0')
+RATE_LIMIT_DISK = os.getenv('RATE_LIMIT_DISK', '0')  # Запись архивов дампов на локальный диск
+RATE_LIMIT_BURST_SECONDS = float(os.getenv('RATE_LIMIT_BURST_SECONDS', 1))  # Допустимый всплеск, секунд лимита
 
 # Переменные окружения
 YANDEX_DISK_TOKEN = os.getenv('YANDEX_DISK_TOKEN', '')
 YANDEX_DISK_BACKUP_FOLDER = os.getenv('YANDEX_DISK_BACKUP_FOLDER', '/Backups')
+YANDEX_CACHE_TTL = int(os.getenv('YANDEX_CACHE_TTL', 600))  # Сколько секунд доверять проверке токена и папок
+YANDEX_MAX_CONNECTIONS = int(os.getenv('YANDEX_MAX_CONNECTIONS', 8))  # Размер пула соединений к Яндекс.Диску
+YANDEX_DELETE_CONCURRENCY = int(os.getenv('YANDEX_DELETE_CONCURRENCY', 4))  # Одновременных удалений при очистке
+BACKUP_RETENTION_DAYS = int(os.getenv('BACKUP_RETENTION_DAYS', 31))  # Срок хранения бэкапов на Яндекс.Диске
+LOCAL_RETENTION_DAYS = int(os.getenv('LOCAL_RETENTION_DAYS', 30))  # Срок хранения локальных архивов в DUMPS_DIR
+YANDEX_UPLOAD_MODE = os.getenv('YANDEX_UPLOAD_MODE', 'after_dump')  # after_dump или pipelined (загрузка во время дампа)
+UPLOAD_QUEUE_ENABLED = os.getenv('UPLOAD_QUEUE_ENABLED', 'true').lower() == 'true'  # Плановые бэкапы загружаются фоновой очередью
+UPLOAD_QUEUE_WORKERS = int(os.getenv('UPLOAD_QUEUE_WORKERS', 2))  # Одновременных загрузок из очереди
+UPLOAD_RETRY_BASE_SECONDS = int(os.getenv('UPLOAD_RETRY_BASE_SECONDS', 30))  # Первая задержка повтора, дальше удваивается
+UPLOAD_RETRY_MAX_SECONDS = int(os.getenv('UPLOAD_RETRY_MAX_SECONDS', 3600))
+UPLOAD_BREAKER_THRESHOLD = int(os.getenv('UPLOAD_BREAKER_THRESHOLD', 3))  # Неудач подряд до паузы загрузок в хранилище
+UPLOAD_BREAKER_COOLDOWN_SECONDS = int(os.getenv('UPLOAD_BREAKER_COOLDOWN_SECONDS', 600))
 FILE_EXCHANGE_API_URL = os.getenv('FILE_EXCHANGE_API_URL', '')
+FILE_EXCHANGE_CHUNKED_URL = os.getenv('FILE_EXCHANGE_CHUNKED_URL', '')  # Частичная загрузка с докачкой (если сервер умеет)
+FILE_EXCHANGE_PART_SIZE_MB = int(os.getenv('FILE_EXCHANGE_PART_SIZE_MB', 8))
+FILE_EXCHANGE_PARALLEL_PARTS = int(os.getenv('FILE_EXCHANGE_PARALLEL_PARTS', 4))
+FILE_EXCHANGE_PART_RETRIES = int(os.getenv('FILE_EXCHANGE_PART_RETRIES', 3))
+FILE_EXCHANGE_MIN_RATE_KB = int(os.getenv('FILE_EXCHANGE_MIN_RATE_KB', 256))  # Худшая ожидаемая скорость для тайм-аутов, КБ/с
+MIRROR_DIRS = [Path(path.strip()) for path in os.getenv('MIRROR_DIRS', '').split(',') if path.strip()]  # Локальные копии архивов
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL', '')  # S3-совместимое хранилище (AWS, MinIO), например http://127.0.0.1:9000
+S3_BUCKET = os.getenv('S3_BUCKET', '')
+S3_ACCESS_KEY = os.getenv('S3_ACCESS_KEY', '')
+S3_SECRET_KEY = os.getenv('S3_SECRET_KEY', '')
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+S3_PREFIX = os.getenv('S3_PREFIX', '')  # Префикс ключей объектов внутри бакета
+S3_PART_SIZE_MB = int(os.getenv('S3_PART_SIZE_MB', 16))  # Размер части multipart upload (не меньше 5)
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_LIST = os.getenv('ADMIN_LIST', '').split(',')
 
@@ -37,6 +85,24 @@ telegram_bot = Bot(token=TELEGRAM_BOT_TOKEN) if TELEGRAM_BOT_TOKEN else None
 dp = Dispatcher(storage=MemoryStorage()) if telegram_bot else None
 logger.debug(f"Инициализирован dp с id: {id(dp) if dp else None}")
 
+def _common_db_options(prefix, i):
+    """Общие для всех типов баз необязательные параметры."""
+    compress_level = os.getenv(f'{prefix}_DB_{i}_COMPRESS_LEVEL')
+    return {
+        'priority': int(os.getenv(f'{prefix}_DB_{i}_PRIORITY', DEFAULT_DB_PRIORITY)),
+        'schedule': os.getenv(f'{prefix}_DB_{i}_SCHEDULE', BACKUP_SCHEDULE),
+        'jitter': int(os.getenv(f'{prefix}_DB_{i}_JITTER', SCHEDULE_JITTER_SECONDS)),
+        'codec': os.getenv(f'{prefix}_DB_{i}_CODEC', ARCHIVE_CODEC),
+        'storage_mode': os.getenv(f'{prefix}_DB_{i}_STORAGE_MODE', STORAGE_MODE),
+        'skip_unchanged': os.getenv(f'{prefix}_DB_{i}_SKIP_UNCHANGED', str(SKIP_UNCHANGED_DUMPS)).lower() == 'true',
+        'change_probe': os.getenv(f'{prefix}_DB_{i}_CHANGE_PROBE', 'stats'),  # stats или checksum (MySQL/MariaDB)
+        'compress_level': int(compress_level) if compress_level else ARCHIVE_COMPRESS_LEVEL,
+        # PostgreSQL: plain, directory, custom или segments; MySQL/MariaDB: plain или parallel
+        'dump_format': os.getenv(f'{prefix}_DB_{i}_DUMP_FORMAT', 'plain'),
+        'dump_jobs': int(os.getenv(f'{prefix}_DB_{i}_DUMP_JOBS', os.cpu_count() or 1)),
+        'upload_mode': os.getenv(f'{prefix}_DB_{i}_UPLOAD_MODE', YANDEX_UPLOAD_MODE)
+    }
+
 # Конфигурация баз данных
 POSTGRES_DBS = []
 MYSQL_DBS = []
@@ -48,7 +114,8 @@ for i in range(1, 10):
         'host': os.getenv(f'POSTGRES_DB_{i}_HOST'),
         'port': os.getenv(f'POSTGRES_DB_{i}_PORT', '5432'),
         'user': os.getenv(f'POSTGRES_DB_{i}_USER'),
-        'password': os.getenv(f'POSTGRES_DB_{i}_PASSWORD')
+        'password': os.getenv(f'POSTGRES_DB_{i}_PASSWORD'),
+        **_common_db_options('POSTGRES', i)
     }
     if all([pg_db['dbname'], pg_db['host'], pg_db['user'], pg_db['password']]):
         POSTGRES_DBS.append(pg_db)
@@ -60,7 +127,8 @@ for i in range(1, 10):
         'host': os.getenv(f'MYSQL_DB_{i}_HOST'),
         'port': os.getenv(f'MYSQL_DB_{i}_PORT', '3306'),
         'user': os.getenv(f'MYSQL_DB_{i}_USER'),
-        'password': os.getenv(f'MYSQL_DB_{i}_PASSWORD')
+        'password': os.getenv(f'MYSQL_DB_{i}_PASSWORD'),
+        **_common_db_options('MYSQL', i)
     }
     if all([mysql_db['database'], mysql_db['host'], mysql_db['user'], mysql_db['password']]):
         MYSQL_DBS.append(mysql_db)
@@ -72,7 +140,8 @@ for i in range(1, 10):
         'host': os.getenv(f'MARIADB_DB_{i}_HOST'),
         'port': os.getenv(f'MARIADB_DB_{i}_PORT', '3306'),
         'user': os.getenv(f'MARIADB_DB_{i}_USER'),
-        'password': os.getenv(f'MARIADB_DB_{i}_PASSWORD')
+        'password': os.getenv(f'MARIADB_DB_{i}_PASSWORD'),
+        **_common_db_options('MARIADB', i)
     }
     if all([mariadb_db['database'], mariadb_db['host'], mariadb_db['user'], mariadb_db['password']]):
         MARIADB_DBS.append(mariadb_db)
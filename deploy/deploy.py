@@ -1,18 +1,190 @@
-from config.settings import telegram_bot, logger, ERROR_DUMPS_DIR
-from backups.utils import run_subprocess
+from config.settings import telegram_bot, DEPLOY_ENGINE, logger, ERROR_DUMPS_DIR
+from backups.utils import run_subprocess, DUMP_CHUNK_SIZE
+from backups.compression import open_dump_reader
+from backups.dedup import MANIFEST_SUFFIX
+from deploy.progress import RestoreProgress, restore_size
+from deploy.native import (
+    NATIVE_ERRORS, deploy_target, describe_error, database_exists, recreate_database, load_sql_dump,
+    release_admin_connection
+)
 import os
 import asyncio
+import time
 from pathlib import Path
 import shutil
 
-async def deploy_dump(dump_path, db_type, ip, port, dbname, password, username, overwrite_confirmed, chat_id, progress_message_id):
-    """Развёртывание дампа на удалённый сервер."""
+PG_RESTORE_SECTIONS = ('pre-data', 'data', 'post-data')
+
+def _save_error_dump(dump_path):
+    """Сохранение дампа (файла или каталога) для анализа после ошибки."""
+    error_dump_path = ERROR_DUMPS_DIR / dump_path.name
+    ERROR_DUMPS_DIR.mkdir(exist_ok=True)
+    if dump_path.is_dir():
+        shutil.copytree(dump_path, error_dump_path, dirs_exist_ok=True)
+    else:
+        shutil.copy(dump_path, error_dump_path)
+    logger.debug(f"Дамп сохранён для анализа в {error_dump_path}")
+
+async def _pipe_dump_to_process(cmd, env, dump_path, progress=None):
+    """Потоковая передача дампа на stdin клиента СУБД с распаковкой на лету.
+
+    Архив (zip, zstd, gzip, чанки) читается через open_dump_reader, на диск ничего не
+    распаковывается. Следующий блок распаковывается, пока клиент принимает текущий,
+    поэтому в памяти не больше двух блоков по DUMP_CHUNK_SIZE. progress получает
+    прочитанные байты архива (для манифеста чанков — байты собранного дампа).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+        env=env
+    )
+    stderr_task = asyncio.create_task(process.stderr.read())
+    try:
+        source = None
+        if progress is not None and dump_path.suffix != MANIFEST_SUFFIX:
+            source = await asyncio.to_thread(progress.open, dump_path)
+        try:
+            reader = await asyncio.to_thread(open_dump_reader, dump_path, source)
+        except BaseException:
+            if source is not None:
+                source.close()
+            raise
+        pending = None
+        try:
+            pending = asyncio.ensure_future(asyncio.to_thread(reader.read, DUMP_CHUNK_SIZE))
+            while True:
+                chunk = await pending
+                pending = None
+                if not chunk:
+                    break
+                pending = asyncio.ensure_future(asyncio.to_thread(reader.read, DUMP_CHUNK_SIZE))
+                if progress is not None and source is None:
+                    progress.advance(len(chunk))
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # Клиент завершился с ошибкой, причина будет в stderr
+            pass
+        finally:
+            if pending is not None:
+                # Читатель нельзя закрывать, пока поток ещё читает из него
+                await asyncio.gather(pending, return_exceptions=True)
+            await asyncio.to_thread(reader.close)
+            if source is not None:
+                await asyncio.to_thread(source.close)
+            if not process.stdin.is_closing():
+                process.stdin.close()
+        await process.wait()
+    except BaseException:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        stderr_task.cancel()
+        raise
+    stderr = await stderr_task
+    return type('CompletedProcess', (), {
+        'returncode': process.returncode,
+        'stderr': stderr.decode(errors='replace')
+    })()
+
+async def _restore_mysql_parallel(dump_path, ip, port, username, dbname, env, jobs, progress, target=None):
+    """Восстановление многофайлового дампа MySQL/MariaDB: схема, данные параллельно, представления и триггеры.
+
+    target — параметры подключения для загрузки через драйвер (DEPLOY_ENGINE=native), иначе клиент mysql.
+    """
+    client_cmd = [
+        'mysql',
+        '-h', ip,
+        '-P', port,
+        '-u', username,
+        '-D', dbname
+    ]
+
+    async def restore_file(path, file_progress=None):
+        if target is not None:
+            return await load_sql_dump(target, path, file_progress)
+        if file_progress is not None:
+            return await _pipe_dump_to_process(client_cmd, env, path, file_progress)
+        return await run_subprocess(client_cmd + [f'--execute=source {path}'], env)
+
+    progress.set_stage("схема")
+    result = await restore_file(dump_path / "schema.sql")
+    if result.returncode != 0:
+        return result
+
+    semaphore = asyncio.Semaphore(max(1, int(jobs)))
+    failed = []
+
+    async def restore_part(part):
+        async with semaphore:
+            if failed:
+                return
+            part_result = await restore_file(part, progress)
+            if part_result.returncode != 0:
+                failed.append(part_result)
+            logger.debug(f"Загружена часть {part.name}: код {part_result.returncode}")
+
+    parts = sorted((dump_path / 'data').glob('*.sql.gz'))
+    logger.info(f"Параллельная загрузка {len(parts)} частей данных в {dbname}, потоков: {jobs}")
+    progress.set_stage(f"данные, {len(parts)} частей в {jobs} потоков", sum(part.stat().st_size for part in parts))
+    await asyncio.gather(*(restore_part(part) for part in parts))
+    if failed:
+        return failed[0]
+    progress.set_stage("представления и триггеры")
+    return await restore_file(dump_path / "post.sql")
+
+async def _restore_postgres_sections(dump_path, ip, port, username, dbname, env, jobs, progress):
+    """Восстановление архива pg_dump (directory/custom) по секциям.
+
+    pre-data (таблицы, типы, функции) создаётся в одном соединении, затем данные таблиц
+    загружаются в jobs соединений, после них в jobs соединений строятся индексы,
+    ограничения и триггеры (post-data). Длительность каждой секции пишется в лог.
+    """
+    base_cmd = [
+        'pg_restore',
+        '-h', ip,
+        '-p', port,
+        '-U', username,
+        '-d', dbname,
+        '--no-owner',
+        '--no-privileges'
+    ]
+    result = None
+    for number, section in enumerate(PG_RESTORE_SECTIONS, 1):
+        section_jobs = 1 if section == 'pre-data' else max(1, int(jobs))
+        # pg_restore не сообщает прогресс внутри секции — показываются этап и время
+        progress.set_stage(f"секция {section} ({number}/{len(PG_RESTORE_SECTIONS)}), потоков: {section_jobs}")
+        cmd = base_cmd + [f'--section={section}', '-j', str(section_jobs), str(dump_path)]
+        started = time.monotonic()
+        result = await run_subprocess(cmd, env)
+        if result.returncode != 0:
+            logger.error(f"Ошибка восстановления секции {section} в {dbname}: {result.stderr}")
+            return result
+        logger.info(f"Секция {section} восстановлена в {dbname} за {time.monotonic() - started:.1f} сек, потоков: {section_jobs}")
+    return result
+
+async def deploy_dump(dump_path, db_type, ip, port, dbname, password, username, overwrite_confirmed, chat_id, progress_message_id, jobs=1):
+    """Развёртывание дампа на удалённый сервер.
+
+    При DEPLOY_ENGINE=native база создаётся и SQL дамп загружается через драйвер СУБД,
+    иначе — клиентами psql/mysql. Архивы pg_dump (directory/custom) восстанавливает pg_restore.
+    """
+    target = deploy_target(db_type, ip, port, username, password, dbname)
     try:
         env = os.environ.copy()
         env['PGPASSWORD' if db_type == 'postgresql' else 'MYSQL_PWD'] = password
         
         # Создание базы, если она не существует или перезаписывается
-        if not overwrite_confirmed:
+        if DEPLOY_ENGINE == 'native':
+            logger.debug(f"{'Перезапись' if overwrite_confirmed else 'Создание'} базы {dbname} на {ip}:{port} через драйвер")
+            try:
+                await recreate_database(target, drop=overwrite_confirmed)
+            except NATIVE_ERRORS as e:
+                logger.error(f"Ошибка создания базы {dbname}: {describe_error(e)}")
+                return False, f"Ошибка создания базы: {describe_error(e)}"
+        elif not overwrite_confirmed:
             logger.debug(f"Проверка и создание базы {dbname} на {ip}:{port}")
             if db_type == 'postgresql':
                 create_cmd = [
@@ -90,41 +262,85 @@ async def deploy_dump(dump_path, db_type, ip, port, dbname, password, username,
                     return False, f"Ошибка создания базы: {create_result.stderr}"
         
         # Команда восстановления дампа
-        if db_type == 'postgresql':
+        if db_type == 'postgresql' and (dump_path.is_dir() or dump_path.suffix == '.dump'):
+            # Архивный формат pg_dump (directory/custom) восстанавливается pg_restore по секциям
+            cmd = None
+        elif db_type == 'postgresql':
+            # SQL-дамп (или архив с ним) передаётся на stdin без распаковки на диск
             cmd = [
                 'psql',
                 '-h', ip,
                 '-p', port,
                 '-U', username,
-                '-d', dbname,
-                '-f', str(dump_path)
+                '-d', dbname
             ]
+        elif dump_path.is_dir():
+            # Многофайловый дамп MySQL/MariaDB восстанавливается по частям
+            cmd = None
         else:
             cmd = [
                 'mysql',
                 '-h', ip,
                 '-P', port,
                 '-u', username,
-                '-D', dbname,
-                f'--execute=source {dump_path}'
+                '-D', dbname
             ]
         
-        logger.debug(f"Выполнение команды деплоя: {cmd}")
-        result = await run_subprocess(cmd, env)
+        progress = RestoreProgress(chat_id, progress_message_id, dbname).start()
+        try:
+            if cmd is None and db_type == 'postgresql':
+                result = await _restore_postgres_sections(dump_path, ip, port, username, dbname, env, jobs, progress)
+            elif cmd is None:
+                result = await _restore_mysql_parallel(
+                    dump_path, ip, port, username, dbname, env, jobs, progress,
+                    target=target if DEPLOY_ENGINE == 'native' else None
+                )
+            elif DEPLOY_ENGINE == 'native':
+                logger.debug(f"Загрузка {dump_path} в {ip}:{port}/{dbname} через драйвер")
+                progress.set_stage("загрузка дампа", await asyncio.to_thread(restore_size, dump_path))
+                result = await load_sql_dump(target, dump_path, progress)
+            else:
+                logger.debug(f"Выполнение команды деплоя: {cmd} < {dump_path}")
+                progress.set_stage("загрузка дампа", await asyncio.to_thread(restore_size, dump_path))
+                result = await _pipe_dump_to_process(cmd, env, dump_path, progress)
+        finally:
+            await progress.stop()
         if result.returncode != 0:
             logger.error(f"Ошибка развёртывания дампа: {result.stderr}")
-            error_dump_path = ERROR_DUMPS_DIR / dump_path.name
-            ERROR_DUMPS_DIR.mkdir(exist_ok=True)
-            shutil.copy(dump_path, error_dump_path)
-            logger.debug(f"Дамп сохранён для анализа в {error_dump_path}")
+            _save_error_dump(dump_path)
             return False, f"Ошибка развёртывания: {result.stderr}"
         
         logger.info(f"Успешно развёрнут дамп {dump_path} на {ip}:{port}/{dbname}")
         return True, None
     except Exception as e:
         logger.error(f"Неожиданная ошибка при развёртывании дампа: {e}")
-        error_dump_path = ERROR_DUMPS_DIR / dump_path.name
-        ERROR_DUMPS_DIR.mkdir(exist_ok=True)
-        shutil.copy(dump_path, error_dump_path)
-        logger.debug(f"Дамп сохранён для анализа в {error_dump_path}")
-        return False, str(e)
\ No newline at end of file
+        _save_error_dump(dump_path)
+        return False, str(e)
+    finally:
+        if DEPLOY_ENGINE == 'native':
+            await asyncio.to_thread(release_admin_connection, target)
+
+async def check_database_exists(db_type, ip, port, dbname, password, username):
+    """Есть ли база на сервере развёртывания: (есть ли, текст ошибки или None)."""
+    if DEPLOY_ENGINE == 'native':
+        try:
+            return await database_exists(deploy_target(db_type, ip, port, username, password, dbname)), None
+        except NATIVE_ERRORS as e:
+            return False, describe_error(e)
+    env = os.environ.copy()
+    env['PGPASSWORD' if db_type == 'postgresql' else 'MYSQL_PWD'] = password
+    check_db_cmd = [
+        'psql' if db_type == 'postgresql' else 'mysql',
+        '-h', ip,
+        '-P' if db_type == 'mysql' else '-p', port,
+        '-u' if db_type == 'mysql' else '-U', username,
+        '-d' if db_type == 'postgresql' else '-D', 'postgres' if db_type == 'postgresql' else dbname,
+        '-t' if db_type == 'postgresql' else '--batch',
+        '-c' if db_type == 'postgresql' else '-e',
+        f"SELECT 1 FROM pg_database WHERE datname = '{dbname}';" if db_type == 'postgresql' else f"SHOW DATABASES LIKE '{dbname}';"
+    ]
+    logger.debug(f"Проверка базы данных: {check_db_cmd}")
+    check_db_result = await run_subprocess(check_db_cmd, env)
+    if check_db_result.returncode != 0:
+        return False, check_db_result.stderr
+    return bool(check_db_result.stdout.strip()), None
\ No newline at end of file
@@ -0,0 +1,580 @@
+import asyncio
+import re
+import threading
+import time
+import psycopg2
+import mysql.connector
+from config.settings import DEPLOY_BATCH_MB, logger
+from backups.utils import DUMP_CHUNK_SIZE
+from backups.compression import open_dump_reader
+from backups.dedup import MANIFEST_SUFFIX
+
+CONNECT_TIMEOUT = 30
+ADMIN_IDLE_SECONDS = 300  # Служебное соединение, не использованное столько секунд, закрывается
+SPLIT_LOOKAHEAD = 64  # Байт после начала токена, нужных для его разбора ($тег$, DELIMITER, разделитель)
+ERRORS_IN_RESULT = 10  # Сколько ошибок операторов попадает в текст результата
+
+NATIVE_ERRORS = (psycopg2.Error, mysql.connector.Error)
+_RECONNECT_ERRORS = (
+    psycopg2.OperationalError, psycopg2.InterfaceError,
+    mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError
+)
+
+_SPACE_RE = re.compile(rb'\s*')
+_PG_TOKEN_RE = re.compile(rb"""[;'"]|[Ee]'|--|/\*|\$(?:[A-Za-z_\x80-\xff][\w\x80-\xff]*)?\$""")
+_PG_COMMENT_RE = re.compile(rb'/\*|\*/')
+_PG_STRING_RE = re.compile(rb"[^']*(?:''[^']*)*'")
+_PG_ESCAPE_STRING_RE = re.compile(rb"[^'\\]*(?:(?:\\.|'')[^'\\]*)*'", re.S)
+_PG_IDENTIFIER_RE = re.compile(rb'[^"]*(?:""[^"]*)*"')
+_MYSQL_STRING_RE = {
+    quote: re.compile(rb"[^Q\\]*(?:(?:\\.|QQ)[^Q\\]*)*Q".replace(b'Q', quote), re.S) for quote in (b"'", b'"')
+}
+_MYSQL_IDENTIFIER_RE = re.compile(rb'[^`]*(?:``[^`]*)*`')
+_DELIMITER_RE = re.compile(rb'delimiter[ \t]+(\S+)', re.I)
+_COPY_RE = re.compile(rb'COPY\b.*\bFROM\s+stdin\b', re.I | re.S)
+_WORD_RE = re.compile(rb'[\w$\x80-\xff]')
+
+def _mysql_run_re(delimiter):
+    """Текст без комментариев вместе со строками и идентификаторами до разделителя — одним совпадением.
+
+    Многострочные INSERT mysqldump состоят из тысяч строковых значений; разбор их по одному
+    токену заметно медленнее загрузки на сервер, поэтому они пропускаются регулярным выражением
+    (притяжательные квантификаторы без возвратов, Python 3.11+).
+    """
+    stop = re.escape(delimiter[:1])
+    return re.compile(
+        rb"(?:[^'\"`#/\-" + stop + rb"]++"
+        rb"|'[^'\\]*+(?:(?:\\.|'')[^'\\]*+)*+'"
+        rb'|"[^"\\]*+(?:(?:\\.|"")[^"\\]*+)*+"'
+        rb"|`[^`]*+(?:``[^`]*+)*+`)*+",
+        re.S
+    )
+
+class SqlSplitter:
+    """Разбор SQL дампа на операторы по блокам, без чтения дампа целиком.
+
+    Разделитель не ищется внутри строк, идентификаторов в кавычках, комментариев и
+    $-строк PostgreSQL; учитываются DELIMITER клиента mysql и команды psql (\\connect,
+    \\restrict), которые пропускаются. Итерация даёт (оператор, номер строки, данные COPY):
+    после COPY ... FROM stdin данные — читатель строк до «\\.», его нужно дочитать до
+    следующего оператора.
+    """
+
+    def __init__(self, read, dialect):
+        self._read = read
+        self._mysql = dialect == 'mysql'
+        self._buffer = b''
+        self._eof = False
+        self._pos = 0
+        self._start = 0  # Начало текущего оператора; всё до него при чтении блока отбрасывается
+        self._counted = 0
+        self._lines = 1
+        self._set_delimiter(b';')
+
+    def _set_delimiter(self, delimiter):
+        self._delimiter = delimiter
+        if self._mysql:
+            self._token_re = re.compile(rb"""['"`#]|--|/\*|""" + re.escape(delimiter))
+            self._run_re = _mysql_run_re(delimiter)
+        else:
+            self._token_re = _PG_TOKEN_RE
+            self._run_re = None
+
+    def _fill(self):
+        """Следующий блок дампа; False — дамп закончился."""
+        if self._eof:
+            return False
+        block = self._read()
+        if not block:
+            self._eof = True
+            return False
+        self._line_at(self._start)
+        self._buffer = self._buffer[self._start:] + block
+        self._pos -= self._start
+        self._counted -= self._start
+        self._start = 0
+        return True
+
+    def _line_at(self, position):
+        self._lines += self._buffer.count(b'\n', self._counted, position)
+        self._counted = position
+        return self._lines
+
+    def _line_end(self, position):
+        """Позиция после конца строки; None — строка ещё не прочитана целиком."""
+        end = self._buffer.find(b'\n', position)
+        if end >= 0:
+            return end + 1
+        return len(self._buffer) if self._eof else None
+
+    def _client_command(self):
+        """Команда клиента в начале оператора: True — пропущена, False — её нет, None — нужен следующий блок."""
+        buffer, pos = self._buffer, self._pos
+        if self._mysql:
+            match = _DELIMITER_RE.match(buffer, pos)
+            if match is None:
+                return False
+        elif not buffer.startswith(b'\\', pos):
+            return False
+        end = self._line_end(pos)
+        if end is None:
+            return None
+        if self._mysql:
+            self._set_delimiter(match.group(1))
+        else:
+            logger.debug(f"Пропущена команда psql: {buffer[pos:end].strip().decode(errors='replace')}")
+        self._pos = end
+        return True
+
+    def _skip(self, token, start, end):
+        """Конец строки, идентификатора или комментария, начатого токеном; None — нужен следующий блок."""
+        buffer = self._buffer
+        if token in (b'--', b'#'):
+            return self._line_end(end)
+        if token == b'/*':
+            if self._mysql:
+                close = buffer.find(b'*/', end)
+                return close + 2 if close >= 0 else None
+            depth = 1
+            while depth:
+                match = _PG_COMMENT_RE.search(buffer, end)
+                if match is None:
+                    return None
+                depth += 1 if match.group() == b'/*' else -1
+                end = match.end()
+            return end
+        if token.startswith(b'$'):
+            close = buffer.find(token, end)
+            return close + len(token) if close >= 0 else None
+        if self._mysql:
+            pattern = _MYSQL_IDENTIFIER_RE if token == b'`' else _MYSQL_STRING_RE[token]
+        elif token == b'"':
+            pattern = _PG_IDENTIFIER_RE
+        else:
+            pattern = _PG_ESCAPE_STRING_RE if len(token) == 2 else _PG_STRING_RE
+        match = pattern.match(buffer, end)
+        # Кавычка в конце блока может оказаться первой из удвоенных
+        if match is None or (match.end() == len(buffer) and not self._eof):
+            return None
+        return match.end()
+
+    def _is_comment(self, token, end):
+        if token == b'/*':
+            return not (self._mysql and self._buffer[end:end + 1] in (b'!', b'+'))
+        if token == b'--' and self._mysql:
+            # В mysql «--» начинает комментарий, только если за ним пробел или конец строки
+            return self._buffer[end:end + 1] in (b'', b' ', b'\t', b'\n', b'\r')
+        return token in (b'--', b'#')
+
+    def _copy_chunk(self):
+        """Следующая порция строк данных COPY; None — достигнута строка «\\.»."""
+        while True:
+            buffer, pos = self._buffer, self._pos
+            if len(buffer) - pos < 3 and self._fill():
+                continue
+            if buffer.startswith(b'\\.', pos):
+                self._pos = self._start = self._line_end(pos) or len(buffer)
+                return None
+            end = buffer.find(b'\n\\.', pos)
+            if end >= 0:
+                self._pos = self._start = end + 1
+                return buffer[pos:end + 1]
+            # Отдаются только целые строки: «\.» распознаётся лишь в начале строки
+            cut = buffer.rfind(b'\n', pos) + 1
+            if cut > pos:
+                self._pos = self._start = cut
+                return buffer[pos:cut]
+            if not self._fill():
+                self._pos = self._start = len(buffer)
+                return buffer[pos:] or None
+
+    def __iter__(self):
+        content = False
+        while True:
+            buffer = self._buffer
+            if not content:
+                # Пробелы, комментарии и команды клиента между операторами в текст оператора не входят
+                self._pos = self._start = _SPACE_RE.match(buffer, self._pos).end()
+                if len(buffer) - self._pos < SPLIT_LOOKAHEAD and self._fill():
+                    continue
+                if self._pos >= len(buffer):
+                    return
+                skipped = self._client_command()
+                if skipped is None and self._fill():
+                    continue
+                if skipped:
+                    continue
+            if self._run_re is not None:
+                run_end = self._run_re.match(buffer, self._pos).end()
+                # Строка, закрытая в конце блока, может продолжиться удвоенной кавычкой в следующем
+                if run_end > len(buffer) - SPLIT_LOOKAHEAD and self._fill():
+                    continue
+                if run_end > self._pos:
+                    content = True
+                    self._pos = run_end
+            match = self._token_re.search(buffer, self._pos)
+            if match is None:
+                if not self._eof:
+                    # Просмотренное не сканируется повторно, кроме хвоста, где может начинаться токен
+                    tail = len(buffer) - SPLIT_LOOKAHEAD
+                    content = content or self._pos < tail
+                    self._pos = max(self._pos, tail)
+                    self._fill()
+                    continue
+                statement = buffer[self._start:].strip()
+                if statement:
+                    yield statement, self._line_at(self._start), None
+                return
+            if match.end() + SPLIT_LOOKAHEAD > len(buffer) and self._fill():
+                continue
+            token, token_start, token_end = match.group(), match.start(), match.end()
+            content = content or token_start > self._pos
+            if token == self._delimiter:
+                statement = buffer[self._start:token_start].rstrip()
+                line = self._line_at(self._start)
+                self._pos = token_end
+                if not content:
+                    continue
+                content = False
+                if self._mysql or not _COPY_RE.match(statement):
+                    yield statement, line, None
+                    continue
+                # Данные COPY начинаются со строки после оператора
+                while self._line_end(self._pos) is None:
+                    self._fill()
+                self._pos = self._start = self._line_end(self._pos)
+                data = CopyData(self)
+                yield statement, line, data
+                data.drain()
+                continue
+            if token.startswith(b'$') and token_start > 0 and _WORD_RE.match(buffer, token_start - 1):
+                # $ внутри идентификатора, а не начало $-строки
+                content = True
+                self._pos = token_start + 1
+                continue
+            if len(token) == 2 and token[1:] == b"'" and token_start > 0 and _WORD_RE.match(buffer, token_start - 1):
+                # E' в конце идентификатора — обычная строка после него
+                token, token_start = b"'", token_start + 1
+            if token == b'--' and not self._is_comment(token, token_end):
+                content = True
+                self._pos = token_start + 1
+                continue
+            end = self._skip(token, token_start, token_end)
+            if end is None:
+                if self._fill():
+                    continue
+                end = len(buffer)
+            content = content or not self._is_comment(token, token_end)
+            self._pos = end
+
+class CopyData:
+    """Данные одного COPY ... FROM stdin для copy_expert: читаются из дампа по мере отправки."""
+
+    def __init__(self, splitter):
+        self._splitter = splitter
+        self._chunk = b''
+        self._offset = 0
+        self._done = False
+
+    def read(self, size=-1):
+        while self._offset >= len(self._chunk):
+            if self._done:
+                return b''
+            chunk = self._splitter._copy_chunk()
+            if chunk is None:
+                self._done = True
+                return b''
+            self._chunk, self._offset = chunk, 0
+        if size is None or size < 0:
+            size = len(self._chunk) - self._offset
+        data = self._chunk[self._offset:self._offset + size]
+        self._offset += len(data)
+        return data
+
+    def drain(self):
+        """Пропуск непрочитанных данных (если COPY завершился ошибкой)."""
+        while self.read(DUMP_CHUNK_SIZE):
+            pass
+
+def deploy_target(db_type, ip, port, username, password, dbname=None):
+    """Параметры подключения к серверу развёртывания в виде записи базы (как в ALL_DBS)."""
+    return {'type': db_type, 'host': ip, 'port': port, 'user': username, 'password': password, 'database': dbname}
+
+def describe_error(error):
+    """Текст ошибки драйвера: код (SQLSTATE или номер ошибки MySQL) и сообщение сервера."""
+    if isinstance(error, psycopg2.Error) and error.pgcode:
+        return f"{error.pgcode}: {error.diag.message_primary}"
+    if isinstance(error, mysql.connector.Error) and error.errno:
+        return f"ERROR {error.errno} ({error.sqlstate}): {error.msg}"
+    return str(error).strip() or type(error).__name__
+
+def _quote_identifier(db_type, name):
+    if db_type == 'postgresql':
+        return '"' + name.replace('"', '""') + '"'
+    return '`' + name.replace('`', '``') + '`'
+
+def _connect(target, autocommit=False):
+    """Соединение с сервером развёртывания (с базой target['database'] или служебной)."""
+    if target['type'] == 'postgresql':
+        connection = psycopg2.connect(
+            host=target['host'],
+            port=int(target['port']),
+            user=target['user'],
+            password=target['password'],
+            dbname=target['database'] or 'postgres',
+            connect_timeout=CONNECT_TIMEOUT
+        )
+        connection.autocommit = autocommit
+        return connection
+    return mysql.connector.connect(
+        host=target['host'],
+        port=int(target['port']),
+        user=target['user'],
+        password=target['password'],
+        database=target['database'],
+        charset='utf8mb4',
+        connection_timeout=CONNECT_TIMEOUT,
+        autocommit=autocommit
+    )
+
+def _close_quietly(connection):
+    if connection is None:
+        return
+    try:
+        connection.close()
+    except NATIVE_ERRORS as e:
+        logger.debug(f"Ошибка закрытия соединения: {e}")
+
+_admin_connections = {}  # (тип, хост, порт, пользователь): {connection, password, lock, used_at}
+_admin_lock = threading.Lock()
+
+def _admin_key(target):
+    return target['type'], target['host'], str(target['port']), target['user']
+
+def _admin_entry(target):
+    """Запись пула служебных соединений для сервера; заодно закрываются простаивающие соединения."""
+    key = _admin_key(target)
+    now = time.monotonic()
+    with _admin_lock:
+        for other_key, entry in list(_admin_connections.items()):
+            if other_key != key and now - entry['used_at'] > ADMIN_IDLE_SECONDS and entry['lock'].acquire(blocking=False):
+                del _admin_connections[other_key]
+                _close_quietly(entry['connection'])
+                entry['lock'].release()
+        entry = _admin_connections.setdefault(
+            key, {'connection': None, 'password': None, 'lock': threading.Lock(), 'used_at': now}
+        )
+        entry['used_at'] = now
+        return entry
+
+def _run_admin(target, operation):
+    """Служебная операция через соединение из пула (одно на сервер и пользователя).
+
+    Проверка, удаление и создание базы идут по одному соединению. Если соединение из пула
+    оказалось разорвано, операция повторяется один раз через новое.
+    """
+    entry = _admin_entry(target)
+    with entry['lock']:
+        while True:
+            reused = entry['connection'] is not None and entry['password'] == target['password']
+            if not reused:
+                _close_quietly(entry['connection'])
+                entry['connection'] = None
+                entry['connection'] = _connect({**target, 'database': None}, autocommit=True)
+                entry['password'] = target['password']
+            try:
+                return operation(entry['connection'])
+            except _RECONNECT_ERRORS:
+                _close_quietly(entry['connection'])
+                entry['connection'] = None
+                if not reused:
+                    raise
+                logger.debug(f"Служебное соединение с {target['host']}:{target['port']} разорвано, повторное подключение")
+
+def release_admin_connection(target):
+    """Закрытие служебного соединения после развёртывания."""
+    with _admin_lock:
+        entry = _admin_connections.pop(_admin_key(target), None)
+    if entry is not None:
+        with entry['lock']:
+            _close_quietly(entry['connection'])
+
+def _database_exists(target, connection):
+    cursor = connection.cursor()
+    try:
+        if target['type'] == 'postgresql':
+            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (target['database'],))
+        else:
+            cursor.execute("SELECT 1 FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = %s", (target['database'],))
+        return bool(cursor.fetchall())
+    finally:
+        cursor.close()
+
+async def database_exists(target):
+    """Есть ли база target['database'] на сервере."""
+    return await asyncio.to_thread(_run_admin, target, lambda connection: _database_exists(target, connection))
+
+async def recreate_database(target, drop):
+    """Создание базы; drop — перед созданием удалить существующую."""
+    name = _quote_identifier(target['type'], target['database'])
+    if drop:
+        statements = [f"DROP DATABASE IF EXISTS {name}", f"CREATE DATABASE {name}"]
+    elif target['type'] == 'postgresql':
+        statements = [f"CREATE DATABASE {name}"]
+    else:
+        statements = [f"CREATE DATABASE IF NOT EXISTS {name}"]
+
+    def operation(connection):
+        cursor = connection.cursor()
+        try:
+            for statement in statements:
+                logger.debug(f"Выполнение на {target['host']}:{target['port']}: {statement}")
+                cursor.execute(statement)
+        finally:
+            cursor.close()
+
+    await asyncio.to_thread(_run_admin, target, operation)
+
+def _flush_postgres(connection, batch, errors):
+    """Пачка операторов одной транзакцией за один запрос к серверу.
+
+    Если пачка не выполнилась, её операторы повторяются по одному без транзакции: как psql
+    без ON_ERROR_STOP, оператор с ошибкой пропускается, остальные выполняются.
+    """
+    if not batch:
+        return
+    cursor = connection.cursor()
+    try:
+        try:
+            # Разделитель на отдельной строке: оператор может заканчиваться комментарием --
+            cursor.execute(b'\n;\n'.join(statement for statement, _ in batch))
+            connection.commit()
+            return
+        except psycopg2.Error:
+            connection.rollback()
+        connection.autocommit = True
+        try:
+            for statement, line in batch:
+                try:
+                    cursor.execute(statement)
+                except psycopg2.Error as e:
+                    errors.append(f"строка {line}: {describe_error(e)}")
+        finally:
+            connection.autocommit = False
+    finally:
+        cursor.close()
+        batch.clear()
+
+def _load_postgres(target, read, stats):
+    """Загрузка SQL дампа PostgreSQL: операторы пачками до DEPLOY_BATCH_MB, данные через COPY FROM STDIN."""
+    errors = []
+    batch, batch_size = [], 0
+    connection = _connect(target)
+    try:
+        for statement, line, copy_data in SqlSplitter(read, 'postgresql'):
+            stats['statements'] += 1
+            if copy_data is None:
+                batch.append((statement, line))
+                batch_size += len(statement)
+                if batch_size >= DEPLOY_BATCH_MB * 1024 * 1024:
+                    stats['transactions'] += 1
+                    _flush_postgres(connection, batch, errors)
+                    batch_size = 0
+                continue
+            if batch:
+                stats['transactions'] += 1
+                _flush_postgres(connection, batch, errors)
+                batch_size = 0
+            stats['copies'] += 1
+            stats['transactions'] += 1
+            cursor = connection.cursor()
+            try:
+                cursor.copy_expert(statement, copy_data, size=DUMP_CHUNK_SIZE)
+                connection.commit()
+            except psycopg2.Error as e:
+                connection.rollback()
+                errors.append(f"строка {line}: {describe_error(e)}")
+            finally:
+                cursor.close()
+        if batch:
+            stats['transactions'] += 1
+            _flush_postgres(connection, batch, errors)
+    finally:
+        _close_quietly(connection)
+    return errors, False
+
+def _load_mysql(target, read, stats):
+    """Загрузка SQL дампа MySQL/MariaDB: фиксация раз в DEPLOY_BATCH_MB, остановка на первой ошибке, как у mysql."""
+    batch_size = 0
+    connection = _connect(target)
+    try:
+        cursor = connection.cursor(buffered=True)
+        try:
+            for statement, line, _ in SqlSplitter(read, 'mysql'):
+                stats['statements'] += 1
+                try:
+                    cursor.execute(statement)
+                except mysql.connector.Error as e:
+                    connection.rollback()
+                    return [f"строка {line}: {describe_error(e)}"], True
+                batch_size += len(statement)
+                if batch_size >= DEPLOY_BATCH_MB * 1024 * 1024:
+                    connection.commit()
+                    stats['transactions'] += 1
+                    batch_size = 0
+            connection.commit()
+            stats['transactions'] += 1
+        finally:
+            cursor.close()
+    finally:
+        _close_quietly(connection)
+    return [], False
+
+async def load_sql_dump(target, dump_path, progress=None):
+    """Загрузка SQL дампа (или архива с ним) через драйвер СУБД без запуска psql/mysql.
+
+    Дамп распаковывается на лету (open_dump_reader) и разбирается на операторы; progress
+    получает прочитанные байты архива, как при передаче дампа клиенту. Результат такой же,
+    как у клиента СУБД: returncode и stderr.
+    """
+    stats = {'statements': 0, 'copies': 0, 'transactions': 0}
+    loader = _load_postgres if target['type'] == 'postgresql' else _load_mysql
+
+    def run():
+        source = None
+        if progress is not None and dump_path.suffix != MANIFEST_SUFFIX:
+            source = progress.open(dump_path)
+        try:
+            reader = open_dump_reader(dump_path, source)
+            try:
+                def read():
+                    block = reader.read(DUMP_CHUNK_SIZE)
+                    if progress is not None and source is None:
+                        progress.advance(len(block))
+                    return block
+
+                return loader(target, read, stats)
+            finally:
+                reader.close()
+        finally:
+            if source is not None:
+                source.close()
+
+    started = time.monotonic()
+    try:
+        errors, failed = await asyncio.to_thread(run)
+    except NATIVE_ERRORS as e:
+        errors, failed = [describe_error(e)], True
+    logger.info(
+        f"Дамп {dump_path.name} загружен в {target['database']} за {time.monotonic() - started:.1f} сек: "
+        f"операторов {stats['statements']}, COPY {stats['copies']}, транзакций {stats['transactions']}"
+    )
+    if errors and not failed:
+        logger.warning(
+            f"При загрузке {dump_path.name} пропущено операторов с ошибками: {len(errors)}; "
+            f"{'; '.join(errors[:ERRORS_IN_RESULT])}"
+        )
+    return type('CompletedProcess', (), {
+        'returncode': 1 if failed else 0,
+        'stderr': '\n'.join(errors[:ERRORS_IN_RESULT])
+    })()
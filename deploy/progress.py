@@ -0,0 +1,165 @@
+import asyncio
+import os
+import threading
+import time
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramRetryAfter
+from config.settings import telegram_bot, RESTORE_PROGRESS_INTERVAL, logger
+from backups.dedup import MANIFEST_SUFFIX, read_manifest
+
+RATE_SMOOTHING = 0.3  # Вес последнего интервала в сглаженной скорости
+
+def restore_size(dump_path):
+    """Объём, по которому считается прогресс: размер архива (сжатый) или исходного дампа для манифеста чанков."""
+    if dump_path.suffix == MANIFEST_SUFFIX:
+        return read_manifest(dump_path).get('size', 0)
+    return os.path.getsize(dump_path)
+
+def _format_size(size):
+    if size >= 1024 ** 3:
+        return f"{size / 1024 ** 3:.2f} ГБ"
+    return f"{size / 1024 ** 2:.1f} МБ"
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+class ProgressFile:
+    """Файл архива, прочитанные байты которого засчитываются в прогресс восстановления.
+
+    Распаковщик читает архив последовательно, поэтому число прочитанных байт — это
+    смещение в сжатом файле, и процент не зависит от степени сжатия.
+    """
+
+    def __init__(self, path, progress):
+        self._file = open(path, 'rb')
+        self._progress = progress
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self._progress.advance(len(data))
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+class RestoreProgress:
+    """Прогресс восстановления в сообщении Telegram.
+
+    advance() вызывается из потоков распаковки и только увеличивает счётчик; сообщение
+    правит отдельная задача не чаще раза в RESTORE_PROGRESS_INTERVAL секунд и только при
+    изменении текста. Время выполнения растёт в каждом обновлении, поэтому медленное
+    восстановление отличается от зависшего по скорости, а не по застывшему сообщению.
+    """
+
+    def __init__(self, chat_id, message_id, dbname):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.dbname = dbname
+        self.total = 0
+        self.done = 0
+        self.stage = None
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_done = 0
+        self._last_tick = self._started
+        self._rate = None
+        self._last_text = None
+        self._task = None
+
+    def open(self, path):
+        return ProgressFile(path, self)
+
+    def advance(self, size):
+        with self._lock:
+            self.done += size
+
+    def set_stage(self, stage, total=None):
+        """Новый этап восстановления; total — объём этапа в байтах (None — без процента)."""
+        with self._lock:
+            self.stage = stage
+            self.total = total or 0
+            self.done = 0
+        self._last_done = 0
+        self._rate = None
+        logger.debug(f"Восстановление {self.dbname}: {stage}")
+
+    def _update_rate(self):
+        now = time.monotonic()
+        interval = now - self._last_tick
+        if interval <= 0:
+            return
+        rate = (self.done - self._last_done) / interval
+        self._rate = rate if self._rate is None else self._rate * (1 - RATE_SMOOTHING) + rate * RATE_SMOOTHING
+        self._last_done = self.done
+        self._last_tick = now
+
+    def render(self):
+        elapsed = time.monotonic() - self._started
+        lines = [f"🔄 Развёртывание {self.dbname}" + (f": {self.stage}" if self.stage else '')]
+        if self.total:
+            percent = min(100.0, self.done * 100 / self.total)
+            filled = int(percent // 10)
+            lines.append(f"{'▓' * filled}{'░' * (10 - filled)} {percent:.1f}% ({_format_size(self.done)} из {_format_size(self.total)})")
+        rate = self._rate or 0
+        line = f"⚡ {rate / 1_048_576:.1f} МБ/с · ⏱ {_format_duration(elapsed)}"
+        if self.total and rate > 0:
+            line += f" · осталось ~{_format_duration(max(0, self.total - self.done) / rate)}"
+        lines.append(line)
+        return '\n'.join(lines)
+
+    async def _edit(self, text):
+        try:
+            await telegram_bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text)
+            self._last_text = text
+        except TelegramRetryAfter as e:
+            # Telegram ограничил частоту правок — следующая попытка после паузы
+            logger.debug(f"Обновление прогресса отложено на {e.retry_after} сек")
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest as e:
+            logger.debug(f"Не удалось обновить прогресс восстановления: {e}")
+        except TelegramAPIError as e:
+            # Сеть или сервер Telegram: следующее обновление попробует снова
+            logger.warning(f"Не удалось обновить прогресс восстановления: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(max(1, RESTORE_PROGRESS_INTERVAL))
+            self._update_rate()
+            text = self.render()
+            if text != self._last_text:
+                await self._edit(text)
+
+    def start(self):
+        if telegram_bot and self.chat_id and self.message_id:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        """Остановка обновлений до того, как вызывающий запишет итог в то же сообщение."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Сбой показа прогресса не влияет на результат развёртывания
+            logger.warning(f"Обновление прогресса восстановления {self.dbname} прервано: {e}")
+        self._task = None
@@ -1,6 +1,9 @@
-from config.settings import logger, PORT, DUMP_INTERVAL_HOURS, telegram_bot, dp
-from backups.manager import backup_job
-from storage.yandex_disk import cleanup_yandex_disk_backups
+from config.settings import logger, PORT, BACKUP_SCHEDULE, telegram_bot, dp
+from backups.manager import run_scheduled_backups
+from backups.utils import cleanup_old_archives
+from storage.fanout import run_upload_workers
+from storage.yandex_disk import cleanup_yandex_disk_backups, close_session
+from storage.remote_index import remote_index
 from bot.utils import set_bot_commands
 from aiogram.exceptions import TelegramNetworkError
 import asyncio
@@ -30,12 +33,9 @@ async def start_bot():
             logger.debug("Сессия бота закрыта")
 
 async def run_backups():
-    """Периодический запуск запланированных бэкапов."""
-    logger.info(f"Запуск цикла бэкапов с интервалом {DUMP_INTERVAL_HOURS} часов")
-    while True:
-        await backup_job()
-        logger.debug(f"Ожидание следующего бэкапа через {DUMP_INTERVAL_HOURS * 3600} секунд")
-        await asyncio.sleep(DUMP_INTERVAL_HOURS * 3600)
+    """Запуск запланированных бэкапов по расписанию каждой базы."""
+    logger.info("Запуск планировщика бэкапов")
+    await run_scheduled_backups()
 
 async def run_yandex_cleanup():
     """Периодический запуск очистки старых бэкапов на Яндекс.Диске."""
@@ -45,18 +45,35 @@ async def run_yandex_cleanup():
         logger.debug("Ожидание следующей очистки Яндекс.Диска через 86400 секунд")
         await asyncio.sleep(86400)
 
+async def run_local_cleanup():
+    """Периодическая очистка старых локальных архивов и неиспользуемых чанков."""
+    logger.info("Запуск цикла очистки локальных бэкапов раз в день")
+    while True:
+        try:
+            await asyncio.to_thread(cleanup_old_archives)
+        except Exception as e:
+            logger.error(f"Ошибка очистки локальных бэкапов: {e}")
+        logger.debug("Ожидание следующей очистки локальных бэкапов через 86400 секунд")
+        await asyncio.sleep(86400)
+
 async def main():
     """Основная функция для одновременного запуска бэкапов, очистки и Telegram-бота."""
     logger.info(f"Запуск приложения для бэкапов на порту {PORT}")
-    logger.info(f"Интервал бэкапа: каждые {DUMP_INTERVAL_HOURS} часов")
+    logger.info(f"Расписание бэкапа по умолчанию: {BACKUP_SCHEDULE}")
     
     tasks = [
         asyncio.create_task(run_backups()),
         asyncio.create_task(run_yandex_cleanup()),
+        asyncio.create_task(run_local_cleanup()),
+        asyncio.create_task(run_upload_workers()),
         asyncio.create_task(start_bot())
     ]
     
-    await asyncio.gather(*tasks)
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await remote_index.flush()
+        await close_session()
 
 if __name__ == '__main__':
     try:
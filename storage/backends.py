@@ -0,0 +1,59 @@
+import asyncio
+import os
+from config.settings import logger
+from backups.ratelimit import disk_limiter
+
+class StorageBackend:
+    """Хранилище бэкапов для загрузки через fan_out_archive.
+
+    prepare() вызывается до чтения архива и возвращает цель загрузки (None — архив в это
+    хранилище не загружается), send() получает блоки архива по мере чтения файла и может
+    вернуть словарь с подробностями (url, путь), abort() убирает неполную копию после ошибки.
+    """
+
+    name = 'storage'
+    limiter = None  # Общий RateLimiter направления (загрузка в сеть или запись на диск)
+    accepts_manifests = True  # False — нет хранилища чанков, дедуплицированный бэкап сюда не загружается
+
+    async def prepare(self, archive_file, db_name):
+        return archive_file.name
+
+    async def send(self, target, blocks):
+        raise NotImplementedError
+
+    async def abort(self, target):
+        pass
+
+class LocalMirrorBackend(StorageBackend):
+    """Копия архивов в локальный каталог (второй диск, NFS, смонтированное хранилище)."""
+
+    limiter = disk_limiter
+    accepts_manifests = False
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = f"mirror:{directory}"
+
+    async def prepare(self, archive_file, db_name):
+        path = self.directory / db_name / archive_file.name
+        if path.exists():
+            logger.debug(f"Архив {archive_file.name} уже есть в {self.directory}")
+            return None
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        return path
+
+    async def send(self, target, blocks):
+        part_path = target.with_name(f"{target.name}.part")
+        f = await asyncio.to_thread(open, part_path, 'wb')
+        try:
+            async for block in blocks:
+                await asyncio.to_thread(f.write, block)
+        finally:
+            await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, part_path, target)
+        return {'path': str(target)}
+
+    async def abort(self, target):
+        part_path = target.with_name(f"{target.name}.part")
+        if part_path.exists():
+            await asyncio.to_thread(part_path.unlink)
@@ -0,0 +1,237 @@
+import asyncio
+import time
+from config.settings import (
+    MIRROR_DIRS, YANDEX_DISK_TOKEN, YANDEX_DISK_BACKUP_FOLDER, S3_ENDPOINT_URL, S3_BUCKET, FILE_EXCHANGE_API_URL,
+    FILE_EXCHANGE_CHUNKED_URL, UPLOAD_QUEUE_ENABLED, UPLOAD_QUEUE_WORKERS, logger
+)
+from pathlib import Path
+from backups.ratelimit import READ_BLOCK_SIZE
+from backups.checksums import ChecksumHasher, load_checksums, save_checksums
+from backups.dedup import MANIFEST_SUFFIX
+from storage.backends import LocalMirrorBackend
+from storage.yandex_disk import YandexDiskBackend, upload_to_yandex_disk_rest
+from storage.s3 import S3Backend
+from storage.file_exchange import FileExchangeBackend
+from storage.upload_queue import upload_queue
+
+FANOUT_QUEUE_BLOCKS = 16  # Блоков в очереди каждого хранилища; медленное хранилище задерживает чтение
+
+def configured_backends(file_exchange=False, exclude=()):
+    """Хранилища из настроек; файлообменник — только для бэкапов по запросу."""
+    backends = [LocalMirrorBackend(directory) for directory in MIRROR_DIRS]
+    if YANDEX_DISK_TOKEN and YANDEX_DISK_BACKUP_FOLDER:
+        backends.append(YandexDiskBackend())
+    if S3_ENDPOINT_URL and S3_BUCKET:
+        backends.append(S3Backend())
+    if file_exchange and (FILE_EXCHANGE_API_URL or FILE_EXCHANGE_CHUNKED_URL):
+        backends.append(FileExchangeBackend())
+    return [backend for backend in backends if backend.name not in exclude]
+
+async def _queue_blocks(blocks_queue, limiter):
+    """Блоки архива для одного хранилища с учётом лимита скорости его направления."""
+    while True:
+        block = await blocks_queue.get()
+        if block is None:
+            return
+        if limiter:
+            await limiter.acquire(len(block))
+        yield block
+
+async def _offer(blocks_queue, task, block):
+    """Передача блока хранилищу; хранилище, завершившееся с ошибкой, блоки больше не ждёт."""
+    put = asyncio.ensure_future(blocks_queue.put(block))
+    await asyncio.wait({put, task}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        put.cancel()
+
+async def _timed_send(backend, target, blocks):
+    """Загрузка в одно хранилище: (подробности, длительность в секундах)."""
+    started = time.monotonic()
+    details = await backend.send(target, blocks)
+    return details or {}, time.monotonic() - started
+
+def _describe(result):
+    """Краткий итог загрузки в хранилище для лога."""
+    if result['ok']:
+        return f"{result['mb_per_s']} МБ/с"
+    if result.get('unsupported'):
+        return 'не поддерживается'
+    return 'пропущено' if result['skipped'] else 'ошибка'
+
+def _split_unsupported(archive_file, backends):
+    """Хранилища, принимающие архив, и результаты для остальных.
+
+    Дедуплицированный бэкап (манифест) без хранилища чанков не восстановить,
+    поэтому в хранилища без accepts_manifests (S3, зеркала) он не загружается.
+    """
+    if archive_file.suffix != MANIFEST_SUFFIX:
+        return backends, {}
+    unsupported = {
+        backend.name: {'ok': False, 'skipped': True, 'unsupported': True, 'error': None}
+        for backend in backends if not backend.accepts_manifests
+    }
+    if unsupported:
+        logger.warning(
+            f"Дедуплицированный бэкап {archive_file.name} не копируется в {', '.join(unsupported)}: "
+            f"там нет хранилища чанков"
+        )
+    return [backend for backend in backends if backend.name not in unsupported], unsupported
+
+def unsupported_storages(uploads):
+    """Хранилища, в которые архив не попал из-за его формата (для уведомлений)."""
+    return [name for name, result in (uploads or {}).items() if result.get('unsupported')]
+
+async def fan_out_archive(archive_file, db_name, backends):
+    """Загрузка архива во все хранилища одновременно за одно чтение файла.
+
+    Возвращает результат по каждому хранилищу: {имя: {ok, skipped, bytes, seconds, mb_per_s, error, ...}}.
+    """
+    backends, results = _split_unsupported(archive_file, backends)
+    prepared = await asyncio.gather(
+        *(backend.prepare(archive_file, db_name) for backend in backends), return_exceptions=True
+    )
+    active = []
+    for backend, target in zip(backends, prepared):
+        if isinstance(target, BaseException):
+            logger.error(f"Хранилище {backend.name} недоступно для {archive_file.name}: {target}")
+            results[backend.name] = {'ok': False, 'skipped': False, 'error': str(target)}
+        elif target is None:
+            results[backend.name] = {'ok': False, 'skipped': True, 'error': None}
+        else:
+            blocks_queue = asyncio.Queue(maxsize=FANOUT_QUEUE_BLOCKS)
+            task = asyncio.create_task(_timed_send(backend, target, _queue_blocks(blocks_queue, backend.limiter)))
+            active.append((backend, target, blocks_queue, task))
+    if not active:
+        return results
+
+    size = 0
+    read_error = None
+    # Архивы, дописанные после дампа (описание формата, упакованный каталог), хэшируются здесь же
+    hasher = ChecksumHasher() if load_checksums(archive_file) is None else None
+    try:
+        with open(archive_file, 'rb') as f:
+            while True:
+                block = await asyncio.to_thread(f.read, READ_BLOCK_SIZE)
+                if not block:
+                    if hasher:
+                        # До конца потока: хранилища сверяют суммы сразу после загрузки
+                        await asyncio.to_thread(save_checksums, archive_file, hasher)
+                    break
+                size += len(block)
+                if hasher:
+                    hasher.update(block)
+                live = [(blocks_queue, task) for _, _, blocks_queue, task in active if not task.done()]
+                if not live:
+                    break
+                await asyncio.gather(*(_offer(blocks_queue, task, block) for blocks_queue, task in live))
+        for _, _, blocks_queue, task in active:
+            if not task.done():
+                await _offer(blocks_queue, task, None)
+    except Exception as e:
+        read_error = e
+        logger.error(f"Ошибка чтения {archive_file} при загрузке в хранилища: {e}")
+        for _, _, _, task in active:
+            task.cancel()
+
+    outcomes = await asyncio.gather(*(task for _, _, _, task in active), return_exceptions=True)
+    for (backend, target, _, _), outcome in zip(active, outcomes):
+        if isinstance(outcome, BaseException) or read_error:
+            error = read_error or outcome
+            logger.error(f"Не удалось загрузить {archive_file.name} в {backend.name}: {error}")
+            try:
+                await backend.abort(target)
+            except Exception as e:
+                logger.warning(f"Не удалось убрать неполную копию {archive_file.name} в {backend.name}: {e}")
+            results[backend.name] = {'ok': False, 'skipped': False, 'error': str(error) or type(error).__name__}
+            continue
+        details, seconds = outcome
+        results[backend.name] = {
+            'ok': True,
+            'skipped': False,
+            'error': None,
+            'bytes': size,
+            'seconds': round(seconds, 2),
+            'mb_per_s': round(size / 1_048_576 / seconds, 2) if seconds else None,
+            **details
+        }
+
+    summary = ', '.join(f"{name}: {_describe(result)}" for name, result in results.items())
+    logger.info(f"Архив {archive_file.name} ({size / 1_048_576:.2f} МБ) загружен в хранилища за одно чтение: {summary}")
+    return results
+
+async def upload_archive(archive_file, db_name, file_exchange=False, exclude=()):
+    """Загрузка готового архива во все настроенные хранилища.
+
+    Неудачная загрузка на Яндекс.Диск повторяется отдельно (с повторными попытками),
+    остальные хранилища сообщают об ошибке в результате.
+    """
+    backends = configured_backends(file_exchange, exclude)
+    if not backends:
+        return {}
+    results = await fan_out_archive(archive_file, db_name, backends)
+    yandex = results.get('yandex')
+    if yandex and not yandex['ok'] and not yandex['skipped']:
+        logger.warning(f"Повторная загрузка {archive_file.name} на Яндекс.Диск")
+        yandex['ok'] = await upload_to_yandex_disk_rest(archive_file, db_name)
+    return results
+
+async def enqueue_upload(archive_file, db_name, exclude=()):
+    """Постановка архива в очередь загрузки во все настроенные хранилища, кроме файлообменника.
+
+    Возвращает результат в том же виде, что upload_archive, с отметкой queued.
+    """
+    backends, results = _split_unsupported(archive_file, configured_backends(exclude=exclude))
+    names = [backend.name for backend in backends]
+    if names:
+        upload_queue.enqueue(archive_file, db_name, names)
+    results.update({name: {'ok': False, 'skipped': False, 'queued': True, 'error': None} for name in names})
+    return results
+
+async def _upload_queued(item):
+    """Одна попытка загрузки записи очереди в оставшиеся хранилища."""
+    archive_file = Path(item['archive'])
+    if not archive_file.exists():
+        upload_queue.drop(item['id'], "архив удалён")
+        return
+    available = {backend.name: backend for backend in configured_backends()}
+    removed = [name for name in item['backends'] if name not in available]
+    if removed:
+        logger.warning(f"Хранилища {', '.join(removed)} больше не настроены, архив {archive_file.name} в них не загружается")
+    backends = [
+        available[name] for name in item['backends']
+        if name in available and upload_queue.breaker(name).allow()
+    ]
+    results = await fan_out_archive(archive_file, item['db_name'], backends) if backends else {}
+    done, errors = list(removed), {}
+    for name, result in results.items():
+        if result['ok'] or result['skipped']:
+            upload_queue.breaker(name).record_success()
+            done.append(name)
+        else:
+            upload_queue.breaker(name).record_failure()
+            errors[name] = result['error']
+    upload_queue.update(item['id'], done, errors)
+
+async def _upload_worker(number):
+    """Обработчик очереди: берёт записи, время попытки которых наступило."""
+    while True:
+        item = upload_queue.claim()
+        if item is None:
+            await upload_queue.wait(upload_queue.seconds_until_next())
+            continue
+        logger.debug(f"Обработчик очереди {number}: загрузка {item['id']} в {', '.join(item['backends'])}")
+        try:
+            await _upload_queued(item)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки {item['id']} из очереди: {e}")
+            upload_queue.update(item['id'], [], {'queue': str(e) or type(e).__name__})
+        finally:
+            upload_queue.release(item['id'])
+
+async def run_upload_workers():
+    """Фоновая загрузка архивов из очереди, не больше UPLOAD_QUEUE_WORKERS одновременно."""
+    if not UPLOAD_QUEUE_ENABLED:
+        return
+    pending = upload_queue.items()
+    logger.info(f"Запуск обработчиков очереди загрузки ({UPLOAD_QUEUE_WORKERS}), архивов в очереди: {len(pending)}")
+    await asyncio.gather(*(_upload_worker(number) for number in range(1, max(1, UPLOAD_QUEUE_WORKERS) + 1)))
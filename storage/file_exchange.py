@@ -1,33 +1,242 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
 import aiohttp
-from config.settings import FILE_EXCHANGE_API_URL, logger
+from config.settings import (
+    FILE_EXCHANGE_API_URL, FILE_EXCHANGE_CHUNKED_URL, FILE_EXCHANGE_PART_SIZE_MB, FILE_EXCHANGE_PARALLEL_PARTS,
+    FILE_EXCHANGE_PART_RETRIES, FILE_EXCHANGE_MIN_RATE_KB, logger
+)
+from backups.ratelimit import upload_limiter, iter_file
+from storage.backends import StorageBackend
+
+BASE_TIMEOUT = 30  # Секунд на соединение и ответ сервера сверх времени передачи
+TIMEOUT_SAFETY = 3  # Во сколько раз медленнее измеренной скорости ещё допустимо передавать часть
+UPLOAD_STATE_SUFFIX = '.upload.json'  # Состояние незавершённой загрузки рядом с архивом
+
+# Протокол частичной загрузки (FILE_EXCHANGE_CHUNKED_URL, см. storage/file_exchange_stub.py):
+#   POST {url}                      {"filename", "size", "part_size"} -> {"upload_id"}
+#   GET  {url}/{id}                 -> {"received": [номера частей]}, 404 — загрузка истекла
+#   PUT  {url}/{id}/parts/{n}       тело части, X-Part-Sha256 -> 204
+#   POST {url}/{id}/complete        -> {"url"}
+
+def _min_rate():
+    return max(1, FILE_EXCHANGE_MIN_RATE_KB) * 1024
+
+def transfer_timeout(size, rate=None):
+    """Тайм-аут передачи size байт: по измеренной скорости с запасом или по минимальной ожидаемой."""
+    rate = rate / TIMEOUT_SAFETY if rate else _min_rate()
+    return aiohttp.ClientTimeout(total=BASE_TIMEOUT + size / max(rate, 1), sock_connect=BASE_TIMEOUT)
+
+class ChunkedUpload:
+    """Загрузка на файлообменник частями фиксированного размера.
+
+    Части уходят параллельно (FILE_EXCHANGE_PARALLEL_PARTS), при ошибке повторяется только
+    неудачная часть. Идентификатор загрузки хранится рядом с архивом, поэтому после сбоя
+    или перезапуска отправляются только части, которых ещё нет на сервере.
+    """
+
+    def __init__(self, session, archive_file):
+        self._session = session
+        self.archive_file = archive_file
+        self.size = os.path.getsize(archive_file)
+        self.part_size = max(1, FILE_EXCHANGE_PART_SIZE_MB) * 1024 * 1024
+        self.parts = max(1, -(-self.size // self.part_size))
+        self._state_path = archive_file.with_name(f"{archive_file.name}{UPLOAD_STATE_SUFFIX}")
+        self._rate = None  # Измеренная скорость передачи одной части, байт в секунду
+        self.upload_id = None
+        self.received = set()
+
+    def _url(self, *parts):
+        return '/'.join([FILE_EXCHANGE_CHUNKED_URL.rstrip('/'), *parts])
+
+    def _save_state(self):
+        tmp_path = self._state_path.with_name(f"{self._state_path.name}.tmp")
+        tmp_path.write_text(json.dumps({
+            'upload_id': self.upload_id,
+            'size': self.size,
+            'part_size': self.part_size
+        }), encoding='utf-8')
+        os.replace(tmp_path, self._state_path)
+
+    def _load_state(self):
+        if not self._state_path.exists():
+            return None
+        try:
+            state = json.loads(self._state_path.read_text(encoding='utf-8'))
+        except ValueError:
+            return None
+        if state.get('size') != self.size or state.get('part_size') != self.part_size:
+            return None
+        return state
+
+    async def start(self):
+        """Продолжение сохранённой загрузки или создание новой."""
+        state = self._load_state()
+        if state:
+            async with self._session.get(self._url(state['upload_id']), timeout=transfer_timeout(0)) as response:
+                if response.status == 200:
+                    self.upload_id = state['upload_id']
+                    self.received = set((await response.json())['received'])
+                    logger.info(
+                        f"Продолжение загрузки {self.archive_file.name} на файлообменник: "
+                        f"получено частей {len(self.received)} из {self.parts}"
+                    )
+                    return
+                logger.debug(f"Загрузка {state['upload_id']} не найдена на файлообменнике ({response.status}), начинаем заново")
+        payload = {'filename': self.archive_file.name, 'size': self.size, 'part_size': self.part_size}
+        async with self._session.post(FILE_EXCHANGE_CHUNKED_URL, json=payload, timeout=transfer_timeout(0)) as response:
+            response.raise_for_status()
+            self.upload_id = (await response.json())['upload_id']
+        self.received = set()
+        await asyncio.to_thread(self._save_state)
+
+    async def put_part(self, number, data):
+        """Отправка части с повторами; тайм-аут зависит от размера части и измеренной скорости."""
+        digest = hashlib.sha256(data).hexdigest()
+        for attempt in range(1, FILE_EXCHANGE_PART_RETRIES + 1):
+            await upload_limiter.acquire(len(data))
+            started = time.monotonic()
+            try:
+                async with self._session.put(
+                    self._url(self.upload_id, 'parts', str(number)),
+                    data=data,
+                    headers={'X-Part-Sha256': digest},
+                    timeout=transfer_timeout(len(data), self._rate)
+                ) as response:
+                    response.raise_for_status()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == FILE_EXCHANGE_PART_RETRIES:
+                    raise
+                logger.warning(f"Часть {number} {self.archive_file.name} не загружена ({e}), попытка {attempt + 1}")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            elapsed = max(time.monotonic() - started, 0.001)
+            rate = len(data) / elapsed
+            self._rate = rate if self._rate is None else self._rate * 0.7 + rate * 0.3
+            self.received.add(number)
+            return
+
+    async def complete(self):
+        """Сборка файла на сервере, возвращает ссылку на скачивание."""
+        # Сервер собирает и проверяет файл целиком: время зависит от размера
+        async with self._session.post(
+            self._url(self.upload_id, 'complete'), timeout=transfer_timeout(self.size, self._rate and self._rate * 10)
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+        if 'url' not in data:
+            raise ValueError(f"Ответ файлообменника не содержит 'url': {data}")
+        self._state_path.unlink(missing_ok=True)
+        return data['url']
+
+    async def run(self, parts):
+        """Параллельная отправка частей из асинхронного источника (номер, данные)."""
+        semaphore = asyncio.Semaphore(max(1, FILE_EXCHANGE_PARALLEL_PARTS))
+        tasks = []
+
+        async def send(number, data):
+            try:
+                await self.put_part(number, data)
+            finally:
+                semaphore.release()
+
+        try:
+            async for number, data in parts:
+                # Свободный слот берётся до чтения следующей части: в памяти не больше N частей
+                await semaphore.acquire()
+                tasks.append(asyncio.create_task(send(number, data)))
+                failed = next((task for task in tasks if task.done() and task.exception()), None)
+                if failed:
+                    raise failed.exception()
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        logger.info(f"Загружено частей {self.archive_file.name} на файлообменник: {len(self.received)} из {self.parts}")
+        return await self.complete()
+
+    async def file_parts(self):
+        """Части архива с диска, кроме уже полученных сервером."""
+        with open(self.archive_file, 'rb') as f:
+            for number in range(1, self.parts + 1):
+                if number in self.received:
+                    continue
+                await asyncio.to_thread(f.seek, (number - 1) * self.part_size)
+                yield number, await asyncio.to_thread(f.read, self.part_size)
+
+    async def stream_parts(self, blocks):
+        """Части из потока блоков (загрузка в несколько хранилищ за одно чтение)."""
+        buffer = bytearray()
+        number = 1
+        async for block in blocks:
+            buffer += block
+            while len(buffer) >= self.part_size:
+                if number not in self.received:
+                    yield number, bytes(buffer[:self.part_size])
+                del buffer[:self.part_size]
+                number += 1
+        if (buffer or number == 1) and number not in self.received:
+            yield number, bytes(buffer)
+
+class FileExchangeBackend(StorageBackend):
+    """Файлообменник: архив отправляется формой или частями, в ответ приходит ссылка на скачивание."""
+
+    name = 'file_exchange'
+    # Частичная загрузка ограничивает скорость сама, с учётом повторов
+    limiter = None if FILE_EXCHANGE_CHUNKED_URL else upload_limiter
+
+    async def prepare(self, archive_file, db_name):
+        return archive_file
+
+    async def send(self, target, blocks):
+        async with aiohttp.ClientSession() as session:
+            if FILE_EXCHANGE_CHUNKED_URL:
+                upload = ChunkedUpload(session, target)
+                await upload.start()
+                url = await upload.run(upload.stream_parts(blocks))
+            else:
+                url = await _post_form(session, target, blocks)
+        logger.info(f"Загружен {target} на файлообменник: {url}")
+        return {'url': url}
+
+async def _post_form(session, archive_file, blocks):
+    """Загрузка одним запросом (сервер без частичной загрузки), тайм-аут по размеру архива."""
+    form = aiohttp.FormData()
+    form.add_field('file', blocks, filename=archive_file.name, content_type='application/zip')
+    timeout = transfer_timeout(os.path.getsize(archive_file))
+    async with session.post(FILE_EXCHANGE_API_URL, data=form, timeout=timeout) as response:
+        response.raise_for_status()
+        data = await response.json()
+    if 'url' not in data:
+        raise ValueError(f"Ответ файлообменника не содержит 'url': {data}")
+    return data['url']
 
 async def upload_to_file_exchange(zip_file):
     """Загрузка ZIP-файла на файлообменник и возврат URL для скачивания."""
-    if not FILE_EXCHANGE_API_URL:
+    if not FILE_EXCHANGE_API_URL and not FILE_EXCHANGE_CHUNKED_URL:
         logger.warning("Загрузка на файлообменник не настроена (отсутствует FILE_EXCHANGE_API_URL)")
         return None
-    
-    async with aiohttp.ClientSession() as session:
-        try:
-            with open(zip_file, 'rb') as f:
-                form = aiohttp.FormData()
-                form.add_field('file', f, filename=zip_file.name, content_type='application/zip')
-                async with session.post(FILE_EXCHANGE_API_URL, data=form, timeout=30) as response:
-                    response.raise_for_status()
-                    data = await response.json()
-                    if 'url' not in data:
-                        logger.error(f"Ответ файлообменника не содержит 'url': {data}")
-                        return None
-                    
-                    download_url = data['url']
-                    logger.info(f"Загружен {zip_file} на файлообменник: {download_url}")
-                    return download_url
-        except aiohttp.ClientError as e:
-            logger.error(f"Сетевая ошибка при загрузке {zip_file} на файлообменник: {e}")
-            return None
-        except ValueError as e:
-            logger.error(f"Ошибка разбора ответа файлообменника: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Не удалось загрузить {zip_file} на файлообменник: {e}")
-            return None
\ No newline at end of file
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            if FILE_EXCHANGE_CHUNKED_URL:
+                upload = ChunkedUpload(session, zip_file)
+                await upload.start()
+                download_url = await upload.run(upload.file_parts())
+            else:
+                download_url = await _post_form(session, zip_file, iter_file(zip_file, upload_limiter))
+        logger.info(f"Загружен {zip_file} на файлообменник: {download_url}")
+        return download_url
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error(f"Сетевая ошибка при загрузке {zip_file} на файлообменник: {e}")
+        return None
+    except ValueError as e:
+        logger.error(f"Ошибка разбора ответа файлообменника: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Не удалось загрузить {zip_file} на файлообменник: {e}")
+        return None
@@ -0,0 +1,110 @@
+"""Локальный сервер-заменитель файлообменника для проверки загрузки без внешнего сервиса.
+
+Реализует оба протокола storage/file_exchange.py: загрузку формой (FILE_EXCHANGE_API_URL)
+и частичную загрузку с докачкой (FILE_EXCHANGE_CHUNKED_URL). Параметр --fail-rate
+отвечает ошибкой 503 на указанную долю частей, чтобы проверить повтор неудачных частей.
+
+    python -m storage.file_exchange_stub --port 8080 --dir /tmp/file_exchange --fail-rate 0.2
+    FILE_EXCHANGE_API_URL=http://127.0.0.1:8080/upload
+    FILE_EXCHANGE_CHUNKED_URL=http://127.0.0.1:8080/uploads
+"""
+import argparse
+import hashlib
+import random
+import uuid
+from pathlib import Path
+from aiohttp import web
+
+def create_app(storage_dir, fail_rate=0.0):
+    """Приложение aiohttp с загрузками в storage_dir."""
+    storage_dir = Path(storage_dir)
+    parts_dir = storage_dir / '.parts'
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    uploads = {}
+
+    def file_url(request, name):
+        return str(request.url.with_path(f"/files/{name}").with_query(None))
+
+    async def upload_form(request):
+        reader = await request.multipart()
+        field = await reader.next()
+        if field is None or field.name != 'file':
+            return web.json_response({'error': 'file field required'}, status=400)
+        name = f"{uuid.uuid4().hex[:8]}_{Path(field.filename).name}"
+        with open(storage_dir / name, 'wb') as f:
+            while chunk := await field.read_chunk():
+                f.write(chunk)
+        return web.json_response({'url': file_url(request, name)})
+
+    async def create_upload(request):
+        payload = await request.json()
+        upload_id = uuid.uuid4().hex
+        uploads[upload_id] = {
+            'filename': Path(payload['filename']).name,
+            'size': int(payload['size']),
+            'part_size': int(payload['part_size']),
+            'received': set()
+        }
+        (parts_dir / upload_id).mkdir()
+        return web.json_response({'upload_id': upload_id}, status=201)
+
+    def get_upload(request):
+        upload = uploads.get(request.match_info['upload_id'])
+        if upload is None:
+            raise web.HTTPNotFound()
+        return upload
+
+    async def upload_status(request):
+        upload = get_upload(request)
+        return web.json_response({
+            'upload_id': request.match_info['upload_id'],
+            'size': upload['size'],
+            'part_size': upload['part_size'],
+            'received': sorted(upload['received'])
+        })
+
+    async def put_part(request):
+        upload = get_upload(request)
+        number = int(request.match_info['number'])
+        data = await request.read()
+        if random.random() < fail_rate:
+            return web.json_response({'error': 'injected failure'}, status=503)
+        if request.headers.get('X-Part-Sha256') not in (None, hashlib.sha256(data).hexdigest()):
+            return web.json_response({'error': 'checksum mismatch'}, status=400)
+        (parts_dir / request.match_info['upload_id'] / str(number)).write_bytes(data)
+        upload['received'].add(number)
+        return web.Response(status=204)
+
+    async def complete_upload(request):
+        upload_id = request.match_info['upload_id']
+        upload = get_upload(request)
+        parts = max(1, -(-upload['size'] // upload['part_size']))
+        missing = [number for number in range(1, parts + 1) if number not in upload['received']]
+        if missing:
+            return web.json_response({'error': 'missing parts', 'missing': missing}, status=409)
+        name = f"{upload_id[:8]}_{upload['filename']}"
+        with open(storage_dir / name, 'wb') as f:
+            for number in range(1, parts + 1):
+                f.write((parts_dir / upload_id / str(number)).read_bytes())
+        if (storage_dir / name).stat().st_size != upload['size']:
+            return web.json_response({'error': 'size mismatch'}, status=409)
+        del uploads[upload_id]
+        return web.json_response({'url': file_url(request, name)})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post('/upload', upload_form)
+    app.router.add_post('/uploads', create_upload)
+    app.router.add_get('/uploads/{upload_id}', upload_status)
+    app.router.add_put('/uploads/{upload_id}/parts/{number}', put_part)
+    app.router.add_post('/uploads/{upload_id}/complete', complete_upload)
+    app.router.add_static('/files', storage_dir)
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Локальный сервер-заменитель файлообменника")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--dir', default='file_exchange_stub')
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    web.run_app(create_app(args.dir, args.fail_rate), host=args.host, port=args.port)
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from config.settings import DUMPS_DIR, YANDEX_DISK_BACKUP_FOLDER, logger
+
+REMOTE_INDEX_FILE = DUMPS_DIR / '.remote_index.json'
+SAVE_DELAY = 2  # Изменения за это время записываются на диск одним разом, секунды
+
+def _normalize(path):
+    """Путь без префикса disk: — в таком виде пути хранятся в индексе."""
+    return path[len('disk:'):] if path.startswith('disk:') else path
+
+class RemoteIndex:
+    """Локальный индекс файлов бэкапов на Яндекс.Диске: путь, размер, контрольные суммы, время изменения.
+
+    Обновляется при каждой загрузке и удалении и периодически сверяется с полным
+    списком файлов на Диске, поэтому ответ «есть ли архив на Диске» не требует запросов к API.
+    Изменения сразу видны в памяти, а на диск пишутся с задержкой SAVE_DELAY в отдельном потоке;
+    потерянные при аварийной остановке изменения восстановит ежедневная сверка перед очисткой Диска.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._data = None
+        self.version = 0  # Растёт при каждом изменении индекса: по нему каталог бэкапов узнаёт об изменениях
+        self._dirty = False
+        self._flush_task = None
+        self._write_lock = asyncio.Lock()
+
+    def _load(self):
+        """Ленивое чтение индекса с диска."""
+        if self._data is None:
+            self._data = {'reconciled_at': None, 'folders': [], 'files': {}}
+            if self._path.exists():
+                try:
+                    self._data.update(json.loads(self._path.read_text(encoding='utf-8')))
+                except ValueError as e:
+                    logger.warning(f"Повреждён индекс Яндекс.Диска {self._path}, будет выполнена сверка: {e}")
+        return self._data
+
+    def _write(self, data):
+        """Атомарная запись индекса."""
+        tmp_path = self._path.with_name(f"{self._path.name}.tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp_path, self._path)
+
+    def _save(self):
+        """Отметка об изменении индекса и отложенная запись на диск."""
+        self.version += 1
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._dirty = False
+            self._write(self._data)
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(SAVE_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        """Запись накопленных изменений индекса на диск."""
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            # Записи файлов при изменении заменяются целиком, копии верхнего уровня достаточно
+            data = {**self._data, 'files': dict(self._data['files']), 'folders': list(self._data['folders'])}
+            try:
+                await asyncio.to_thread(self._write, data)
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Не удалось сохранить индекс Яндекс.Диска {self._path}: {e}")
+
+    def get(self, path):
+        """Запись о файле или None, если файла на Диске нет (по данным индекса)."""
+        return self._load()['files'].get(_normalize(path))
+
+    def files(self):
+        """Все известные файлы: [{path, size, modified, md5, sha256}]."""
+        return [{'path': path, **entry} for path, entry in self._load()['files'].items()]
+
+    def find(self, name):
+        """Файлы с указанным именем в любой папке базы."""
+        return [entry for entry in self.files() if entry['path'].rsplit('/', 1)[-1] == name]
+
+    def record(self, path, size, modified=None, md5=None, sha256=None):
+        """Добавление или обновление файла после загрузки."""
+        self._load()['files'][_normalize(path)] = {
+            'size': size,
+            'modified': modified or datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'md5': md5,
+            'sha256': sha256
+        }
+        self._save()
+
+    def remove(self, paths):
+        """Удаление файлов из индекса после удаления на Диске."""
+        files = self._load()['files']
+        for path in paths:
+            files.pop(_normalize(path), None)
+        self._save()
+
+    def has_folder(self, folder_path):
+        """Известна ли папка как существующая на Диске."""
+        return _normalize(folder_path) in self._load()['folders']
+
+    def add_folder(self, folder_path):
+        """Запоминание существующей или созданной папки."""
+        folders = self._load()['folders']
+        if _normalize(folder_path) not in folders:
+            folders.append(_normalize(folder_path))
+            self._save()
+
+    def forget_folder(self, folder_path):
+        """Папка пропала с Диска: забываем её и все файлы в ней."""
+        data = self._load()
+        folder_path = _normalize(folder_path)
+        if folder_path in data['folders']:
+            data['folders'].remove(folder_path)
+        data['files'] = {path: entry for path, entry in data['files'].items() if not path.startswith(f"{folder_path}/")}
+        self._save()
+
+    def replace(self, files, folders):
+        """Замена содержимого индекса результатом полной сверки."""
+        data = self._load()
+        before = set(data['files'])
+        data['files'] = {_normalize(path): entry for path, entry in files.items()}
+        data['folders'] = sorted({_normalize(folder) for folder in folders})
+        data['reconciled_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self._save()
+        after = set(data['files'])
+        logger.info(
+            f"Индекс Яндекс.Диска сверен: файлов {len(after)}, "
+            f"появилось {len(after - before)}, пропало {len(before - after)}"
+        )
+
+remote_index = RemoteIndex(REMOTE_INDEX_FILE)
+
+def remote_archive_path(db_name, archive_name):
+    """Путь архива базы на Яндекс.Диске."""
+    return f"{YANDEX_DISK_BACKUP_FOLDER}/{db_name}/{archive_name}"
+
+def is_offsite(db_name, archive_name):
+    """Есть ли архив на Яндекс.Диске (по локальному индексу, без запросов к API)."""
+    return remote_index.get(remote_archive_path(db_name, archive_name)) is not None
@@ -0,0 +1,143 @@
+import hashlib
+import hmac
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+from xml.etree import ElementTree
+import aiohttp
+from yarl import URL
+from config.settings import S3_ENDPOINT_URL, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION, S3_PREFIX, S3_PART_SIZE_MB, logger
+from backups.ratelimit import upload_limiter
+from storage.backends import StorageBackend
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024  # Минимальный размер части multipart upload (кроме последней)
+S3_REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=600)
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _hmac(key, msg):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+def _canonical_query(query):
+    """Строка запроса в каноническом виде SigV4 (ключи по алфавиту, RFC 3986)."""
+    return '&'.join(f"{quote(key, safe='~')}={quote(value, safe='~')}" for key, value in sorted(query.items()))
+
+def sign_request(method, host, path, query, payload_hash, now=None):
+    """Заголовки запроса S3 с подписью AWS Signature Version 4."""
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = now.strftime('%Y%m%d')
+    signed_headers = 'host;x-amz-content-sha256;x-amz-date'
+    canonical_request = '\n'.join([
+        method,
+        path,
+        _canonical_query(query),
+        f"host:{host}\nx-amz-content-sha256:{payload_hash}\nx-amz-date:{amz_date}\n",
+        signed_headers,
+        payload_hash
+    ])
+    scope = f"{date}/{S3_REGION}/s3/aws4_request"
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope, _sha256(canonical_request.encode())])
+    signing_key = _hmac(_hmac(_hmac(_hmac(f"AWS4{S3_SECRET_KEY}".encode(), date), S3_REGION), 's3'), 'aws4_request')
+    signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return {
+        'Host': host,
+        'x-amz-date': amz_date,
+        'x-amz-content-sha256': payload_hash,
+        'Authorization': (
+            f"AWS4-HMAC-SHA256 Credential={S3_ACCESS_KEY}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+    }
+
+def _find_text(xml, tag):
+    """Текст элемента ответа S3 без учёта пространства имён."""
+    for element in ElementTree.fromstring(xml).iter():
+        if element.tag.rsplit('}', 1)[-1] == tag:
+            return element.text
+    return None
+
+class S3Backend(StorageBackend):
+    """S3-совместимое хранилище (AWS, MinIO, Yandex Object Storage) через multipart upload.
+
+    Архив передаётся частями по S3_PART_SIZE_MB по мере чтения, поэтому в памяти
+    держится не больше одной части, а прерванная загрузка отменяется целиком.
+    """
+
+    name = 's3'
+    limiter = upload_limiter
+    accepts_manifests = False
+
+    def __init__(self):
+        endpoint = urlsplit(S3_ENDPOINT_URL.rstrip('/'))
+        self._base = f"{endpoint.scheme}://{endpoint.netloc}"
+        self._host = endpoint.netloc
+        self._base_path = endpoint.path
+        self._part_size = max(S3_MIN_PART_SIZE, S3_PART_SIZE_MB * 1024 * 1024)
+
+    def _key(self, db_name, name):
+        return '/'.join(part for part in (S3_PREFIX.strip('/'), db_name, name) if part)
+
+    async def _request(self, session, method, key, query=None, body=b''):
+        """Подписанный запрос к объекту бакета, возвращает (статус, заголовки, тело)."""
+        query = query or {}
+        path = f"{self._base_path}/{S3_BUCKET}/{quote(key, safe='/~')}"
+        headers = sign_request(method, self._host, path, query, _sha256(body))
+        url = self._base + path + (f"?{_canonical_query(query)}" if query else '')
+        async with session.request(
+            method, URL(url, encoded=True), data=body, headers=headers, timeout=S3_REQUEST_TIMEOUT
+        ) as response:
+            return response.status, response.headers, await response.read()
+
+    @staticmethod
+    def _raise_for_status(status, body, action):
+        # CompleteMultipartUpload может вернуть 200 с ошибкой в теле
+        if status >= 300 or b'<Error>' in body:
+            raise aiohttp.ClientError(f"S3 {action}: {status} {body[:300].decode(errors='replace')}")
+
+    async def prepare(self, archive_file, db_name):
+        key = self._key(db_name, archive_file.name)
+        async with aiohttp.ClientSession() as session:
+            status, _, _ = await self._request(session, 'HEAD', key)
+            if status == 200:
+                logger.warning(f"Объект {key} уже есть в S3, пропускаем загрузку")
+                return None
+            status, _, body = await self._request(session, 'POST', key, {'uploads': ''})
+        self._raise_for_status(status, body, f"создание загрузки {key}")
+        return {'key': key, 'upload_id': _find_text(body, 'UploadId')}
+
+    async def send(self, target, blocks):
+        key, upload_id = target['key'], target['upload_id']
+        parts = []
+        buffer = bytearray()
+        async with aiohttp.ClientSession() as session:
+
+            async def upload_part(data):
+                number = len(parts) + 1
+                status, headers, body = await self._request(
+                    session, 'PUT', key, {'partNumber': str(number), 'uploadId': upload_id}, data
+                )
+                self._raise_for_status(status, body, f"часть {number} {key}")
+                parts.append((number, headers['ETag']))
+
+            async for block in blocks:
+                buffer += block
+                while len(buffer) >= self._part_size:
+                    await upload_part(bytes(buffer[:self._part_size]))
+                    del buffer[:self._part_size]
+            if buffer or not parts:
+                await upload_part(bytes(buffer))
+
+            complete = ''.join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+            )
+            body = f"<CompleteMultipartUpload>{complete}</CompleteMultipartUpload>".encode()
+            status, _, body = await self._request(session, 'POST', key, {'uploadId': upload_id}, body)
+            self._raise_for_status(status, body, f"завершение загрузки {key}")
+        return {'key': key, 'parts': len(parts)}
+
+    async def abort(self, target):
+        async with aiohttp.ClientSession() as session:
+            status, _, body = await self._request(session, 'DELETE', target['key'], {'uploadId': target['upload_id']})
+        if status not in (204, 404):
+            logger.warning(f"Не удалось отменить загрузку {target['key']} в S3: {status} {body[:300]}")
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from config.settings import (
+    DUMPS_DIR, UPLOAD_RETRY_BASE_SECONDS, UPLOAD_RETRY_MAX_SECONDS, UPLOAD_BREAKER_THRESHOLD,
+    UPLOAD_BREAKER_COOLDOWN_SECONDS, logger
+)
+
+UPLOAD_QUEUE_FILE = DUMPS_DIR / '.upload_queue.json'
+UPLOAD_QUEUE_IDLE_SECONDS = 300  # Сколько ждать новых архивов, если очередь пуста
+
+class CircuitBreaker:
+    """Размыкатель для одного хранилища.
+
+    После UPLOAD_BREAKER_THRESHOLD неудач подряд хранилище не получает загрузок
+    UPLOAD_BREAKER_COOLDOWN_SECONDS секунд, затем пропускается одна пробная загрузка:
+    успех замыкает цепь, неудача снова размыкает её на время остывания.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def retry_in(self):
+        """Секунд до пробной загрузки; 0 — загрузка разрешена."""
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.opened_at + UPLOAD_BREAKER_COOLDOWN_SECONDS - time.monotonic())
+
+    def allow(self):
+        """Можно ли начать загрузку (в полуоткрытом состоянии — только одну)."""
+        if self.opened_at is None:
+            return True
+        if self._trial or self.retry_in() > 0:
+            return False
+        self._trial = True
+        logger.info(f"Пробная загрузка в хранилище {self.name} после остывания")
+        return True
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info(f"Хранилище {self.name} снова доступно, загрузки возобновлены")
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.failures >= max(1, UPLOAD_BREAKER_THRESHOLD):
+            if self.opened_at is None:
+                logger.warning(
+                    f"Хранилище {self.name}: {self.failures} неудачных загрузок подряд, "
+                    f"загрузки приостановлены на {UPLOAD_BREAKER_COOLDOWN_SECONDS} сек"
+                )
+            self.opened_at = time.monotonic()
+
+def retry_delay(attempts):
+    """Экспоненциальная задержка перед повтором после attempts неудачных попыток."""
+    return min(UPLOAD_RETRY_MAX_SECONDS, UPLOAD_RETRY_BASE_SECONDS * 2 ** max(0, attempts - 1))
+
+class UploadQueue:
+    """Очередь архивов на загрузку в хранилища, сохраняемая на диск.
+
+    Запись очереди — архив и хранилища, в которые он ещё не загружен. Запись обновляется
+    после каждой попытки, поэтому после перезапуска загрузка продолжается только в
+    оставшиеся хранилища. Время следующей попытки хранится как Unix-время.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._items = None
+        self._claimed = set()
+        self._wakeup = asyncio.Event()
+        self.breakers = {}
+
+    def _load(self):
+        """Ленивое чтение очереди с диска."""
+        if self._items is None:
+            self._items = {}
+            if self._path.exists():
+                try:
+                    self._items = json.loads(self._path.read_text(encoding='utf-8'))
+                except ValueError as e:
+                    logger.error(f"Повреждён файл очереди загрузок {self._path}: {e}")
+        return self._items
+
+    def _save(self):
+        """Атомарная запись очереди."""
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._path.with_name(f"{self._path.name}.tmp")
+        tmp_path.write_text(json.dumps(self._items, ensure_ascii=False, indent=1), encoding='utf-8')
+        os.replace(tmp_path, self._path)
+
+    def breaker(self, name):
+        if name not in self.breakers:
+            self.breakers[name] = CircuitBreaker(name)
+        return self.breakers[name]
+
+    def enqueue(self, archive_file, db_name, backends):
+        """Добавление архива в очередь; повторное добавление расширяет список хранилищ."""
+        items = self._load()
+        item_id = f"{db_name}/{archive_file.name}"
+        item = items.get(item_id)
+        if item:
+            item['backends'] = sorted(set(item['backends']) | set(backends))
+            item['next_attempt_at'] = time.time()
+        else:
+            items[item_id] = {
+                'archive': str(archive_file),
+                'db_name': db_name,
+                'backends': sorted(backends),
+                'attempts': 0,
+                'next_attempt_at': time.time(),
+                'last_error': None,
+                'enqueued_at': datetime.now().isoformat(timespec='seconds')
+            }
+        self._save()
+        self._wakeup.set()
+        logger.info(f"Архив {archive_file.name} поставлен в очередь загрузки: {', '.join(sorted(backends))}")
+
+    def items(self):
+        """Все записи очереди: [{id, archive, db_name, backends, attempts, next_attempt_at, last_error}]."""
+        return [{'id': item_id, **item} for item_id, item in self._load().items()]
+
+    def is_pending(self, archive_file):
+        """Ждёт ли архив загрузки (такой архив нельзя удалять при очистке)."""
+        return any(item['archive'] == str(archive_file) for item in self._load().values())
+
+    def _blocked_for(self, item):
+        """Секунд, пока все оставшиеся хранилища записи разомкнуты; 0 — хотя бы одно доступно."""
+        return min(self.breaker(name).retry_in() for name in item['backends'])
+
+    def claim(self):
+        """Следующая запись, которую пора загружать, или None; запись отдаётся одному обработчику."""
+        now = time.time()
+        for item_id, item in sorted(self._load().items(), key=lambda entry: entry[1]['next_attempt_at']):
+            if item_id in self._claimed or item['next_attempt_at'] > now:
+                continue
+            blocked = self._blocked_for(item)
+            if blocked:
+                item['next_attempt_at'] = now + blocked
+                continue
+            self._claimed.add(item_id)
+            return {'id': item_id, **item}
+        return None
+
+    def release(self, item_id):
+        self._claimed.discard(item_id)
+
+    def seconds_until_next(self):
+        """Секунд до ближайшей попытки среди незанятых записей."""
+        pending = [item['next_attempt_at'] for item_id, item in self._load().items() if item_id not in self._claimed]
+        if not pending:
+            return UPLOAD_QUEUE_IDLE_SECONDS
+        return min(UPLOAD_QUEUE_IDLE_SECONDS, max(0.0, min(pending) - time.time()))
+
+    async def wait(self, timeout):
+        """Ожидание новой записи или наступления времени попытки."""
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def update(self, item_id, done, errors):
+        """Итог попытки: done — хранилища, куда архив загружен, errors — {хранилище: ошибка}."""
+        items = self._load()
+        item = items.get(item_id)
+        if item is None:
+            return
+        item['backends'] = [name for name in item['backends'] if name not in done]
+        if not item['backends']:
+            del items[item_id]
+            logger.info(f"Архив {item_id} загружен во все хранилища, удалён из очереди")
+        elif errors:
+            item['attempts'] += 1
+            item['last_error'] = '; '.join(f"{name}: {error}" for name, error in errors.items())
+            delay = retry_delay(item['attempts'])
+            item['next_attempt_at'] = time.time() + delay
+            logger.warning(
+                f"Архив {item_id} не загружен в {', '.join(errors)} (попытка {item['attempts']}), "
+                f"повтор через {delay:.0f} сек"
+            )
+        else:
+            # Оставшиеся хранилища ждут пробной загрузки после остывания — попытка не засчитывается
+            item['next_attempt_at'] = time.time() + UPLOAD_RETRY_BASE_SECONDS
+        self._save()
+        self._wakeup.set()
+
+    def drop(self, item_id, reason):
+        """Удаление записи, загрузка которой больше невозможна."""
+        if self._load().pop(item_id, None) is not None:
+            logger.warning(f"Архив {item_id} удалён из очереди загрузки: {reason}")
+            self._save()
+
+upload_queue = UploadQueue(UPLOAD_QUEUE_FILE)
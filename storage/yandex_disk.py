@@ -1,10 +1,341 @@
 import aiohttp
+import asyncio
+import json
 import os
-from config.settings import YANDEX_DISK_TOKEN, YANDEX_DISK_BACKUP_FOLDER, logger
+import queue
+import time
+from config.settings import (
+    YANDEX_DISK_TOKEN, YANDEX_DISK_BACKUP_FOLDER, YANDEX_CACHE_TTL, YANDEX_MAX_CONNECTIONS, YANDEX_DELETE_CONCURRENCY,
+    BACKUP_RETENTION_DAYS, DUMPS_DIR, logger
+)
+from storage.remote_index import remote_index, remote_archive_path
+from backups.ratelimit import upload_limiter, download_limiter, iter_file
+from storage.backends import StorageBackend
+from backups.checksums import load_checksums
+from bot.utils import send_telegram_notification
+from backups.dedup import CHUNK_STORE_DIR, MANIFEST_SUFFIX, chunk_path, read_manifest, referenced_chunks
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
 from datetime import datetime, timedelta, timezone
 import traceback
 
+CHUNKS_FOLDER_NAME = '.chunks'  # Общая папка чанков дедуплицированных бэкапов
+CHUNK_UPLOAD_CONCURRENCY = 4
+VERIFY_ATTEMPTS = 5  # Диск может отдать контрольные суммы не сразу после загрузки
+VERIFY_DELAY = 2
+REMOTE_CHUNKS_FILE = CHUNK_STORE_DIR / 'remote.txt'  # Чанки, уже загруженные на Яндекс.Диск
+API_URL = "https://cloud-api.yandex.net/v1/disk"
+PIPELINED_CODECS = ('zip', 'zstd', 'gzip')  # Кодеки, которые пишут архив последовательно, без возврата назад
+PIPELINE_BLOCK_SIZE = 1024 * 1024  # Размер блока, передаваемого в загрузку
+PIPELINE_MAX_PENDING = 16  # Блоков в очереди на загрузку; при заполнении запись архива ждёт сеть
+# Только поля, нужные для очистки и индекса: ответ на страницу из 1000 файлов в разы меньше
+LISTING_FIELDS = ','.join(
+    f"_embedded.items.{field}" for field in ('name', 'type', 'path', 'modified', 'size', 'md5', 'sha256')
+)
+
+# Общий пул соединений и кэш проверок токена и папок (время истечения по time.monotonic)
+_session = None
+_token_valid_until = 0
+_known_folders = {}
+
+async def get_session():
+    """Общая сессия aiohttp с keep-alive для всех запросов к Яндекс.Диску."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=YANDEX_MAX_CONNECTIONS, keepalive_timeout=60, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+        logger.debug(f"Создана сессия Яндекс.Диска, соединений не больше {YANDEX_MAX_CONNECTIONS}")
+    return _session
+
+async def close_session():
+    """Закрытие общей сессии при остановке приложения."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.debug("Сессия Яндекс.Диска закрыта")
+    _session = None
+
+def _auth_headers():
+    """Заголовок авторизации REST API."""
+    return {"Authorization": f"OAuth {YANDEX_DISK_TOKEN}"}
+
+def _invalidate_cache():
+    """Сброс кэша проверок после ответа 401."""
+    global _token_valid_until
+    _token_valid_until = 0
+    _known_folders.clear()
+
+def _check_response(response, folder_path=None):
+    """Сброс устаревших записей кэша по ответу API: 401 — токен, 404 — папка."""
+    if response.status == 401:
+        logger.warning("Яндекс.Диск вернул 401, кэш токена и папок сброшен")
+        _invalidate_cache()
+    elif response.status == 404 and folder_path:
+        _forget_folder(folder_path)
+
+def _forget_folder(folder_path):
+    """Папки больше нет на Диске: сброс кэша и индекса."""
+    _known_folders.pop(folder_path, None)
+    if remote_index.has_folder(folder_path):
+        remote_index.forget_folder(folder_path)
+
+async def _ensure_token(session, headers):
+    """Проверка токена не чаще раза в YANDEX_CACHE_TTL секунд."""
+    global _token_valid_until
+    if time.monotonic() < _token_valid_until:
+        return
+    async with session.get(API_URL, headers=headers, timeout=5) as token_response:
+        if token_response.status != 200:
+            logger.error(f"Невалидный токен Яндекс.Диска: {token_response.status} {await token_response.text()}")
+            _invalidate_cache()
+            raise aiohttp.ClientError(f"Invalid token: {token_response.status}")
+        logger.debug(f"Токен Яндекс.Диска валиден: {token_response.status}")
+    _token_valid_until = time.monotonic() + YANDEX_CACHE_TTL
+
+async def _ensure_folder(session, headers, folder_path):
+    """Создание папки на Яндекс.Диске, если её нет; известные папки не проверяются повторно."""
+    if time.monotonic() < _known_folders.get(folder_path, 0):
+        return
+    if remote_index.has_folder(folder_path):
+        # Папка есть в индексе; если её удалили, загрузка вернёт DiskPathDoesntExistsError
+        _known_folders[folder_path] = time.monotonic() + YANDEX_CACHE_TTL
+        return
+    folder_url = f"{API_URL}/resources?path=disk:{folder_path}"
+    async with session.get(folder_url, headers=headers, timeout=10) as folder_response:
+        _check_response(folder_response)
+        if folder_response.status == 404:
+            async with session.put(folder_url, headers=headers, timeout=10) as create_response:
+                # 409 — папку уже создал параллельный бэкап
+                if create_response.status != 409:
+                    create_response.raise_for_status()
+                    logger.info(f"Создана папка на Яндекс.Диске: {folder_path}")
+        elif folder_response.status != 200:
+            logger.error(f"Ошибка проверки папки {folder_path}: {folder_response.status} {await folder_response.text()}")
+            raise aiohttp.ClientError(f"Folder check failed: {await folder_response.text()}")
+    _known_folders[folder_path] = time.monotonic() + YANDEX_CACHE_TTL
+    remote_index.add_folder(folder_path)
+
+async def _get_upload_href(session, headers, remote_path, folder_path):
+    """URL для загрузки файла; None, если файл уже существует.
+
+    Отдельная проверка существования файла не нужна: с overwrite=false API сам вернёт 409.
+    """
+    upload_url = f"{API_URL}/resources/upload?path=disk:{remote_path}&overwrite=false"
+    for attempt in range(2):
+        async with session.get(upload_url, headers=headers, timeout=10) as upload_response:
+            _check_response(upload_response, folder_path)
+            if upload_response.status == 409:
+                error = (await upload_response.json(content_type=None)).get('error')
+                if error == 'DiskResourceAlreadyExistsError':
+                    return None
+                if error == 'DiskPathDoesntExistsError' and attempt == 0:
+                    # Папку удалили, запись в кэше устарела
+                    _forget_folder(folder_path)
+                    await _ensure_folder(session, headers, folder_path)
+                    continue
+            upload_response.raise_for_status()
+            put_url = (await upload_response.json()).get("href")
+            if not put_url:
+                logger.error("Не удалось получить URL для загрузки от Яндекс.Диска")
+                raise aiohttp.ClientError("No upload URL")
+            return put_url
+
+def _load_remote_chunks():
+    """Множество чанков, которые уже есть на Яндекс.Диске."""
+    if not REMOTE_CHUNKS_FILE.exists():
+        return set()
+    return set(REMOTE_CHUNKS_FILE.read_text().split())
+
+def _save_remote_chunks(chunk_ids):
+    """Перезапись списка загруженных чанков."""
+    REMOTE_CHUNKS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = REMOTE_CHUNKS_FILE.with_suffix('.tmp')
+    tmp_path.write_text(''.join(f"{chunk_id}\n" for chunk_id in sorted(chunk_ids)))
+    os.replace(tmp_path, REMOTE_CHUNKS_FILE)
+
+async def _iter_folder_items(session, headers, folder_path, limit=1000, fields=LISTING_FIELDS):
+    """Постраничный обход содержимого папки на Яндекс.Диске."""
+    offset = 0
+    while True:
+        url = f"{API_URL}/resources?path={folder_path}&limit={limit}&offset={offset}"
+        if fields:
+            url += f"&fields={fields}"
+        async with session.get(url, headers=headers, timeout=30) as response:
+            _check_response(response, folder_path.replace('disk:', ''))
+            if response.status == 404:
+                return
+            response.raise_for_status()
+            data = await response.json()
+        items = data.get('_embedded', {}).get('items', [])
+        for item in items:
+            yield item
+        if len(items) < limit:
+            return
+        offset += limit
+
+async def _upload_chunks(session, headers, manifest_path):
+    """Загрузка на Яндекс.Диск чанков манифеста, которых там ещё нет."""
+    manifest = read_manifest(manifest_path)
+    remote_chunks = _load_remote_chunks()
+    missing = list(dict.fromkeys(chunk_id for chunk_id, _ in manifest['chunks'] if chunk_id not in remote_chunks))
+    if not missing:
+        logger.debug(f"Все чанки {manifest_path.name} уже есть на Яндекс.Диске")
+        return
+    
+    chunks_folder = f"{YANDEX_DISK_BACKUP_FOLDER}/{CHUNKS_FOLDER_NAME}"
+    await _ensure_folder(session, headers, chunks_folder)
+    
+    semaphore = asyncio.Semaphore(CHUNK_UPLOAD_CONCURRENCY)
+    uploaded_bytes = 0
+    
+    async def upload_chunk(chunk_id):
+        nonlocal uploaded_bytes
+        async with semaphore:
+            put_url = await _get_upload_href(session, headers, f"{chunks_folder}/{chunk_id}", chunks_folder)
+            if put_url is None:
+                # Чанк уже загружен другим бэкапом
+                remote_chunks.add(chunk_id)
+                return
+            async with session.put(put_url, data=iter_file(chunk_path(chunk_id), upload_limiter), timeout=600) as put_response:
+                put_response.raise_for_status()
+            uploaded_bytes += chunk_path(chunk_id).stat().st_size
+            remote_chunks.add(chunk_id)
+    
+    try:
+        await asyncio.gather(*(upload_chunk(chunk_id) for chunk_id in missing))
+    finally:
+        _save_remote_chunks(remote_chunks)
+    logger.info(f"Загружено чанков на Яндекс.Диск для {manifest_path.name}: {len(missing)}, {uploaded_bytes / 1_048_576:.2f} МБ")
+
+async def _download_json(session, headers, remote_path):
+    """Скачивание небольшого JSON-файла (манифеста) с Яндекс.Диска."""
+    download_url = f"{API_URL}/resources/download?path={remote_path}"
+    async with session.get(download_url, headers=headers, timeout=10) as response:
+        response.raise_for_status()
+        href = (await response.json())['href']
+    body = bytearray()
+    async with session.get(href, timeout=300) as response:
+        response.raise_for_status()
+        async for block in response.content.iter_chunked(64 * 1024):
+            await download_limiter.acquire(len(block))
+            body += block
+    return json.loads(body)
+
+def _modified_at(item):
+    """Время изменения ресурса из ответа API."""
+    return datetime.fromisoformat(item['modified'].replace('Z', '+00:00'))
+
+async def _delete_items(session, headers, items):
+    """Удаление ресурсов с ограниченной параллельностью, возвращает успешно удалённые."""
+    semaphore = asyncio.Semaphore(YANDEX_DELETE_CONCURRENCY)
+    deleted = []
+
+    async def delete(item):
+        async with semaphore:
+            delete_url = f"{API_URL}/resources?path={item['path']}&permanently=true"
+            try:
+                async with session.delete(delete_url, headers=headers, timeout=30) as delete_response:
+                    _check_response(delete_response)
+                    # 404 — файл уже удалён, место всё равно освобождено
+                    if delete_response.status != 404:
+                        delete_response.raise_for_status()
+            except Exception as e:
+                logger.error(f"Не удалось удалить {item['path']} на Яндекс.Диске: {e}")
+                return
+            deleted.append(item)
+            logger.debug(f"Удалён на Яндекс.Диске: {item['path']}")
+
+    await asyncio.gather(*(delete(item) for item in items))
+    return deleted
+
+async def _cleanup_remote_chunks(session, headers, remote_manifests, threshold):
+    """Удаление старых чанков, на которые не ссылается ни один манифест (локальный или на Диске)."""
+    referenced = referenced_chunks(DUMPS_DIR.glob(f'*/*{MANIFEST_SUFFIX}'))
+    for remote_path, db_name, name in remote_manifests:
+        if (DUMPS_DIR / db_name / name).exists():
+            continue
+        manifest = await _download_json(session, headers, remote_path)
+        referenced.update(chunk_id for chunk_id, _ in manifest['chunks'])
+    
+    chunks_folder = f"disk:{YANDEX_DISK_BACKUP_FOLDER}/{CHUNKS_FOLDER_NAME}"
+    # Сначала полный список, затем удаление: удаление во время обхода сдвигает страницы
+    candidates = [
+        item async for item in _iter_folder_items(session, headers, chunks_folder)
+        if item['type'] == 'file' and item['name'] not in referenced and _modified_at(item) < threshold
+    ]
+    deleted = await _delete_items(session, headers, candidates)
+    remote_chunks = _load_remote_chunks()
+    remote_chunks.difference_update(item['name'] for item in deleted)
+    _save_remote_chunks(remote_chunks)
+    logger.info(f"Удалено неиспользуемых чанков на Яндекс.Диске: {len(deleted)}")
+    return deleted
+
+async def _prepare_upload(session, zip_file, db_name):
+    """Проверки перед загрузкой архива: (путь на Диске, URL загрузки или None, если файл уже есть)."""
+    headers = _auth_headers()
+    await _ensure_token(session, headers)
+    await _ensure_folder(session, headers, YANDEX_DISK_BACKUP_FOLDER)
+    db_folder_path = f"{YANDEX_DISK_BACKUP_FOLDER}/{db_name}"
+    await _ensure_folder(session, headers, db_folder_path)
+    
+    if zip_file.suffix == MANIFEST_SUFFIX:
+        # Дедуплицированный бэкап: сначала новые чанки, затем сам манифест
+        await _upload_chunks(session, headers, zip_file)
+    
+    remote_path = f"{db_folder_path}/{zip_file.name}"
+    return remote_path, await _get_upload_href(session, headers, remote_path, db_folder_path)
+
+class ChecksumMismatchError(Exception):
+    """Контрольные суммы файла на Диске не совпали с локальным архивом."""
+
+async def _verify_upload(session, remote_path, archive_file):
+    """Сверка md5/sha256 файла на Диске с суммами, посчитанными при записи архива.
+
+    True — суммы совпали, False — не совпали (отправляется уведомление), None — сверить не с чем.
+    """
+    checksums = load_checksums(archive_file)
+    if not checksums:
+        logger.debug(f"Нет контрольных сумм {archive_file.name}, проверка загрузки пропущена")
+        return None
+    url = f"{API_URL}/resources?path=disk:{remote_path}&fields=md5,sha256,size"
+    for _ in range(VERIFY_ATTEMPTS):
+        async with session.get(url, headers=_auth_headers(), timeout=10) as response:
+            _check_response(response)
+            response.raise_for_status()
+            meta = await response.json()
+        if meta.get('md5') or meta.get('sha256'):
+            break
+        await asyncio.sleep(VERIFY_DELAY)
+    else:
+        logger.warning(f"Яндекс.Диск не вернул контрольные суммы {remote_path}, проверка пропущена")
+        return None
+    mismatched = [
+        field for field in ('sha256', 'md5', 'size')
+        if meta.get(field) is not None and meta[field] != checksums[field]
+    ]
+    if not mismatched:
+        logger.info(f"Копия {remote_path} на Яндекс.Диске проверена: sha256 {checksums['sha256']}")
+        return True
+    logger.error(f"Копия {remote_path} на Яндекс.Диске не совпадает с {archive_file}: {', '.join(mismatched)}")
+    await send_telegram_notification(
+        f"⚠️ Копия {archive_file.name} на Яндекс.Диске не совпала с локальным архивом ({', '.join(mismatched)}), "
+        f"файл будет загружен повторно"
+    )
+    return False
+
+def _record_upload(remote_path, archive_file):
+    """Запись загруженного архива в индекс вместе с контрольными суммами."""
+    checksums = load_checksums(archive_file) or {}
+    remote_index.record(
+        remote_path, os.path.getsize(archive_file), md5=checksums.get('md5'), sha256=checksums.get('sha256')
+    )
+
+async def _delete_remote(remote_path):
+    """Удаление неполного файла на Диске (404 — файл не успел появиться)."""
+    deleted = await _delete_items(await get_session(), _auth_headers(), [{'path': f"disk:{remote_path}"}])
+    if deleted:
+        logger.info(f"Удалён неполный файл на Яндекс.Диске: {remote_path}")
+    remote_index.remove([remote_path])
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(10), retry=retry_if_exception_type(aiohttp.ClientError))
 async def upload_to_yandex_disk_rest(zip_file, db_name):
     """Загрузка ZIP-файла на Яндекс.Диск через REST API с aiohttp."""
@@ -16,120 +347,288 @@ async def upload_to_yandex_disk_rest(zip_file, db_name):
     file_size = os.path.getsize(zip_file) / 1_048_576  # Размер в МБ
     logger.debug(f"Начало загрузки {zip_file} на Яндекс.Диск: {start_time}, размер: {file_size:.2f} МБ")
     
-    async with aiohttp.ClientSession() as session:
-        try:
-            headers = {"Authorization": f"OAuth {YANDEX_DISK_TOKEN}"}
-            
-            # Проверка токена
-            async with session.get("https://cloud-api.yandex.net/v1/disk", headers=headers, timeout=5) as token_response:
-                if token_response.status != 200:
-                    logger.error(f"Невалидный токен Яндекс.Диска: {token_response.status} {await token_response.text()}")
-                    raise aiohttp.ClientError(f"Invalid token: {token_response.status}")
-                logger.debug(f"Токен Яндекс.Диска валиден: {token_response.status}")
+    if remote_index.get(remote_archive_path(db_name, zip_file.name)):
+        logger.warning(f"Файл {zip_file.name} уже есть на Яндекс.Диске (по индексу), пропускаем загрузку")
+        return False
+    
+    session = await get_session()
+    try:
+        for attempt in range(2):
+            remote_path, put_url = await _prepare_upload(session, zip_file, db_name)
+            if put_url is None:
+                logger.warning(f"Файл {remote_path} уже существует на Яндекс.Диске, пропускаем загрузку")
+                return False
             
-            # Проверка сети
+            async with session.put(put_url, data=iter_file(zip_file, upload_limiter), timeout=600) as put_response:
+                put_response.raise_for_status()
+            if await _verify_upload(session, remote_path, zip_file) is not False:
+                break
+            # Повреждённая копия удаляется, иначе повторная загрузка получит 409
+            await _delete_remote(remote_path)
+        else:
+            logger.error(f"Не удалось получить проверенную копию {zip_file} на Яндекс.Диске")
+            return False
+        _record_upload(remote_path, zip_file)
+        
+        end_time = datetime.now(timezone.utc)
+        duration = (end_time - start_time).total_seconds()
+        logger.info(f"Загружен файл {zip_file} на Яндекс.Диск: {remote_path}, размер: {file_size:.2f} МБ, время: {duration:.2f} сек")
+        return True
+    except aiohttp.ClientError as e:
+        logger.error(f"Сетевая ошибка при загрузке {zip_file} на Яндекс.Диск: {e}\n{traceback.format_exc()}")
+        return False
+    except Exception as e:
+        logger.error(f"Не удалось загрузить {zip_file} на Яндекс.Диск: {e}\n{traceback.format_exc()}")
+        return False
+
+class _UploadTee:
+    """Файл архива, который одновременно пишется на диск и передаётся в загрузку.
+
+    Поток не поддерживает seek, поэтому zipfile пишет архив последовательно. Если загрузка
+    прервана (failed), архив дописывается только на диск.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'wb')
+        self._queue = queue.Queue(maxsize=PIPELINE_MAX_PENDING)
+        self._buffer = bytearray()
+        self._size = 0
+        self.failed = False
+
+    def _put(self, item):
+        while not self.failed:
             try:
-                async with session.get("https://cloud-api.yandex.net/ping", timeout=5) as ping_response:
-                    logger.debug(f"Пинг до Яндекс.Диска: {ping_response.status}")
-            except Exception as ping_err:
-                logger.warning(f"Не удалось проверить пинг до Яндекс.Диска: {ping_err}")
-            
-            folder_url = f"https://cloud-api.yandex.net/v1/disk/resources?path=disk:{YANDEX_DISK_BACKUP_FOLDER}"
-            async with session.get(folder_url, headers=headers, timeout=10) as folder_response:
-                if folder_response.status == 404:
-                    create_folder_url = f"https://cloud-api.yandex.net/v1/disk/resources?path=disk:{YANDEX_DISK_BACKUP_FOLDER}"
-                    async with session.put(create_folder_url, headers=headers, timeout=10) as create_response:
-                        create_response.raise_for_status()
-                        logger.info(f"Создана корневая папка на Яндекс.Диске: {YANDEX_DISK_BACKUP_FOLDER}")
-                elif folder_response.status != 200:
-                    logger.error(f"Ошибка проверки корневой папки: {folder_response.status} {await folder_response.text()}")
-                    raise aiohttp.ClientError(f"Root folder check failed: {await folder_response.text()}")
-            
-            db_folder_path = f"{YANDEX_DISK_BACKUP_FOLDER}/{db_name}"
-            db_folder_url = f"https://cloud-api.yandex.net/v1/disk/resources?path=disk:{db_folder_path}"
-            async with session.get(db_folder_url, headers=headers, timeout=10) as db_folder_response:
-                if db_folder_response.status == 404:
-                    create_db_folder_url = f"https://cloud-api.yandex.net/v1/disk/resources?path=disk:{db_folder_path}"
-                    async with session.put(create_db_folder_url, headers=headers, timeout=10) as create_db_response:
-                        create_db_response.raise_for_status()
-                        logger.info(f"Создана папка базы данных на Яндекс.Диске: {db_folder_path}")
-                elif db_folder_response.status != 200:
-                    logger.error(f"Ошибка проверки папки базы данных: {db_folder_response.status} {await db_folder_response.text()}")
-                    raise aiohttp.ClientError(f"DB folder check failed: {await db_folder_response.text()}")
-            
-            remote_path = f"{db_folder_path}/{zip_file.name}"
-            file_check_url = f"https://cloud-api.yandex.net/v1/disk/resources?path=disk:{remote_path}"
-            async with session.get(file_check_url, headers=headers, timeout=10) as file_check_response:
-                if file_check_response.status == 200:
-                    logger.warning(f"Файл {remote_path} уже существует на Яндекс.Диске, пропускаем загрузку")
-                    return False
-            
-            upload_url = f"https://cloud-api.yandex.net/v1/disk/resources/upload?path=disk:{remote_path}&overwrite=false"
-            async with session.get(upload_url, headers=headers, timeout=10) as upload_response:
-                upload_response.raise_for_status()
-                upload_data = await upload_response.json()
-                put_url = upload_data.get("href")
-                if not put_url:
-                    logger.error("Не удалось получить URL для загрузки от Яндекс.Диска")
-                    raise aiohttp.ClientError("No upload URL")
-            
-            with open(zip_file, 'rb') as f:
-                async with session.put(put_url, data=f, chunked=True, timeout=600) as put_response:
-                    put_response.raise_for_status()
-            
-            end_time = datetime.now(timezone.utc)
-            duration = (end_time - start_time).total_seconds()
-            logger.info(f"Загружен файл {zip_file} на Яндекс.Диск: {remote_path}, размер: {file_size:.2f} МБ, время: {duration:.2f} сек")
-            return True
-        except aiohttp.ClientError as e:
-            logger.error(f"Сетевая ошибка при загрузке {zip_file} на Яндекс.Диск: {e}\n{traceback.format_exc()}")
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self._file.write(data)
+        self._size += len(data)
+        self._buffer += data
+        if len(self._buffer) >= PIPELINE_BLOCK_SIZE:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def tell(self):
+        return self._size
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        self._put(None)
+
+    async def blocks(self):
+        """Тело запроса PUT: блоки архива по мере записи."""
+        while True:
+            try:
+                block = await asyncio.to_thread(self._queue.get, True, 1)
+            except queue.Empty:
+                continue
+            if block is None:
+                return
+            await upload_limiter.acquire(len(block))
+            yield block
+
+class PipelinedUpload:
+    """Загрузка архива на Яндекс.Диск одновременно с дампом.
+
+    Архив пишется через tee: на диск и в открытый PUT по ссылке загрузки, поэтому бэкап
+    занимает примерно max(дамп, загрузка), а не их сумму. finish() дожидается загрузки
+    (при сбое сети — обычная загрузка готового файла), abort() удаляет неполный файл на Диске.
+    """
+
+    def __init__(self, archive_file, db_name, remote_path, put_url):
+        self.archive_file = archive_file
+        self.db_name = db_name
+        self.remote_path = remote_path
+        self.tee = _UploadTee(archive_file)
+        self._started = time.monotonic()
+        self._done = False
+        self._task = asyncio.create_task(self._upload(put_url))
+
+    async def _upload(self, put_url):
+        session = await get_session()
+        try:
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=600)
+            async with session.put(put_url, data=self.tee.blocks(), timeout=timeout) as put_response:
+                put_response.raise_for_status()
+        except BaseException:
+            # Запись архива не должна ждать очередь, которую больше никто не читает
+            self.tee.failed = True
+            raise
+
+    async def finish(self, fallback=True):
+        """Завершение загрузки после успешного дампа; True, если архив на Диске.
+
+        fallback=False — при сбое готовый архив не загружается повторно здесь (его загрузит очередь).
+        """
+        if self._done:
             return False
+        self._done = True
+        try:
+            await self._task
+            if await _verify_upload(await get_session(), self.remote_path, self.archive_file) is False:
+                raise ChecksumMismatchError(self.remote_path)
         except Exception as e:
-            logger.error(f"Не удалось загрузить {zip_file} на Яндекс.Диск: {e}\n{traceback.format_exc()}")
-            return False
+            logger.error(f"Ошибка загрузки {self.archive_file.name} во время дампа: {e}, повторная загрузка готового архива")
+            await _delete_remote(self.remote_path)
+            if not fallback:
+                return False
+            return await upload_to_yandex_disk_rest(self.archive_file, self.db_name)
+        _record_upload(self.remote_path, self.archive_file)
+        size = os.path.getsize(self.archive_file)
+        duration = time.monotonic() - self._started
+        logger.info(
+            f"Загружен файл {self.archive_file} на Яндекс.Диск во время дампа: {self.remote_path}, "
+            f"размер: {size / 1_048_576:.2f} МБ, время дампа и загрузки: {duration:.2f} сек"
+        )
+        return True
+
+    async def abort(self):
+        """Отмена загрузки после неудачного дампа и удаление неполного файла на Диске."""
+        if self._done:
+            return
+        self._done = True
+        self.tee.failed = True
+        await asyncio.to_thread(self.tee.close)
+        if not self._task.done():
+            self._task.cancel()
+        try:
+            await self._task
+        except BaseException:
+            pass
+        await _delete_remote(self.remote_path)
+
+async def start_pipelined_upload(archive_file, db_name, codec):
+    """Подготовка загрузки во время дампа; None — архив будет загружен после дампа как обычно."""
+    if not YANDEX_DISK_TOKEN or not YANDEX_DISK_BACKUP_FOLDER:
+        return None
+    if codec not in PIPELINED_CODECS:
+        logger.debug(f"Кодек {codec} не поддерживает загрузку во время дампа, {archive_file.name} будет загружен после")
+        return None
+    if remote_index.get(remote_archive_path(db_name, archive_file.name)):
+        return None
+    try:
+        remote_path, put_url = await _prepare_upload(await get_session(), archive_file, db_name)
+    except aiohttp.ClientError as e:
+        logger.warning(f"Не удалось подготовить загрузку {archive_file.name} во время дампа: {e}")
+        return None
+    if put_url is None:
+        return None
+    logger.debug(f"Архив {archive_file.name} загружается на Яндекс.Диск во время дампа")
+    return PipelinedUpload(archive_file, db_name, remote_path, put_url)
+
+class YandexDiskBackend(StorageBackend):
+    """Яндекс.Диск как одно из хранилищ при загрузке архива за одно чтение."""
+
+    name = 'yandex'
+    limiter = upload_limiter
+
+    async def prepare(self, archive_file, db_name):
+        if remote_index.get(remote_archive_path(db_name, archive_file.name)):
+            logger.warning(f"Файл {archive_file.name} уже есть на Яндекс.Диске (по индексу), пропускаем загрузку")
+            return None
+        remote_path, put_url = await _prepare_upload(await get_session(), archive_file, db_name)
+        if put_url is None:
+            logger.warning(f"Файл {remote_path} уже существует на Яндекс.Диске, пропускаем загрузку")
+            return None
+        return {'path': remote_path, 'href': put_url, 'archive': archive_file}
+
+    async def send(self, target, blocks):
+        session = await get_session()
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=600)
+        async with session.put(target['href'], data=blocks, timeout=timeout) as put_response:
+            put_response.raise_for_status()
+        # Суммы архива к этому моменту сохранены: конец потока отдаётся после подсчёта
+        verified = await _verify_upload(session, target['path'], target['archive'])
+        if verified is False:
+            raise ChecksumMismatchError(target['path'])
+        _record_upload(target['path'], target['archive'])
+        return {'path': target['path'], 'verified': verified}
+
+    async def abort(self, target):
+        await _delete_remote(target['path'])
+
+async def reconcile_remote_index(session=None, headers=None):
+    """Сверка локального индекса с полным списком бэкапов на Яндекс.Диске."""
+    session = session or await get_session()
+    headers = headers or _auth_headers()
+    root_folder = f"disk:{YANDEX_DISK_BACKUP_FOLDER}"
+    folders = [YANDEX_DISK_BACKUP_FOLDER]
+    files = {}
+    async for folder in _iter_folder_items(session, headers, root_folder):
+        if folder['type'] != 'dir' or folder['name'] == CHUNKS_FOLDER_NAME:
+            continue
+        folders.append(folder['path'])
+        async for item in _iter_folder_items(session, headers, folder['path']):
+            if item['type'] == 'file':
+                files[item['path']] = {
+                    'size': item.get('size'),
+                    'modified': item['modified'],
+                    'md5': item.get('md5'),
+                    'sha256': item.get('sha256')
+                }
+    remote_index.replace(files, folders)
 
 async def cleanup_yandex_disk_backups():
-    """Ежедневная очистка бэкапов старше 31 дня на Яндекс.Диске."""
+    """Ежедневная очистка бэкапов старше BACKUP_RETENTION_DAYS дней на Яндекс.Диске.
+
+    Возвращает отчёт: сколько файлов удалено и сколько байт освобождено.
+    """
+    report = {'files': 0, 'bytes': 0, 'chunks': 0, 'failed': 0}
     if not YANDEX_DISK_TOKEN or not YANDEX_DISK_BACKUP_FOLDER:
         logger.debug("Очистка Яндекс.Диска отключена (отсутствует YANDEX_DISK_TOKEN или YANDEX_DISK_BACKUP_FOLDER)")
-        return
+        return report
     
-    async with aiohttp.ClientSession() as session:
+    session = await get_session()
+    try:
+        headers = _auth_headers()
+        threshold = datetime.now(timezone.utc) - timedelta(days=BACKUP_RETENTION_DAYS)
+        # Перед удалением чанков индекс сверяется всегда: между сверками в нём может не быть манифеста,
+        # загруженного с другого хоста или перед аварийной остановкой (индекс пишется с задержкой),
+        # и его общие старые чанки были бы удалены безвозвратно. Без сверки очистка не выполняется
+        await reconcile_remote_index(session, headers)
+        
+        expired = []
+        remote_manifests = []
+        for entry in remote_index.files():
+            if _modified_at(entry) < threshold:
+                expired.append(entry)
+            elif entry['path'].endswith(MANIFEST_SUFFIX):
+                db_name, name = entry['path'].rsplit('/', 2)[-2:]
+                remote_manifests.append((entry['path'], db_name, name))
+        
+        logger.info(f"Найдено бэкапов старше {BACKUP_RETENTION_DAYS} дней на Яндекс.Диске: {len(expired)}")
+        deleted = await _delete_items(session, headers, expired)
+        remote_index.remove(item['path'] for item in deleted)
+        report['files'] = len(deleted)
+        report['bytes'] = sum(item.get('size', 0) for item in deleted)
+        report['failed'] = len(expired) - len(deleted)
+        
+        # Живые манифесты взяты из только что сверенного полного списка файлов на Диске
         try:
-            headers = {"Authorization": f"OAuth {YANDEX_DISK_TOKEN}"}
-            threshold = datetime.now(timezone.utc) - timedelta(days=31)
-            
-            folder_url = f"https://cloud-api.yandex.net/v1/disk/resources?path=disk:{YANDEX_DISK_BACKUP_FOLDER}&limit=1000"
-            async with session.get(folder_url, headers=headers, timeout=10) as folder_response:
-                folder_response.raise_for_status()
-                folder_data = await folder_response.json()
-            
-            for item in folder_data.get('_embedded', {}).get('items', []):
-                if item['type'] != 'dir':
-                    continue
-                db_folder_path = item['path'].replace('disk:', '')
-                
-                files_url = f"https://cloud-api.yandex.net/v1/disk/resources?path={db_folder_path}&limit=1000"
-                async with session.get(files_url, headers=headers, timeout=10) as files_response:
-                    files_response.raise_for_status()
-                    files_data = await files_response.json()
-                
-                for file_item in files_data.get('_embedded', {}).get('items', []):
-                    if file_item['type'] != 'file':
-                        continue
-                    modified_str = file_item['modified']
-                    modified_time = datetime.fromisoformat(modified_str.replace('Z', '+00:00'))
-                    if modified_time < threshold:
-                        try:
-                            delete_url = f"https://cloud-api.yandex.net/v1/disk/resources?path={file_item['path']}&permanently=true"
-                            async with session.delete(delete_url, headers=headers, timeout=10) as delete_response:
-                                delete_response.raise_for_status()
-                                logger.info(f"Удалён старый бэкап на Яндекс.Диске: {file_item['path']}")
-                        except Exception as e:
-                            logger.error(f"Не удалось удалить {file_item['path']} на Яндекс.Диске: {e}")
-            
-            logger.info("Очистка старых бэкапов на Яндекс.Диске завершена")
-        except aiohttp.ClientError as e:
-            logger.error(f"Ошибка очистки бэкапов на Яндекс.Диске: {e}")
+            deleted_chunks = await _cleanup_remote_chunks(session, headers, remote_manifests, threshold)
+            report['chunks'] = len(deleted_chunks)
+            report['bytes'] += sum(item.get('size', 0) for item in deleted_chunks)
         except Exception as e:
-            logger.error(f"Неожиданная ошибка при очистке Яндекс.Диска: {e}")
+            logger.error(f"Ошибка очистки чанков на Яндекс.Диске: {e}")
+        
+        logger.info(
+            f"Очистка старых бэкапов на Яндекс.Диске завершена: удалено файлов {report['files']}, "
+            f"чанков {report['chunks']}, освобождено {report['bytes'] / 1_048_576:.2f} МБ, ошибок {report['failed']}"
+        )
+    except aiohttp.ClientError as e:
+        logger.error(f"Ошибка очистки бэкапов на Яндекс.Диске: {e}")
+    except Exception as e:
+        logger.error(f"Неожиданная ошибка при очистке Яндекс.Диска: {e}")
+    return report
@@ -0,0 +1,95 @@
+import pytest
+from deploy.native import SqlSplitter
+
+# Размеры блоков от 1 байта до чуть больше SPLIT_LOOKAHEAD: токены и кавычки попадают на границы блоков
+BLOCK_SIZES = list(range(1, 70)) + [1024 * 1024]
+
+PG_DUMP = rb"""--
+-- PostgreSQL database dump
+--
+SET statement_timeout = 0;
+\connect shop
+/* outer /* nested; */ still a comment; */
+CREATE FUNCTION touch() RETURNS trigger AS $body$
+BEGIN
+    RAISE NOTICE 'a;b';
+    RETURN NEW;
+END;
+$body$ LANGUAGE plpgsql;
+CREATE FUNCTION semi() RETURNS text AS $$ SELECT ';' $$ LANGUAGE sql;
+INSERT INTO t VALUES (E'it\'s; here', 'dou''bled;', "col;name");
+SELECT x$y$z FROM t; -- no $-quote inside an identifier;
+COPY public.t (id, name) FROM stdin;
+1	semi;colon
+2	-- not a comment
+\.
+SELECT 1;
+"""
+
+PG_STATEMENTS = [
+    (b"SET statement_timeout = 0", 4, None),
+    (b"CREATE FUNCTION touch() RETURNS trigger AS $body$\nBEGIN\n    RAISE NOTICE 'a;b';\n"
+     b"    RETURN NEW;\nEND;\n$body$ LANGUAGE plpgsql", 7, None),
+    (b"CREATE FUNCTION semi() RETURNS text AS $$ SELECT ';' $$ LANGUAGE sql", 13, None),
+    (rb"""INSERT INTO t VALUES (E'it\'s; here', 'dou''bled;', "col;name")""", 14, None),
+    (b"SELECT x$y$z FROM t", 15, None),
+    (b"COPY public.t (id, name) FROM stdin", 16, b"1\tsemi;colon\n2\t-- not a comment\n"),
+    (b"SELECT 1", 20, None),
+]
+
+MYSQL_DUMP = rb"""-- MySQL dump 10.13
+/*!40101 SET NAMES utf8mb4 */;
+/* plain comment; with delimiter */
+INSERT INTO `t;x` VALUES (1,'a\';b',"q"";"),(2,'it''s;',NULL);
+SELECT 5--2;
+# hash comment;
+DELIMITER ;;
+/*!50003 CREATE*/ /*!50017 DEFINER=`root`@`%`*/ /*!50003 TRIGGER trg BEFORE INSERT ON t FOR EACH ROW BEGIN
+  SET NEW.a = 1;
+  SET NEW.b = ';;';
+END */;;
+DELIMITER ;
+SELECT 'done'
+"""
+
+MYSQL_STATEMENTS = [
+    (b"/*!40101 SET NAMES utf8mb4 */", 2, None),
+    (rb"""INSERT INTO `t;x` VALUES (1,'a\';b',"q"";"),(2,'it''s;',NULL)""", 4, None),
+    (b"SELECT 5--2", 5, None),
+    (b"/*!50003 CREATE*/ /*!50017 DEFINER=`root`@`%`*/ /*!50003 TRIGGER trg BEFORE INSERT ON t FOR EACH ROW BEGIN\n"
+     b"  SET NEW.a = 1;\n  SET NEW.b = ';;';\nEND */", 8, None),
+    (b"SELECT 'done'", 13, None),
+]
+
+def _split(data, dialect, block_size):
+    """Операторы дампа, прочитанного блоками block_size, с дочитанными данными COPY."""
+    blocks = iter([data[i:i + block_size] for i in range(0, len(data), block_size)])
+    statements = []
+    for statement, line, copy_data in SqlSplitter(lambda: next(blocks, b''), dialect):
+        rows = None
+        if copy_data is not None:
+            rows = b''
+            while chunk := copy_data.read(7):
+                rows += chunk
+        statements.append((statement, line, rows))
+    return statements
+
+@pytest.mark.parametrize('block_size', BLOCK_SIZES)
+def test_postgres_dump(block_size):
+    assert _split(PG_DUMP, 'postgres', block_size) == PG_STATEMENTS
+
+@pytest.mark.parametrize('block_size', BLOCK_SIZES)
+def test_mysql_dump(block_size):
+    assert _split(MYSQL_DUMP, 'mysql', block_size) == MYSQL_STATEMENTS
+
+@pytest.mark.parametrize('block_size', BLOCK_SIZES)
+def test_unread_copy_data_is_skipped(block_size):
+    data = b"COPY t (a) FROM stdin;\n1\n2\n\\.\nSELECT 2;\n"
+    blocks = iter([data[i:i + block_size] for i in range(0, len(data), block_size)])
+    statements = [statement for statement, _, _ in SqlSplitter(lambda: next(blocks, b''), 'postgres')]
+    assert statements == [b"COPY t (a) FROM stdin", b"SELECT 2"]
+
+def test_postgres_double_dash_is_always_a_comment():
+    data = b"SELECT 5--2;\n;\n"
+    blocks = iter([data])
+    assert [statement for statement, _, _ in SqlSplitter(lambda: next(blocks, b''), 'postgres')] == [b"SELECT 5--2;"]